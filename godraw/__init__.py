@@ -0,0 +1,4 @@
+"""GUI-free core of the GoDraw sprite editor."""
+from .document import Document, IndexedLayer, Layer, Palette, parse_color, to_hex, to_image
+from .frames import FrameStore
+from .project import Project, load_project, save_project
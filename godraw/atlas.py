@@ -0,0 +1,171 @@
+"""Pack frames and layers into a texture atlas with metadata for game engines.
+
+Sprites are trimmed to their visible pixels, identical sprites are stored
+once, and the rest are placed with a skyline bottom-left packer, which
+stays fast for thousands of sprites. The metadata is written as JSON in
+the common "hash" layout (frame rect, trim offset and source size per
+sprite) and, on request, as a Godot SpriteFrames resource.
+"""
+import json
+import math
+import os
+
+import numpy as np
+
+from .document import mask_bbox
+from .export import layer_path, write_png
+from .frames import frame_key
+
+
+def trim(pixels):
+    """(rect, cropped pixels) of the visible part of an RGBA buffer; a transparent one keeps one pixel."""
+    rect = mask_bbox(pixels[..., 3] > 0) or (0, 0, 1, 1)
+    x0, y0, x1, y1 = rect
+    return rect, pixels[y0:y1, x0:x1]
+
+
+def skyline_pack(sizes, width):
+    """Bottom-left positions for (w, h) sizes in an atlas `width` wide; returns (positions, height).
+
+    The skyline is a list of [x, y, w] segments along the top of what has
+    been placed. Each rectangle goes where its top edge ends lowest,
+    leftmost on ties.
+    """
+    skyline = [[0, 0, width]]
+    positions = [None] * len(sizes)
+    # Tall rectangles first leave fewer gaps under the skyline
+    for index in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        w, h = sizes[index]
+        best = None
+        for start, (x, _, _) in enumerate(skyline):
+            if x + w > width:
+                break
+            # The rectangle rests on the highest segment under its span
+            y, end, covered = 0, start, 0
+            while covered < w:
+                y = max(y, skyline[end][1])
+                covered += skyline[end][2]
+                end += 1
+            if best is None or (y + h, x) < (best[1] + h, best[0]):
+                best = (x, y, start)
+        if best is None:
+            raise ValueError(f"a {w}x{h} sprite does not fit in an atlas {width} pixels wide")
+        x, y, start = best
+        positions[index] = (x, y)
+        # Replace the covered segments with the rectangle's top edge
+        end, right = start, x + w
+        while end < len(skyline) and skyline[end][0] + skyline[end][2] <= right:
+            end += 1
+        tail = []
+        if end < len(skyline) and skyline[end][0] < right:
+            sx, sy, sw = skyline[end]
+            tail = [[right, sy, sx + sw - right]]
+            end += 1
+        skyline[start:end] = [[x, y + h, w]] + tail
+        # Merge neighbours at the same height so the skyline stays short
+        merged = [skyline[0]]
+        for segment in skyline[1:]:
+            if segment[1] == merged[-1][1]:
+                merged[-1][2] += segment[2]
+            else:
+                merged.append(segment)
+        skyline = merged
+    height = max((y + sizes[i][1] for i, (_, y) in enumerate(positions)), default=0)
+    return positions, height
+
+
+def build_atlas(sprites, padding=1, trim_sprites=True, width=None):
+    """Pack (name, pixels) sprites; returns (atlas pixels, metadata entries in sprite order).
+
+    Each entry has the sprite's name, its rect in the atlas, where that
+    rect sits inside the untrimmed sprite and the sprite's full size.
+    Sprites with identical pixels point at the same rect.
+    """
+    unique, entries, keys = [], [], {}
+    for name, pixels in sprites:
+        (x0, y0, x1, y1), cropped = trim(pixels) if trim_sprites else ((0, 0) + pixels.shape[1::-1], pixels)
+        key = frame_key(cropped)
+        if key not in keys:
+            keys[key] = len(unique)
+            unique.append(cropped)
+        entries.append({"name": name, "slot": keys[key], "offset": (x0, y0), "size": (x1 - x0, y1 - y0),
+                        "source": pixels.shape[1::-1]})
+
+    sizes = [(p.shape[1] + padding, p.shape[0] + padding) for p in unique]
+    if width is None:
+        area = sum(w * h for w, h in sizes)
+        width = max(max(w for w, _ in sizes), math.ceil(math.sqrt(area * 1.1)))
+    positions, height = skyline_pack(sizes, width)
+    used_width = max(x + w for (x, _), (w, _) in zip(positions, sizes))
+    atlas = np.zeros((max(height - padding, 1), max(used_width - padding, 1), 4), np.uint8)  # No padding past the edge
+    for (x, y), pixels in zip(positions, unique):
+        atlas[y:y + pixels.shape[0], x:x + pixels.shape[1]] = pixels
+    for entry in entries:
+        entry["position"] = positions[entry.pop("slot")]
+    return atlas, entries
+
+
+def atlas_json(entries, image, size, scale=1, durations=None):
+    """Metadata in the JSON "hash" layout most engines and sprite tools read."""
+    frames = {}
+    for index, entry in enumerate(entries):
+        (x, y), (w, h), (ox, oy), (sw, sh) = entry["position"], entry["size"], entry["offset"], entry["source"]
+        frame = {
+            "frame": {"x": x * scale, "y": y * scale, "w": w * scale, "h": h * scale},
+            "rotated": False,
+            "trimmed": (w, h) != (sw, sh),
+            "spriteSourceSize": {"x": ox * scale, "y": oy * scale, "w": w * scale, "h": h * scale},
+            "sourceSize": {"w": sw * scale, "h": sh * scale},
+        }
+        if durations is not None and index < len(durations):
+            frame["duration"] = durations[index]
+        frames[entry["name"]] = frame
+    return {"frames": frames, "meta": {"app": "GoDraw", "image": image, "format": "RGBA8888",
+                                       "size": {"w": size[0] * scale, "h": size[1] * scale}, "scale": scale}}
+
+
+def godot_sprite_frames(entries, image, durations, scale=1, name="default"):
+    """A Godot 4 SpriteFrames resource (.tres) playing the entries as one looping animation."""
+    base = min(durations)
+    lines = [f'[gd_resource type="SpriteFrames" load_steps={len(entries) + 2} format=3]', "",
+             f'[ext_resource type="Texture2D" path="res://{image}" id="1"]', ""]
+    frames = []
+    for index, entry in enumerate(entries):
+        (x, y), (w, h), (ox, oy), (sw, sh) = entry["position"], entry["size"], entry["offset"], entry["source"]
+        lines += [f'[sub_resource type="AtlasTexture" id="AtlasTexture_{index}"]', 'atlas = ExtResource("1")',
+                  f"region = Rect2({x * scale}, {y * scale}, {w * scale}, {h * scale})",
+                  # The margin puts the trimmed region back at its place in the full frame
+                  f"margin = Rect2({ox * scale}, {oy * scale}, {(sw - w) * scale}, {(sh - h) * scale})", ""]
+        frames.append(f'{{"duration": {durations[index] / base:g}, "texture": SubResource("AtlasTexture_{index}")}}')
+    lines += ["[resource]", "animations = [{", f'"frames": [{", ".join(frames)}],', '"loop": true,',
+              f'"name": &"{name}",', f'"speed": {1000 / base:g}', "}]", ""]
+    return "\n".join(lines)
+
+
+def export_atlas(project, path, scale=1, layers=False, padding=1, trim_sprites=True, godot=False,
+                 compress_level=9):
+    """Save the frames (and optionally every layer) as an atlas PNG plus JSON metadata.
+
+    With godot=True a SpriteFrames .tres for the frames is written too.
+    Returns the paths written.
+    """
+    frames = project.animation()
+    durations = project.frame_durations()
+    stem = os.path.splitext(os.path.basename(path))[0]
+    sprites = [(f"{stem}_{index:04d}", frame) for index, frame in enumerate(frames)]
+    if layers:
+        sprites += [(os.path.splitext(os.path.basename(layer_path(path, index, layer.name)))[0], layer.pixels)
+                    for index, layer in enumerate(project.document.layers)]
+    atlas, entries = build_atlas(sprites, padding, trim_sprites)
+    write_png(atlas, path, scale, compress_level=compress_level)
+    image = os.path.basename(path)
+    size = atlas.shape[1::-1]
+    meta = atlas_json(entries, image, size, scale, durations)  # Only the frames have durations
+    written = [path, os.path.splitext(path)[0] + ".json"]
+    with open(written[1], "w", encoding="utf-8") as out:
+        json.dump(meta, out, indent=1)
+    if godot:
+        written.append(os.path.splitext(path)[0] + ".tres")
+        with open(written[2], "w", encoding="utf-8") as out:
+            out.write(godot_sprite_frames(entries[:len(frames)], image, durations, scale, stem))
+    return written
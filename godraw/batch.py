@@ -0,0 +1,229 @@
+"""Apply the same edits to many sprite images, spread over worker processes.
+
+    python -m godraw batch 'sprites/**/*.png' -x flip-h -x outline:#000000 -o out/
+    python -m godraw batch walk/*.gif -x remap:pico8.hex -x resize:200% -o out/ --jobs 8
+
+Operations are the editor's own: the selection transforms applied to the
+whole image, the flood fill's match mask, and the palette module's
+recolouring and nearest-colour remapping. Animated GIFs, APNGs and WebPs
+keep their frames and timing, and identical frames are edited once.
+"""
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .document import Document, Palette, parse_color
+from .export import export_animation, write_png
+from .fill import fill_mask
+from .frames import FrameStore
+from .importer import read_frames
+from .palette import load_palette, remap_colors
+from .project import Project
+from .selection import flip_horizontal, flip_vertical, rotate_90, scaler
+
+OUTPUT_FORMATS = {"png": ".png", "gif": ".gif", "apng": ".apng", "webp": ".webp"}
+OPERATION_HELP = ("flip-h, flip-v, rotate[:90|180|270], resize:WxH or resize:N%%, recolor:FROM=TO[,FROM=TO...], "
+                  "remap:PALETTE_FILE, fill:X,Y,COLOR, outline[:COLOR]")
+
+
+def whole(pixels, operation):
+    """Run a selection transform on the whole image."""
+    out, _, _ = operation(pixels, np.ones(pixels.shape[:2], bool))
+    return np.ascontiguousarray(out)
+
+
+def rotate(pixels, turns):
+    for _ in range(turns):
+        pixels = whole(pixels, rotate_90)
+    return pixels
+
+
+def scale(pixels, sx, sy):
+    """Nearest-neighbour scale, as the editor's Scale button does."""
+    return whole(pixels, scaler(sx, sy))
+
+
+def resize(pixels, width, height):
+    h, w = pixels.shape[:2]
+    return scale(pixels, width / w, height / h)
+
+
+def recolor(pixels, old, new):
+    return remap_colors(pixels, old, new)
+
+
+def remap(pixels, colors):
+    """Every colour replaced by its nearest palette colour; fully transparent pixels stay so."""
+    palette = Palette(colors)
+    return palette.colors[palette.index(pixels)]
+
+
+def fill(pixels, x, y, color):
+    """Flood fill from (x, y) like the editor's fill tool with no tolerance."""
+    h, w = pixels.shape[:2]
+    if not (0 <= x < w and 0 <= y < h):
+        return pixels
+    out = pixels.copy()
+    out[fill_mask(pixels, x, y)] = color
+    return out
+
+
+def outline(pixels, color):
+    """Paint color on every transparent pixel next to an opaque one (4-connected)."""
+    solid = pixels[..., 3] > 0
+    ring = np.zeros_like(solid)
+    ring[1:] |= solid[:-1]
+    ring[:-1] |= solid[1:]
+    ring[:, 1:] |= solid[:, :-1]
+    ring[:, :-1] |= solid[:, 1:]
+    out = pixels.copy()
+    out[ring & ~solid] = color
+    return out
+
+
+def parse_operation(text):
+    """(function, extra arguments) for one "name[:argument]" operation; raises ValueError.
+
+    Both are picklable, so parsed operations can be sent to worker processes.
+    """
+    name, _, arg = text.partition(":")
+    if name == "flip-h":
+        return whole, (flip_horizontal,)
+    if name == "flip-v":
+        return whole, (flip_vertical,)
+    if name == "rotate":
+        degrees = int(arg or 90)
+        if degrees % 90:
+            raise ValueError(f"rotate: {degrees} is not a multiple of 90")
+        return rotate, ((degrees // 90) % 4,)
+    if name == "resize":
+        if arg.endswith("%"):
+            return scale, (float(arg[:-1]) / 100, float(arg[:-1]) / 100)
+        width, _, height = arg.partition("x")
+        return resize, (int(width), int(height))
+    if name in ("recolor", "recolour"):
+        pairs = [pair.split("=") for pair in arg.split(",")]
+        if not arg or any(len(pair) != 2 for pair in pairs):
+            raise ValueError("recolor needs FROM=TO colour pairs")
+        return recolor, ([parse_color(a) for a, _ in pairs], [parse_color(b) for _, b in pairs])
+    if name == "remap":
+        return remap, (load_palette(arg),)
+    if name == "fill":
+        x, y, color = arg.split(",", 2)
+        return fill, (int(x), int(y), parse_color(color))
+    if name == "outline":
+        return outline, (parse_color(arg or "#000000"),)
+    raise ValueError(f"unknown operation {name!r}; expected one of: {OPERATION_HELP.replace('%%', '%')}")
+
+
+def apply_operations(pixels, operations):
+    for function, args in operations:
+        pixels = function(pixels, *args)
+    return pixels
+
+
+def output_path(name, outdir, fmt=None):
+    """Where the edited image goes: name (the input's path below its glob root) under outdir.
+
+    The format defaults to the input's when it can be written, else PNG.
+    """
+    stem, ext = os.path.splitext(name)
+    if fmt is None:
+        fmt = next((fmt for fmt, suffix in OUTPUT_FORMATS.items() if suffix == ext.lower()), "png")
+    return os.path.join(outdir, stem + OUTPUT_FORMATS[fmt])
+
+
+def process_file(path, target, operations):
+    """Edit one image and write it to target; returns (path written, pixels processed)."""
+    frames, durations = read_frames(path)
+    pixels = sum(frame.shape[0] * frame.shape[1] for frame in frames)
+    store = FrameStore(frames)
+    store.map(lambda frame: apply_operations(frame, operations))
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    if len(store) == 1 and target.endswith(".png"):
+        write_png(store[0], target)
+    else:
+        h, w = store[0].shape[:2]
+        export_animation(Project(Document(w, h), list(store), durations=durations), target)
+    return target, pixels
+
+
+def _try_process(job):
+    try:
+        return process_file(*job), None
+    except Exception as error:  # Report the file and keep going with the others
+        return None, f"{type(error).__name__}: {error}"
+
+
+def glob_root(pattern):
+    """The directory part of a pattern before its first wildcard."""
+    parts = []
+    for part in os.path.dirname(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts)
+
+
+def expand_inputs(patterns):
+    """(file, path below its pattern's glob root) for each match (recursive ** allowed), in order, once each.
+
+    The second item is where the output goes under the output directory,
+    so 'src/**/*.png' keeps the folders below src.
+    """
+    found = {}
+    for pattern in patterns:
+        root = glob_root(pattern)
+        paths = sorted(glob.glob(pattern, recursive=True)) or ([pattern] if os.path.exists(pattern) else [])
+        for path in paths:
+            if os.path.isfile(path) and path not in found:
+                found[path] = os.path.relpath(path, root) if root else path
+                if found[path].startswith(os.pardir) or os.path.isabs(found[path]):
+                    found[path] = os.path.basename(path)
+    return list(found.items())
+
+
+def run_batch(inputs, outdir, operations, fmt=None, workers=None, report=None):
+    """Process (file, output name) pairs from expand_inputs, calling report(path, result, error) as each
+    finishes; returns throughput stats.
+
+    Results stream back in completion order, so one slow file does not
+    hold up the report of the others. Raises ValueError before any work
+    if two inputs would be written to the same file.
+    """
+    jobs = [(path, output_path(name, outdir, fmt), operations) for path, name in inputs]
+    targets = {}
+    for path, target, _ in jobs:
+        key = os.path.normcase(os.path.abspath(target))
+        if key in targets:
+            raise ValueError(f"{targets[key]} and {path} would both be written to {target}")
+        targets[key] = path
+    os.makedirs(outdir, exist_ok=True)
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    start = time.perf_counter()
+    done = failed = pixels = 0
+    if workers == 1:
+        outcomes = ((job[0], _try_process(job)) for job in jobs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        futures = {pool.submit(_try_process, job): job[0] for job in jobs}
+        outcomes = ((futures[future], future.result()) for future in as_completed(futures))
+    try:
+        for path, (result, error) in outcomes:
+            if error:
+                failed += 1
+            else:
+                done += 1
+                pixels += result[1]
+            if report:
+                report(path, result, error)
+    finally:
+        if workers > 1:
+            pool.shutdown()
+    seconds = time.perf_counter() - start
+    return {"files": done, "failed": failed, "megapixels": round(pixels / 1e6, 3), "seconds": round(seconds, 3),
+            "files_per_second": round(done / seconds, 1) if seconds else 0.0,
+            "megapixels_per_second": round(pixels / 1e6 / seconds, 2) if seconds else 0.0, "workers": workers}
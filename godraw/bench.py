@@ -0,0 +1,194 @@
+"""Headless benchmarks of the editor's hot paths on synthetic documents.
+
+    python -m godraw bench --sizes 16 256 1024 --layers 1 8 --frames 1 60 -o bench.json
+    python -m godraw bench --baseline bench.json
+
+Each benchmark runs the same core code the editor's handlers call (a
+pen stroke for paint_pixel, the scanline fill for flood_fill, History for
+undo/redo and so on) and records the median and best wall time over a
+few repeats plus the peak memory traced during one extra run. Results
+are JSON; comparing against a stored run reports the cases that got
+slower than a threshold.
+"""
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from .compositor import Compositor
+from .document import Document
+from .export import export_animation, export_png
+from .fill import flood_fill
+from .frames import FrameStore
+from .history import History
+from .project import Project
+from .stroke import Stroke
+
+SIZES = (16, 64, 256, 1024)
+LAYERS = (1, 4)
+FRAMES = (1, 16)
+PALETTE = ((230, 57, 70, 255), (29, 53, 87, 255), (168, 218, 220, 255), (241, 250, 238, 255), (69, 123, 157, 255))
+
+
+def synthetic_document(size, layers, seed=0):
+    """A size x size document with `layers` layers of random rectangles in a small palette."""
+    rng = np.random.default_rng(seed)
+    document = Document(size, size)
+    for _ in range(layers):
+        document.add_layer()
+        for _ in range(8):
+            x0, y0 = rng.integers(0, size, 2)
+            w, h = rng.integers(1, max(size // 3, 2), 2)
+            document.fill_rect((int(x0), int(y0), min(int(x0 + w), size), min(int(y0 + h), size)),
+                               PALETTE[rng.integers(len(PALETTE))])
+    return document
+
+
+def synthetic_frames(document, count):
+    """`count` frames of the document's composite, each shifted one more pixel to the right."""
+    composite = document.flatten()
+    return [np.roll(composite, index, axis=1) for index in range(count)]
+
+
+def zigzag(size, samples=64):
+    """Pointer samples of a drag across the grid, as paint_pixel receives them."""
+    xs = np.linspace(0, size - 1, samples).astype(int)
+    ys = np.abs((np.arange(samples) * 7) % (2 * size) - size).clip(0, size - 1)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+# Each setup gets (document, frames, workdir) and returns the function to time
+
+def bench_stroke(document, frames, workdir):
+    history = History(document)
+
+    def run():
+        history.begin()
+        stroke = Stroke(document, PALETTE[0], 3)
+        for index, (x, y) in enumerate(zigzag(document.width)):
+            stroke.add(x, y)
+            if index % 4 == 3:  # The editor flushes queued samples once per idle callback
+                stroke.flush()
+        stroke.finish()
+        history.end()
+    return run
+
+
+def bench_flood_fill(document, frames, workdir):
+    return lambda: flood_fill(document, 0, 0, PALETTE[1], connectivity=4)
+
+
+def bench_undo_redo(document, frames, workdir):
+    history = History(document)
+    history.begin()
+    document.fill_rect((0, 0, document.width, document.height // 2), PALETTE[2])
+    history.end()
+
+    def run():
+        history.undo()
+        history.redo()
+    return run
+
+
+def bench_merge_layers(document, frames, workdir):
+    return document.merge_all
+
+
+def bench_composite(document, frames, workdir):
+    compositor = Compositor(document)
+    return lambda: compositor.render((0, 0, document.width, document.height))
+
+
+def bench_save_frame(document, frames, workdir):
+    store = FrameStore(frames)
+    return lambda: store.append(document.flatten())
+
+
+def bench_save_file(document, frames, workdir):
+    return lambda: export_png(Project(document), os.path.join(workdir, "frame.png"), source="composite")
+
+
+def bench_export_gif(document, frames, workdir):
+    project = Project(document, frames)
+    return lambda: export_animation(project, os.path.join(workdir, "animation.gif"))
+
+
+# name -> (setup, parameters the result depends on besides the size)
+BENCHMARKS = {
+    "paint_pixel": (bench_stroke, ()),
+    "flood_fill": (bench_flood_fill, ()),
+    "undo_redo": (bench_undo_redo, ()),
+    "merge_layers": (bench_merge_layers, ("layers",)),
+    "composite": (bench_composite, ("layers",)),
+    "save_frame": (bench_save_frame, ("layers", "frames")),
+    "save_file": (bench_save_file, ("layers",)),
+    "export_as_gif": (bench_export_gif, ("frames",)),
+}
+
+
+def case_key(case):
+    return "/".join(f"{field}={case[field]}" for field in ("name", "size", "layers", "frames"))
+
+
+def measure(setup, document, frames, workdir, repeat):
+    """Median and best milliseconds over repeat runs, and the peak traced memory of one more."""
+    times = []
+    for _ in range(repeat):
+        run = setup(document.copy(), frames, workdir)  # Fresh copy, since most operations edit it
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    run = setup(document.copy(), frames, workdir)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3),
+            "peak_kb": round(peak / 1024, 1)}
+
+
+def run_benchmarks(sizes=SIZES, layers=LAYERS, frames=FRAMES, names=None, repeat=5, report=None):
+    """Run every benchmark over the parameter grid; returns a list of result dicts.
+
+    Parameters a benchmark does not depend on are fixed at their first
+    value, so each distinct case runs once. report, if given, is called
+    with each result as it finishes.
+    """
+    results = []
+    documents = {}
+    with tempfile.TemporaryDirectory(prefix="godraw-bench-") as workdir:
+        for name in names or BENCHMARKS:
+            setup, uses = BENCHMARKS[name]
+            for size in sizes:
+                for layer_count in (layers if "layers" in uses else layers[:1]):
+                    for frame_count in (frames if "frames" in uses else frames[:1]):
+                        key = (size, layer_count)
+                        if key not in documents:
+                            documents[key] = synthetic_document(size, layer_count)
+                        document = documents[key]
+                        case = {"name": name, "size": size, "layers": layer_count, "frames": frame_count}
+                        case.update(measure(setup, document, synthetic_frames(document, frame_count),
+                                            workdir, repeat))
+                        results.append(case)
+                        if report:
+                            report(case)
+    return results
+
+
+def compare(results, baseline, threshold=1.25):
+    """Cases whose median time grew past threshold x the baseline's; returns (case, ratio) pairs."""
+    before = {case_key(case): case for case in baseline}
+    slower = []
+    for case in results:
+        old = before.get(case_key(case))
+        # Sub-millisecond timings are mostly noise
+        if old and old["median_ms"] > 0 and case["median_ms"] > 0.5:
+            ratio = case["median_ms"] / old["median_ms"]
+            if ratio > threshold:
+                slower.append((case, round(ratio, 2)))
+    return slower
@@ -0,0 +1,77 @@
+"""Brushes as precomputed stamp masks centred on the pointer.
+
+A Brush is a boolean mask plus the cell of it that sits under the
+pointer. A stroke ORs the mask into one buffer at every cell of its path
+and paints that buffer with a single masked write, so a stamp costs one
+slice operation whatever the brush size. Ordered-dither brushes AND the
+result with a Bayer pattern fixed to the document grid, so overlapping
+stamps and separate strokes line up.
+"""
+import functools
+
+import numpy as np
+
+from .document import mask_bbox
+
+SHAPES = ("square", "circle")
+BAYER_4 = np.array([[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]])
+DITHER_LEVELS = BAYER_4.size  # Level n paints n of every 16 cells; the top level paints them all
+
+
+def frozen(array):
+    array = np.array(array, bool)
+    array.setflags(write=False)  # Brushes are cached and shared
+    return array
+
+
+class Brush:
+    """A stamp mask, the cell of it under the pointer and an optional dither pattern."""
+
+    def __init__(self, mask, pattern=None, pixel_perfect=False):
+        self.mask = frozen(mask)
+        h, w = self.mask.shape
+        self.anchor = (w // 2, h // 2)  # Cell of the mask under the pointer
+        self.pattern = None if pattern is None else frozen(pattern)  # Tile repeated over the document
+        self.pixel_perfect = pixel_perfect  # Drop the corner cell of every L in a 1-pixel line
+
+    def dithered(self, level):
+        """The same brush painting only `level` of every DITHER_LEVELS cells."""
+        pattern = None if level >= DITHER_LEVELS else dither_pattern(level)
+        return Brush(self.mask, pattern, self.pixel_perfect)
+
+    def pattern_at(self, rect):
+        """The dither pattern over the cells of rect."""
+        x0, y0, x1, y1 = rect
+        h, w = self.pattern.shape
+        return self.pattern[np.arange(y0, y1)[:, None] % h, np.arange(x0, x1) % w]
+
+
+def dither_pattern(level):
+    """Ordered-dither tile with `level` of its 16 cells set."""
+    return BAYER_4 < level
+
+
+def shape_mask(shape, size):
+    if shape == "square":
+        return np.ones((size, size), bool)
+    if shape == "circle":
+        # Cells whose centre lies within the radius, pulled in a little so small circles are not squares
+        centre = (size - 1) / 2
+        y, x = np.ogrid[:size, :size]
+        return (x - centre) ** 2 + (y - centre) ** 2 <= (size / 2 - 0.25) ** 2
+    raise ValueError(f"unknown brush shape {shape!r}; expected one of {', '.join(SHAPES)}")
+
+
+@functools.lru_cache(maxsize=128)
+def make_brush(shape="square", size=1, dither=DITHER_LEVELS, pixel_perfect=False):
+    """Cached brush of a shape and size; pixel_perfect only applies to 1-pixel brushes."""
+    return Brush(shape_mask(shape, size), pixel_perfect=pixel_perfect and size == 1).dithered(dither)
+
+
+def bitmap_brush(mask):
+    """Custom brush from the set cells of a 2-D mask, cropped to them; None if it has none."""
+    rect = mask_bbox(mask)
+    if rect is None:
+        return None
+    x0, y0, x1, y1 = rect
+    return Brush(mask[y0:y1, x0:x1])
@@ -0,0 +1,233 @@
+"""Command line for batch work on GoDraw projects, e.g. in CI.
+
+    python -m godraw export sprites/*.godraw --png --gif --sheet -o build/ --jobs 8
+    python -m godraw export walk.godraw --gif --apng --webp --scale 4
+    python -m godraw export characters/*.godraw --atlas --godot -o assets/
+    python -m godraw batch 'sprites/*.png' -x flip-h -x outline:#000000 -o out/
+    python -m godraw recover -o rescued.godraw
+    python -m godraw bench --sizes 16 256 1024 -o bench.json
+
+Nothing here imports Tk, ttkbootstrap or PyQt5, so it runs without a display.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from .atlas import export_atlas
+from .batch import OPERATION_HELP, OUTPUT_FORMATS, expand_inputs, parse_operation, run_batch as process_batch
+from .export import PNG_SOURCES, export_apng, export_gif, export_png, export_sheet, export_webp
+from .journal import AUTOSAVE_DIR, claim_autosave, has_autosave, recover
+from .project import EXTENSION, load_project, save_project
+
+EXPORTERS = {
+    "png": (export_png, ".png"),
+    "gif": (export_gif, ".gif"),
+    "apng": (export_apng, ".apng"),
+    "webp": (export_webp, ".webp"),
+    "sheet": (export_sheet, "_sheet.png"),
+    "atlas": (export_atlas, "_atlas.png"),
+}
+
+
+def export_file(path, outdir, formats, scale, options=None):
+    """Export one project in every requested format; returns the files written.
+
+    options maps a format name to extra keyword arguments for its exporter.
+    """
+    project = load_project(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    written = []
+    for name in formats:
+        exporter, suffix = EXPORTERS[name]
+        target = os.path.join(outdir or os.path.dirname(path), stem + suffix)
+        written.extend(exporter(project, target, scale, **(options or {}).get(name, {})))
+    return written
+
+
+def run_export(args):
+    formats = [name for name in EXPORTERS if getattr(args, name)]
+    if not formats:
+        print("export: choose at least one of --png, --gif, --apng, --webp, --sheet, --atlas", file=sys.stderr)
+        return 2
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    png = {"background": args.background, "indexed": args.indexed, "compress_level": args.compress}
+    animation = {"background": args.background}
+    options = {"png": dict(png, source=args.png_source), "sheet": png,
+               "gif": animation, "apng": animation, "webp": animation,
+               "atlas": {"layers": args.atlas_layers, "padding": args.padding, "trim_sprites": not args.no_trim,
+                         "godot": args.godot, "compress_level": args.compress}}
+    jobs = [(path, args.output, formats, args.scale, options) for path in args.projects]
+    workers = args.jobs or os.cpu_count() or 1
+    if workers == 1 or len(jobs) == 1:
+        results = map(_try_export, jobs)
+    else:
+        # Projects are independent, so spread them over worker processes
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_try_export, jobs, chunksize=max(len(jobs) // (4 * workers), 1)))
+    failed = 0
+    for (path, *_), (written, error) in zip(jobs, results):
+        if error:
+            failed += 1
+            print(f"{path}: {error}", file=sys.stderr)
+        else:
+            print(f"{path} -> {', '.join(written)}")
+    print(f"exported {len(jobs) - failed} of {len(jobs)} projects")
+    return 1 if failed else 0
+
+
+def _try_export(job):
+    try:
+        return export_file(*job), None
+    except Exception as error:  # Report the file and keep going with the others
+        return None, f"{type(error).__name__}: {error}"
+
+
+def run_batch(args):
+    """Apply an operation list to every matching image, streaming results and a throughput summary."""
+    try:
+        operations = [parse_operation(text) for text in args.operations]
+    except (OSError, ValueError) as error:
+        print(f"batch: {error}", file=sys.stderr)
+        return 2
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        print("batch: no input files match", file=sys.stderr)
+        return 2
+
+    def report(path, result, error):
+        if error:
+            print(f"{path}: {error}", file=sys.stderr)
+        else:
+            print(f"{path} -> {result[0]}", flush=True)
+
+    try:
+        stats = process_batch(inputs, args.output, operations, args.format, args.jobs, report)
+    except ValueError as error:
+        print(f"batch: {error}", file=sys.stderr)
+        return 2
+    print(f"processed {stats['files']} of {len(inputs)} files ({stats['megapixels']} Mpx) in {stats['seconds']} s: "
+          f"{stats['files_per_second']} files/s, {stats['megapixels_per_second']} Mpx/s "
+          f"with {stats['workers']} workers", file=sys.stderr)
+    if args.stats:
+        with open(args.stats, "w", encoding="utf-8") as out:
+            json.dump(stats, out, indent=1)
+    return 1 if stats["failed"] else 0
+
+
+def run_recover(args):
+    """Rebuild the editor's autosave into a project file and report how long replay took.
+
+    Given the autosave root rather than one session, the newest session
+    left by a closed editor is used; running editors' sessions are skipped.
+    """
+    directory, lock = args.directory, None
+    if not has_autosave(directory):
+        directory, lock = claim_autosave(directory) or (directory, None)
+    try:
+        project, stats = recover(directory)
+    except (OSError, ValueError) as error:
+        print(f"recover: {error}", file=sys.stderr)
+        return 1
+    finally:
+        if lock is not None:
+            lock.close()
+    save_project(project, args.output)
+    print(json.dumps(dict(stats, directory=directory, output=args.output)))
+    return 0
+
+
+def run_bench(args):
+    """Time the editor's core operations and optionally check them against a baseline run."""
+    from .bench import BENCHMARKS, compare, run_benchmarks
+    unknown = set(args.only or ()) - set(BENCHMARKS)
+    if unknown:
+        print(f"bench: unknown benchmarks {', '.join(sorted(unknown))}; choose from {', '.join(BENCHMARKS)}",
+              file=sys.stderr)
+        return 2
+
+    def report(case):
+        print(f"{case['name']:<14} size={case['size']:<5} layers={case['layers']:<3} frames={case['frames']:<4} "
+              f"{case['median_ms']:>10.3f} ms  (best {case['min_ms']:.3f})  peak {case['peak_kb']:.0f} KB",
+              file=sys.stderr)
+
+    results = run_benchmarks(args.sizes, args.layers, args.frames, args.only, args.repeat, report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(results, out, indent=1)
+    else:
+        print(json.dumps(results, indent=1))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            slower = compare(results, json.load(f), args.threshold)
+        for case, ratio in slower:
+            print(f"slower: {case['name']} size={case['size']} layers={case['layers']} frames={case['frames']} "
+                  f"{ratio}x the baseline", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="godraw", description="GoDraw sprite tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="export projects to image files")
+    export.add_argument("projects", nargs="+", help="project files to export")
+    export.add_argument("--png", action="store_true", help="composite of the visible layers")
+    export.add_argument("--gif", action="store_true", help="animated GIF of the frames")
+    export.add_argument("--apng", action="store_true", help="animated PNG of the frames")
+    export.add_argument("--webp", action="store_true", help="animated lossless WebP of the frames")
+    export.add_argument("--sheet", action="store_true", help="sprite sheet of the frames")
+    export.add_argument("--atlas", action="store_true",
+                        help="packed texture atlas of the frames with JSON metadata")
+    export.add_argument("--atlas-layers", action="store_true", help="also pack every layer into the atlas")
+    export.add_argument("--padding", type=int, default=1, help="pixels between atlas sprites (default: 1)")
+    export.add_argument("--no-trim", action="store_true", help="keep transparent borders of atlas sprites")
+    export.add_argument("--godot", action="store_true", help="also write a Godot SpriteFrames .tres for the atlas")
+    export.add_argument("-o", "--output", help="output directory (default: next to each project)")
+    export.add_argument("--scale", type=int, default=1, help="integer upscale factor")
+    export.add_argument("--png-source", choices=PNG_SOURCES, default="composite",
+                        help="what --png writes: the composite, the active layer, or one file per layer")
+    export.add_argument("--indexed", action="store_true", help="write palette-indexed PNGs")
+    export.add_argument("--compress", type=int, default=9, choices=range(10), metavar="0-9",
+                        help="PNG compression level (default: 9)")
+    export.add_argument("--background", help="flatten images over this colour instead of keeping transparency")
+    export.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    export.set_defaults(func=run_export)
+
+    batch = commands.add_parser("batch", help="apply the same edits to many PNG/GIF sprites")
+    batch.add_argument("inputs", nargs="+", help="image files or glob patterns such as 'sprites/**/*.png'")
+    batch.add_argument("-x", "--op", dest="operations", action="append", required=True, metavar="OP",
+                       help=f"operation to apply, in order (repeatable): {OPERATION_HELP}")
+    batch.add_argument("-o", "--output", required=True, help="output directory")
+    batch.add_argument("--format", choices=OUTPUT_FORMATS, help="output format (default: that of each input)")
+    batch.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per CPU)")
+    batch.add_argument("--stats", help="also write the throughput summary here as JSON")
+    batch.set_defaults(func=run_batch)
+
+    rescue = commands.add_parser("recover", help="save the autosave left by a crashed editor as a project")
+    rescue.add_argument("directory", nargs="?", default=AUTOSAVE_DIR, help=f"autosave directory (default: {AUTOSAVE_DIR})")
+    rescue.add_argument("-o", "--output", default="recovered" + EXTENSION, help="project file to write")
+    rescue.set_defaults(func=run_recover)
+
+    bench = commands.add_parser("bench", help="benchmark core editing operations on synthetic sprites")
+    bench.add_argument("--sizes", type=int, nargs="+", default=[16, 64, 256, 1024], help="grid sizes")
+    bench.add_argument("--layers", type=int, nargs="+", default=[1, 4], help="layer counts")
+    bench.add_argument("--frames", type=int, nargs="+", default=[1, 16], help="frame counts")
+    bench.add_argument("--only", nargs="+", metavar="NAME", help="benchmarks to run (default: all)")
+    bench.add_argument("--repeat", type=int, default=5, help="timed runs per case (default: 5)")
+    bench.add_argument("-o", "--output", help="write the results here instead of printing them")
+    bench.add_argument("--baseline", help="results of an earlier run to compare against")
+    bench.add_argument("--threshold", type=float, default=1.25,
+                       help="median slowdown that counts as a regression (default: 1.25)")
+    bench.set_defaults(func=run_bench)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
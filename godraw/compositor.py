@@ -0,0 +1,169 @@
+"""Blend a document's layers into the picture the user sees."""
+import numpy as np
+
+from .tiles import TILE_SIZE, tile_rect, tile_spans
+
+# Separable blend functions on straight colours in [0, 1] (backdrop, source)
+BLEND_MODES = {
+    "normal": lambda cb, cs: cs,
+    "multiply": lambda cb, cs: cb * cs,
+    "screen": lambda cb, cs: cb + cs - cb * cs,
+    "overlay": lambda cb, cs: np.where(cb <= 0.5, 2 * cb * cs, 1 - 2 * (1 - cb) * (1 - cs)),
+    "darken": np.minimum,
+    "lighten": np.maximum,
+    "add": lambda cb, cs: np.minimum(cb + cs, 1),
+}
+
+
+def composite(dst, src, opacity=1.0, mode="normal"):
+    """Blend straight-alpha uint8 src onto premultiplied float32 dst, in place."""
+    src = src.astype(np.float32) / 255
+    cs, sa = src[..., :3], src[..., 3:4] * opacity
+    ab = dst[..., 3:4]
+    if mode == "normal":
+        dst[..., :3] = cs * sa + dst[..., :3] * (1 - sa)
+    else:
+        cb = np.divide(dst[..., :3], ab, out=np.zeros_like(cs), where=ab > 0)
+        mixed = BLEND_MODES[mode](cb, cs)
+        dst[..., :3] = sa * (1 - ab) * cs + sa * ab * mixed + dst[..., :3] * (1 - sa)
+    dst[..., 3:4] = sa + ab * (1 - sa)
+
+
+def over(dst, src):
+    """Premultiplied src over premultiplied dst, in place."""
+    dst *= 1 - src[..., 3:4]
+    dst += src
+
+
+def to_rgba8(premultiplied):
+    """Convert a premultiplied float32 buffer to straight-alpha uint8."""
+    alpha = premultiplied[..., 3:4]
+    rgb = np.divide(premultiplied[..., :3], alpha, out=np.zeros_like(premultiplied[..., :3]),
+                    where=alpha > 0)
+    out = np.empty(premultiplied.shape, np.uint8)
+    out[..., :3] = np.clip(rgb * 255 + 0.5, 0, 255)
+    out[..., 3:] = np.clip(alpha * 255 + 0.5, 0, 255)
+    return out
+
+
+def blend_layers(layers, rect, dst=None):
+    """Blend the visible layers' pixels inside rect onto dst (premultiplied float32)."""
+    x0, y0, x1, y1 = rect
+    if dst is None:
+        dst = np.zeros((y1 - y0, x1 - x0, 4), np.float32)
+    for layer in layers:
+        # Transparent pixels leave dst unchanged in every mode, so empty tiles are skipped
+        if layer.visible and layer.opacity > 0 and not layer.is_empty(rect):
+            composite(dst, layer.read_region(rect), layer.opacity, layer.blend_mode)
+    return dst
+
+
+def sample_layers(layers, cols, rows):
+    """Composite of the cells at every (row, col) pair of two sorted index arrays.
+
+    Used when zoomed out, where the screen shows only some of the cells.
+    """
+    dst = np.zeros((len(rows), len(cols), 4), np.float32)
+    for layer in layers:
+        if layer.visible and layer.opacity > 0 and layer.tiles:
+            composite(dst, layer.sample(cols, rows), layer.opacity, layer.blend_mode)
+    return dst
+
+
+def flatten(layers, rect):
+    """Composite of the layers inside rect as straight-alpha uint8."""
+    return to_rgba8(blend_layers(layers, rect))
+
+
+class Compositor:
+    """Composite of a document with the layers around the active one cached.
+
+    The layers below the active layer and, when they all use normal
+    blending, the layers above it are each kept as premultiplied tiles,
+    so painting on the active layer re-blends three buffers in the dirty
+    rectangle instead of the whole stack. Cache tiles are blended the
+    first time they are rendered; fully transparent ones are stored as
+    None.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.key = None
+        self.below = {}
+        self.above = None  # None when the layers above need blending one by one
+
+    def _state(self):
+        doc = self.document
+        # The active layer is blended on every render, so its settings can change freely
+        return (doc.width, doc.height, doc.active_index, doc.palette and doc.palette.version,
+                tuple((id(layer),) if i == doc.active_index else
+                      (id(layer), layer.visible, layer.opacity, layer.blend_mode)
+                      for i, layer in enumerate(doc.layers)))
+
+    def _split(self):
+        layers, active = self.document.layers, self.document.active_index
+        return layers[:active], layers[active], layers[active + 1:]
+
+    def invalidate(self, rect=None):
+        """Drop the cached tiles, only those overlapping rect if one is given."""
+        if rect is None or self.key is None:
+            self.key = None
+            return
+        for key, _ in tile_spans(rect):
+            self.below.pop(key, None)
+            if self.above is not None:
+                self.above.pop(key, None)
+
+    def _ensure(self):
+        state = self._state()
+        if state == self.key:
+            return
+        _, _, above = self._split()
+        self.below = {}
+        visible = [layer for layer in above if layer.visible]
+        self.above = {} if all(l.blend_mode == "normal" for l in visible) else None
+        self.key = state
+
+    def _cached(self, cache, layers, rect, out):
+        """Copy the cached blend of layers inside rect into out, filling missing tiles."""
+        x0, y0 = rect[:2]
+        for key, (sx0, sy0, sx1, sy1) in tile_spans(rect):
+            if key not in cache:
+                tile = blend_layers(layers, self.document.clip(tile_rect(key)))
+                cache[key] = tile if tile[..., 3].any() else None
+            tile = cache[key]
+            if tile is not None:
+                tx0, ty0 = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+                out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = tile[sy0 - ty0:sy1 - ty0, sx0 - tx0:sx1 - tx0]
+
+    def render(self, rect=None):
+        """Straight-alpha uint8 composite of the document inside rect."""
+        x0, y0, x1, y1 = rect = rect or (0, 0, self.document.width, self.document.height)
+        out = np.zeros((y1 - y0, x1 - x0, 4), np.float32)
+        if not self.document.layers:
+            return to_rgba8(out)
+        self._ensure()
+        below, active, above = self._split()
+        self._cached(self.below, below, rect, out)
+        blend_layers([active], rect, out)
+        if self.above is not None:
+            top = np.zeros_like(out)
+            self._cached(self.above, above, rect, top)
+            over(out, top)
+        else:
+            blend_layers(above, rect, out)
+        return to_rgba8(out)
+
+    def sample(self, cols, rows):
+        """Straight-alpha uint8 composite of the cells at every (row, col) pair.
+
+        cols and rows are sorted cell indices inside the document, such as
+        the cells a zoomed view shows on screen.
+        """
+        if len(cols) == 0 or len(rows) == 0:
+            return np.zeros((len(rows), len(cols), 4), np.uint8)
+        rect = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+        if (rect[2] - rect[0]) * (rect[3] - rect[1]) <= len(cols) * len(rows):
+            # Zoomed in: every cell is shown, so blend the rect through the caches
+            return self.render(rect)[np.ix_(rows - rect[1], cols - rect[0])]
+        return to_rgba8(sample_layers(self.document.layers, cols, rows))
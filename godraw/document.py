@@ -0,0 +1,523 @@
+"""Pixel document model: every layer is a sparse grid of RGBA or palette-index tiles, independent of Tk."""
+import numpy as np
+
+from .compositor import flatten
+from .render import flatten_rgb
+from .tiles import TILE_SIZE, tile_rect, tile_spans
+
+TRANSPARENT = (0, 0, 0, 0)
+
+
+def parse_color(color):
+    """Convert a Tk colour string or an RGB(A) tuple to an RGBA tuple."""
+    if color is None:
+        return TRANSPARENT
+    if isinstance(color, str):
+        from PIL import ImageColor
+        color = ImageColor.getrgb(color)
+    color = tuple(int(c) for c in color)
+    if len(color) == 3:
+        color += (255,)
+    return color
+
+
+def to_hex(rgba):
+    """Format an RGB(A) value as a Tk '#rrggbb' string."""
+    return '#%02x%02x%02x' % tuple(int(c) for c in rgba[:3])
+
+
+def clip_rect(rect, width, height):
+    """Clip an (x0, y0, x1, y1) rectangle to the document, None if empty."""
+    x0, y0, x1, y1 = rect
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, width), min(y1, height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def union_rect(a, b):
+    """Smallest rectangle covering both a and b (either may be None)."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def mask_bbox(mask):
+    """Bounding rectangle of the True cells of a 2-D mask, or None."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+class Layer:
+    """An RGBA layer stored as TILE_SIZE square tiles in a dict keyed by (col, row).
+
+    Tiles are allocated by the first write that leaves a visible pixel in
+    them and dropped once they are fully transparent again, so memory
+    follows the painted area rather than the document size. A layer read
+    from a project file may defer loading its tiles until they are used.
+
+    The *_cells methods work on the stored values, which for this class
+    are the RGBA pixels themselves; subclasses storing something else
+    (IndexedLayer) override the *_region methods to convert.
+    """
+    CELL = (4,)  # Shape of one stored cell after (row, col)
+
+    def __init__(self, width, height, name="Layer"):
+        self.name = name
+        self.width = width
+        self.height = height
+        self._tiles = {}
+        self._load = None  # Callable returning the tiles, for layers not read yet
+        self.visible = True
+        self.opacity = 1.0
+        self.blend_mode = "normal"  # One of compositor.BLEND_MODES
+
+    @property
+    def tiles(self):
+        if self._load is not None:
+            load, self._load = self._load, None
+            self._tiles = load()
+        return self._tiles
+
+    @tiles.setter
+    def tiles(self, tiles):
+        self._tiles, self._load = tiles, None
+
+    def defer(self, load):
+        """Read the tiles with load() the first time they are needed."""
+        self._tiles, self._load = {}, load
+
+    @property
+    def loaded(self):
+        return self._load is None
+
+    @property
+    def pixels(self):
+        """The whole layer as one new (height, width, 4) array; writes to it are not kept."""
+        return self.read_region((0, 0, self.width, self.height))
+
+    @pixels.setter
+    def pixels(self, pixels):
+        self.height, self.width = pixels.shape[:2]
+        self.tiles = {}
+        self.write_region(0, 0, pixels)
+
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def coverage(self, cells):
+        """Nonzero where stored cells hold something visible."""
+        return cells[..., 3]
+
+    def blank(self, name=None):
+        """An empty layer of the same kind and size."""
+        return Layer(self.width, self.height, name or self.name)
+
+    def is_empty(self, rect):
+        """True if no stored tile overlaps rect."""
+        return not any(key in self.tiles for key, _ in tile_spans(rect))
+
+    def read_cells(self, rect):
+        """Return a copy of the stored cells inside rect."""
+        x0, y0, x1, y1 = rect
+        out = np.zeros((y1 - y0, x1 - x0) + self.CELL, np.uint8)
+        for key, (sx0, sy0, sx1, sy1) in tile_spans(rect):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                tx0, ty0 = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+                out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = tile[sy0 - ty0:sy1 - ty0, sx0 - tx0:sx1 - tx0]
+        return out
+
+    def sample_cells(self, cols, rows):
+        """Stored cells at every (row, col) pair of two sorted arrays of cell indices."""
+        out = np.zeros((len(rows), len(cols)) + self.CELL, np.uint8)
+        # The arrays are sorted, so the indices falling in one tile form one run
+        col_keys, col_starts = np.unique(cols // TILE_SIZE, return_index=True)
+        row_keys, row_starts = np.unique(rows // TILE_SIZE, return_index=True)
+        col_bounds = col_starts.tolist() + [len(cols)]
+        row_bounds = row_starts.tolist() + [len(rows)]
+        for i, row in enumerate(row_keys.tolist()):
+            rs = slice(row_bounds[i], row_bounds[i + 1])
+            for j, col in enumerate(col_keys.tolist()):
+                tile = self.tiles.get((col, row))
+                if tile is not None:
+                    cs = slice(col_bounds[j], col_bounds[j + 1])
+                    out[rs, cs] = tile[np.ix_(rows[rs] - row * TILE_SIZE, cols[cs] - col * TILE_SIZE)]
+        return out
+
+    def write_cells(self, x0, y0, data, mask=None):
+        """Write stored cells with their top-left corner at (x0, y0), optionally masked."""
+        h, w = data.shape[:2]
+        for key, (sx0, sy0, sx1, sy1) in tile_spans((x0, y0, x0 + w, y0 + h)):
+            part = data[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0]
+            where = None if mask is None else mask[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0]
+            alpha = self.coverage(part) if where is None else self.coverage(part)[where]
+            tile = self.tiles.get(key)
+            if tile is None:
+                if not alpha.any():
+                    continue  # Transparent pixels on an empty tile change nothing
+                tile = self.tiles[key] = np.zeros((TILE_SIZE, TILE_SIZE) + self.CELL, np.uint8)
+            tx0, ty0 = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+            target = tile[sy0 - ty0:sy1 - ty0, sx0 - tx0:sx1 - tx0]
+            if where is None:
+                target[...] = part
+            else:
+                np.copyto(target, part, where=where.reshape(where.shape + (1,) * len(self.CELL)))
+            if not alpha.all() and not self.coverage(tile).any():
+                del self.tiles[key]
+
+    # For RGBA layers the stored cells are the pixels
+    read_region = read_cells
+    sample = sample_cells
+    write_region = write_cells
+
+    def fill(self, rect, color):
+        """Set every pixel inside rect to one RGBA colour."""
+        for key, (sx0, sy0, sx1, sy1) in tile_spans(rect):
+            data = np.empty((sy1 - sy0, sx1 - sx0, 4), np.uint8)
+            data[...] = color
+            self.write_region(sx0, sy0, data)
+
+    def clear(self):
+        self.tiles = {}
+
+    def copy(self):
+        """Independent copy of the layer, pixels and settings."""
+        layer = self.blank()
+        layer.tiles = {key: tile.copy() for key, tile in self.tiles.items()}
+        layer.visible, layer.opacity, layer.blend_mode = self.visible, self.opacity, self.blend_mode
+        return layer
+
+    def resize(self, width, height):
+        """Crop or pad the layer, keeping the top-left corner in place."""
+        self.width, self.height = width, height
+        for key in list(self.tiles):
+            x0, y0, x1, y1 = tile_rect(key)
+            if x0 >= width or y0 >= height:
+                del self.tiles[key]
+            elif x1 > width or y1 > height:
+                # Clear the part past the new edge so growing again shows it empty
+                tile = self.tiles[key]
+                tile[:, max(width - x0, 0):] = 0
+                tile[max(height - y0, 0):] = 0
+                if not self.coverage(tile).any():
+                    del self.tiles[key]
+
+    def bbox(self):
+        """Bounding rectangle of the non-transparent pixels, or None."""
+        rect = None
+        for key, tile in self.tiles.items():
+            box = mask_bbox(self.coverage(tile) > 0)
+            if box is not None:
+                x, y = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+                rect = union_rect(rect, (box[0] + x, box[1] + y, box[2] + x, box[3] + y))
+        return rect
+
+
+class Palette:
+    """Up to 256 RGBA colours shared by the indexed layers of a document.
+
+    colors is the lookup table index buffers are rendered through, so
+    changing an entry recolours every pixel that uses it without touching
+    the pixels. Entry 0 is always transparent, which keeps index tiles as
+    sparse as RGBA ones. version changes with every edit so caches of
+    rendered pixels can tell they are stale.
+    """
+    SIZE = 256
+    LOOKUP_BLOCK = 4096  # Colours matched against the palette at a time
+
+    def __init__(self, colors=()):
+        self.colors = np.zeros((self.SIZE, 4), np.uint8)
+        self.count = 1  # Entries in use, counting transparent entry 0
+        self.version = 0
+        for color in colors:
+            self.add(color)
+
+    def __len__(self):
+        return self.count
+
+    def entries(self):
+        """The colours after the transparent entry, as RGBA tuples."""
+        return [tuple(int(c) for c in color) for color in self.colors[1:self.count]]
+
+    def copy(self):
+        return Palette(self.entries())
+
+    def add(self, color):
+        """Append a colour; returns its index."""
+        if self.count == self.SIZE:
+            raise ValueError(f"a palette holds at most {self.SIZE - 1} colours besides transparent")
+        self.colors[self.count] = parse_color(color)
+        self.count += 1
+        self.version += 1
+        return self.count - 1
+
+    def ensure(self, color):
+        """Index of color, appending it while there is room; a full palette gives the nearest entry."""
+        rgba = np.array([parse_color(color)], np.uint8)
+        if rgba[0, 3] == 0:
+            return 0
+        found = np.flatnonzero((self.colors[1:self.count] == rgba).all(axis=1))
+        if len(found):
+            return int(found[0]) + 1
+        if self.count < self.SIZE:
+            return self.add(rgba[0])
+        return int(self.lookup(rgba)[0])
+
+    def set(self, index, color):
+        """Change one entry, and so every pixel drawn with it."""
+        if not 0 < index < self.count:
+            raise IndexError(f"palette entry {index} is not an editable colour")
+        self.colors[index] = parse_color(color)
+        self.version += 1
+
+    def set_colors(self, colors):
+        """Replace the entries after the transparent one, keeping every pixel's index."""
+        colors = [parse_color(color) for color in colors][:self.SIZE - 1]
+        self.colors[1:] = 0
+        if colors:
+            self.colors[1:len(colors) + 1] = colors
+        self.count = len(colors) + 1
+        self.version += 1
+
+    def cycle(self, start, end, step=1):
+        """Rotate entries start..end-1 by step, as in colour-cycling animation."""
+        start, end = max(start, 1), min(end, self.count)
+        if end - start > 1:
+            self.colors[start:end] = np.roll(self.colors[start:end], step, axis=0)
+            self.version += 1
+
+    def lookup(self, colors):
+        """Index of the nearest entry to each colour of an (n, 4) RGBA array; alpha 0 maps to 0."""
+        out = np.zeros(len(colors), np.uint8)
+        used = self.colors[1:self.count].astype(np.int32)
+        visible = np.flatnonzero(colors[:, 3] > 0)
+        if not len(used):
+            return out
+        # Blocks bound the (colours x entries x 4) distance array
+        for start in range(0, len(visible), self.LOOKUP_BLOCK):
+            rows = visible[start:start + self.LOOKUP_BLOCK]
+            distance = ((colors[rows, None].astype(np.int32) - used) ** 2).sum(axis=-1)
+            out[rows] = distance.argmin(axis=1) + 1
+        return out
+
+    def index(self, pixels):
+        """Palette indices of an RGBA buffer, matching each distinct colour once."""
+        packed = np.ascontiguousarray(pixels).view(np.uint32)[..., 0]
+        codes, inverse = np.unique(packed, return_inverse=True)
+        return self.lookup(codes.view(np.uint8).reshape(-1, 4))[inverse].reshape(packed.shape)
+
+
+class IndexedLayer(Layer):
+    """A layer of one-byte palette indices, read and written as RGBA through the palette.
+
+    Pixels written in a colour the palette lacks get its nearest entry.
+    """
+    CELL = ()
+
+    def __init__(self, width, height, palette, name="Layer"):
+        super().__init__(width, height, name)
+        self.palette = palette
+
+    def coverage(self, cells):
+        return cells
+
+    def blank(self, name=None):
+        return IndexedLayer(self.width, self.height, self.palette, name or self.name)
+
+    def read_region(self, rect):
+        return self.palette.colors[self.read_cells(rect)]
+
+    def sample(self, cols, rows):
+        return self.palette.colors[self.sample_cells(cols, rows)]
+
+    def write_region(self, x0, y0, data, mask=None):
+        self.write_cells(x0, y0, self.palette.index(data), mask)
+
+    def fill(self, rect, color):
+        x0, y0, x1, y1 = rect
+        index = self.palette.lookup(np.array([parse_color(color)], np.uint8))[0]
+        self.write_cells(x0, y0, np.full((y1 - y0, x1 - x0), index, np.uint8))
+
+
+class Document:
+    def __init__(self, width=16, height=16):
+        self.width = width
+        self.height = height
+        self.layers = []
+        self.active_index = 0
+        self.palette = None  # Palette of the indexed layers, or None for RGBA layers
+        self.edit = None  # history.Edit recording the current action, if any
+
+    @property
+    def active_layer(self):
+        return self.layers[self.active_index]
+
+    def layer(self, index=None):
+        return self.active_layer if index is None else self.layers[index]
+
+    def add_layer(self, name=None):
+        """Append a transparent layer and make it active."""
+        layer = self.new_layer(name or f"Layer {len(self.layers) + 1}")
+        self.layers.append(layer)
+        self.active_index = len(self.layers) - 1
+        return layer
+
+    def new_layer(self, name):
+        """An empty layer of the document's kind: indexed when it has a palette."""
+        if self.palette is None:
+            return Layer(self.width, self.height, name)
+        return IndexedLayer(self.width, self.height, self.palette, name)
+
+    def copy(self):
+        """Independent copy of the document and all its layers."""
+        document = Document(self.width, self.height)
+        document.layers = [layer.copy() for layer in self.layers]
+        document.active_index = self.active_index
+        if self.palette is not None:
+            document.palette = self.palette.copy()
+            for layer in document.layers:
+                if isinstance(layer, IndexedLayer):
+                    layer.palette = document.palette
+        return document
+
+    def remove_layer(self, index):
+        del self.layers[index]
+        self.active_index = min(self.active_index, len(self.layers) - 1)
+
+    def resize(self, width, height):
+        """Change the document size for every layer."""
+        self.width, self.height = width, height
+        for layer in self.layers:
+            layer.resize(width, height)
+
+    def clip(self, rect):
+        return clip_rect(rect, self.width, self.height)
+
+    def capture(self, layer, rect, mask=None):
+        """Let the open edit save rect's pixels (those under mask, if given) before they are overwritten."""
+        if self.edit is not None and self.edit.layer is layer:
+            self.edit.capture(rect, mask)
+
+    def get_pixel(self, x, y, index=None):
+        return tuple(int(c) for c in self.layer(index).read_region((x, y, x + 1, y + 1))[0, 0])
+
+    def set_pixel(self, x, y, color, index=None):
+        return self.fill_rect((x, y, x + 1, y + 1), color, index)
+
+    def fill_rect(self, rect, color, index=None):
+        """Fill rect with color on a layer; returns the clipped rect or None."""
+        rect = self.clip(rect)
+        if rect is not None:
+            layer = self.layer(index)
+            self.capture(layer, rect)
+            layer.fill(rect, parse_color(color))
+        return rect
+
+    def fill_mask(self, mask, color, index=None):
+        """Paint color wherever a document-sized mask is set; returns the rect or None."""
+        rect = mask_bbox(mask)
+        if rect is not None:
+            x0, y0, x1, y1 = rect
+            data = np.empty((y1 - y0, x1 - x0, 4), np.uint8)
+            data[...] = parse_color(color)
+            self.write_region(x0, y0, data, mask[y0:y1, x0:x1], index)
+        return rect
+
+    def write_region(self, x0, y0, data, mask=None, index=None):
+        """Write a block of pixels into a layer; returns the rect it covers."""
+        layer = self.layer(index)
+        rect = (x0, y0, x0 + data.shape[1], y0 + data.shape[0])
+        self.capture(layer, rect, mask)
+        layer.write_region(x0, y0, data, mask)
+        return rect
+
+    def write_cells(self, x0, y0, cells, mask=None, index=None):
+        """Write a block of a layer's stored cells as they are (indices on an indexed layer)."""
+        layer = self.layer(index)
+        rect = (x0, y0, x0 + cells.shape[1], y0 + cells.shape[0])
+        self.capture(layer, rect, mask)
+        layer.write_cells(x0, y0, cells, mask)
+        return rect
+
+    def clear_layer(self, index=None):
+        layer = self.layer(index)
+        rect = layer.bbox()
+        if rect is not None:
+            self.capture(layer, rect)
+            layer.clear()
+
+    def snapshot(self, index=None):
+        """Copy of a layer's pixels, suitable for restore()."""
+        return self.layer(index).pixels
+
+    def restore(self, pixels, index=None):
+        layer = self.layer(index)
+        if pixels.shape[:2] != (layer.height, layer.width):
+            layer.pixels = pixels
+        else:
+            self.capture(layer, (0, 0, self.width, self.height))
+            layer.write_region(0, 0, pixels)
+
+    def flatten(self, layers=None):
+        """Composite the visible layers bottom to top into a single RGBA buffer."""
+        layers = self.layers if layers is None else layers
+        out = np.zeros((self.height, self.width, 4), np.uint8)
+        # One band of tiles at a time keeps the float blending buffers small
+        for y0 in range(0, self.height, TILE_SIZE):
+            y1 = min(y0 + TILE_SIZE, self.height)
+            out[y0:y1] = flatten(layers, (0, y0, self.width, y1))
+        return out
+
+    def composite_layer(self, layers, name):
+        """New layer holding the composite of layers, blended tile by tile."""
+        merged = self.new_layer(name)
+        keys = set()
+        for layer in layers:
+            if layer.visible:
+                keys.update(layer.tiles)
+        for key in keys:
+            rect = self.clip(tile_rect(key))
+            if rect is not None:
+                merged.write_region(rect[0], rect[1], flatten(layers, rect))
+        return merged
+
+    def merge_all(self):
+        """Replace every layer with one layer holding their composite."""
+        merged = self.composite_layer(self.layers, "Merged Layer")
+        self.layers = [merged]
+        self.active_index = 0
+        return merged
+
+    def merge_down(self, index=None):
+        """Blend a layer into the one below it, which keeps its name and settings."""
+        index = self.active_index if index is None else index
+        if index <= 0:
+            return None
+        lower, upper = self.layers[index - 1], self.layers[index]
+        # Blend onto the lower layer's own pixels; its settings apply to the result
+        base = lower.blank()
+        base.tiles = lower.tiles
+        merged = self.composite_layer([base, upper], lower.name)
+        merged.visible, merged.opacity, merged.blend_mode = lower.visible, lower.opacity, lower.blend_mode
+        self.layers[index - 1:index + 1] = [merged]
+        self.active_index = index - 1
+        return merged
+
+
+def to_image(pixels, scale=1, background=None):
+    """Build a PIL image from an RGBA buffer, nearest-neighbour upscaled."""
+    from PIL import Image
+    if scale != 1:
+        pixels = pixels.repeat(scale, axis=0).repeat(scale, axis=1)
+    if background is not None:
+        rgb = flatten_rgb(pixels, parse_color(background)[:3])
+        return Image.fromarray(rgb, "RGB").convert("RGBA")
+    return Image.fromarray(np.ascontiguousarray(pixels), "RGBA")
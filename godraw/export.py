@@ -0,0 +1,286 @@
+"""Write a project's pixels to image files without any GUI."""
+import math
+import os
+import re
+import struct
+
+import numpy as np
+
+from .document import mask_bbox, parse_color, to_image
+from .importer import padded
+from .render import flatten_rgb, scale_nearest
+
+PNG_SOURCES = ("composite", "active", "layers")
+ANIMATION_FORMATS = {".gif": "GIF", ".apng": "APNG", ".png": "APNG", ".webp": "WEBP"}
+PALETTE_SAMPLE = 1 << 20  # Pixels sampled to build a quantized palette
+
+
+def palette_indices(pixels):
+    """Split an RGBA buffer into (palette, indices), or None if it has over 256 colours."""
+    packed = np.ascontiguousarray(pixels).view(np.uint32)[..., 0]
+    colors, indices = np.unique(packed, return_inverse=True)
+    if len(colors) > 256:
+        return None
+    palette = colors.view(np.uint8).reshape(-1, 4)
+    return palette, indices.reshape(packed.shape).astype(np.uint8)
+
+
+def png_image(pixels, scale=1, background=None, indexed=False):
+    """PIL image to write as PNG: RGBA, RGB over a background colour, or palette-indexed.
+
+    An indexed image keeps every colour exactly when there are at most
+    256 of them, and falls back to a quantized 256-colour palette otherwise.
+    Transparency is kept unless a background colour is given.
+    """
+    from PIL import Image
+    if background is not None:
+        opaque = np.empty_like(pixels)
+        opaque[..., :3] = flatten_rgb(pixels, parse_color(background)[:3])
+        opaque[..., 3] = 255
+        pixels = opaque
+    if indexed:
+        split = palette_indices(pixels)
+        if split is not None:
+            palette, indices = split
+            # Upscale the one-byte indices rather than the RGBA pixels
+            image = Image.fromarray(np.ascontiguousarray(scale_nearest(indices, scale)), "P")
+            image.putpalette(palette[:, :3].tobytes())
+            if (palette[:, 3] < 255).any():
+                image.info["transparency"] = palette[:, 3].tobytes()
+            return image
+        return to_image(pixels, scale).quantize(256, method=Image.Quantize.FASTOCTREE)
+    if (pixels[..., 3] == 255).all():
+        return Image.fromarray(np.ascontiguousarray(scale_nearest(pixels[..., :3], scale)), "RGB")
+    return to_image(pixels, scale)
+
+
+def write_png(pixels, path, scale=1, background=None, indexed=False, compress_level=9):
+    """Encode an RGBA buffer straight to a PNG file."""
+    png_image(pixels, scale, background, indexed).save(path, "PNG", compress_level=compress_level)
+    return path
+
+
+def layer_path(path, index, name):
+    """File name for one layer when every layer is exported separately."""
+    stem, ext = os.path.splitext(path)
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", name).strip("_") or "layer"
+    return f"{stem}_{index + 1}_{slug}{ext or '.png'}"
+
+
+def export_png(project, path, scale=1, background=None, indexed=False, compress_level=9, source="composite"):
+    """Save the composite, the active layer, or every layer to its own file.
+
+    Returns the paths written.
+    """
+    document = project.document
+    if source == "layers":
+        return [write_png(layer.pixels, layer_path(path, index, layer.name),
+                          scale, background, indexed, compress_level)
+                for index, layer in enumerate(document.layers)]
+    if source == "active":
+        pixels = document.active_layer.pixels
+    elif source == "composite":
+        pixels = document.flatten()
+    else:
+        raise ValueError(f"unknown PNG source {source!r}, expected one of {PNG_SOURCES}")
+    return [write_png(pixels, path, scale, background, indexed, compress_level)]
+
+
+def distinct(values):
+    """Sorted distinct values of an array (sorting beats np.unique's hashing for packed colours)."""
+    values = np.sort(values, axis=None)
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+
+def global_palette(frames, colors=255):
+    """One palette for every frame: (palette, indices per frame, transparent index).
+
+    Pixels with alpha under 128 become the transparent index, which sits
+    right after the colours. When the frames use at most `colors` colours
+    the palette is exact; otherwise it is a median-cut palette of a sample
+    of pixels from all frames. Identical frames share one index buffer.
+    """
+    from PIL import Image
+    packed = {}
+    for frame in frames:
+        if id(frame) not in packed:
+            rgb = np.zeros(frame.shape[:2] + (4,), np.uint8)
+            rgb[..., :3] = frame[..., :3]
+            codes = rgb.view(np.uint32)[..., 0]
+            codes[frame[..., 3] < 128] = np.uint32(0xFFFFFFFF)  # Not a colour any opaque pixel can have
+            packed[id(frame)] = codes
+    used = distinct(np.concatenate([distinct(codes) for codes in packed.values()]))
+    used = used[used != 0xFFFFFFFF]
+    if len(used) <= colors:
+        palette = used.view(np.uint8).reshape(-1, 4)[:, :3]
+        lookup = np.arange(len(used), dtype=np.uint8)
+    else:
+        opaque = np.concatenate([codes[codes != 0xFFFFFFFF] for codes in packed.values()])
+        sample = np.ascontiguousarray(opaque[::max(len(opaque) // PALETTE_SAMPLE, 1)])
+        rgb = np.ascontiguousarray(sample.view(np.uint8).reshape(1, -1, 4)[..., :3])
+        reference = Image.fromarray(rgb, "RGB").quantize(colors, Image.Quantize.MEDIANCUT)
+        palette = np.frombuffer(bytes(reference.getpalette()[:3 * colors]), np.uint8).reshape(-1, 3)
+        # Map each distinct colour once instead of every pixel of every frame
+        rgb = np.ascontiguousarray(used.view(np.uint8).reshape(1, -1, 4)[..., :3])
+        lookup = np.asarray(Image.fromarray(rgb, "RGB").quantize(palette=reference, dither=Image.Dither.NONE))[0]
+    transparent = len(palette)
+    lookup = np.append(lookup, np.uint8(transparent))  # Sorted after every colour, like its code
+    indices = {key: lookup[np.searchsorted(used, codes)] for key, codes in packed.items()}
+    return palette, [indices[id(frame)] for frame in frames], transparent
+
+
+def common_canvas(frames):
+    """The frames padded at the bottom-right to the largest width and height among them.
+
+    Frames saved before the grid was resized are smaller or larger than
+    later ones; animations and sheets need one size. Repeated frames stay
+    shared.
+    """
+    width = max(frame.shape[1] for frame in frames)
+    height = max(frame.shape[0] for frame in frames)
+    shared = {}
+    for frame in frames:
+        if id(frame) not in shared:
+            shared[id(frame)] = padded(frame, width, height)
+    return [shared[id(frame)] for frame in frames]
+
+
+def merge_repeats(indices, durations):
+    """Drop frames identical to the one before, adding their time to it."""
+    kept, times = [indices[0]], [durations[0]]
+    for index, duration in zip(indices[1:], durations[1:]):
+        if index is kept[-1] or np.array_equal(index, kept[-1]):
+            times[-1] += duration
+        else:
+            kept.append(index)
+            times.append(duration)
+    return kept, times
+
+
+def diff_frames(indices, transparent, loop=True):
+    """Cropped updates for a GIF: (rect, sub-image, disposal) per frame.
+
+    Each frame writes only the rectangle that differs from what is on
+    screen, with unchanged pixels inside it left transparent. A frame
+    whose successor turns some of its pixels transparent is disposed to
+    the background, and its rectangle grows to cover those pixels, since
+    drawing cannot make a pixel transparent again.
+    """
+    screen = np.full(indices[0].shape, transparent, np.uint8)
+    updates = []
+    for i, target in enumerate(indices):
+        changed = target != screen
+        following = indices[(i + 1) % len(indices)] if loop or i + 1 < len(indices) else None
+        cleared = None
+        if following is not None:
+            cleared = (target != transparent) & (following == transparent)
+            if not cleared.any():
+                cleared = None
+        rect = mask_bbox(changed if cleared is None else changed | cleared) or (0, 0, 1, 1)
+        x0, y0, x1, y1 = rect
+        sub = target[y0:y1, x0:x1].copy()
+        sub[~changed[y0:y1, x0:x1]] = transparent
+        updates.append((rect, sub, 1 if cleared is None else 2))
+        screen = target.copy()
+        if cleared is not None:
+            screen[y0:y1, x0:x1] = transparent
+    return updates
+
+
+def write_gif(path, palette, indices, transparent, durations, scale=1, loop=0):
+    """Encode palette-indexed frames as a GIF with one global colour table and cropped frames."""
+    from PIL import Image
+    from PIL.GifImagePlugin import getdata
+    indices, durations = merge_repeats(indices, durations)
+    h, w = indices[0].shape
+    bits = max(int(transparent).bit_length(), 1)  # The table must hold the transparent index too
+    table = np.zeros((1 << bits, 3), np.uint8)
+    table[:len(palette)] = palette
+    with open(path, "wb") as out:
+        out.write(b"GIF89a" + struct.pack("<HHBBB", w * scale, h * scale, 0xF0 | (bits - 1), transparent, 0))
+        out.write(table.tobytes())
+        if len(indices) > 1:
+            out.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+        for ((x0, y0, _, _), sub, disposal), duration in zip(diff_frames(indices, transparent, loop == 0),
+                                                             durations):
+            image = Image.fromarray(np.ascontiguousarray(scale_nearest(sub, scale)), "P")
+            for chunk in getdata(image, (x0 * scale, y0 * scale), duration=duration, disposal=disposal,
+                                 transparency=transparent):
+                out.write(chunk)
+        out.write(b";")
+    return path
+
+
+def export_animation(project, path, scale=1, background=None, fmt=None, loop=0):
+    """Save the frames (or the composite if there are none) as an animated GIF, APNG or WebP.
+
+    The format comes from fmt or the file extension. Every format uses the
+    project's per-frame durations. GIF and APNG frames share one global
+    palette when the frames have at most 255 colours (APNG keeps full
+    colour otherwise), and each frame stores only the area that changed.
+    Returns the paths written.
+    """
+    fmt = fmt or ANIMATION_FORMATS.get(os.path.splitext(path)[1].lower(), "GIF")
+    frames, durations = common_canvas(list(project.animation())), project.frame_durations()
+    if background is not None:
+        shared = {}
+        for frame in frames:
+            if id(frame) not in shared:
+                opaque = np.empty_like(frame)
+                opaque[..., :3] = flatten_rgb(frame, parse_color(background)[:3])
+                opaque[..., 3] = 255
+                shared[id(frame)] = opaque
+        frames = [shared[id(frame)] for frame in frames]
+    if fmt == "GIF":
+        palette, indices, transparent = global_palette(frames)
+        return [write_gif(path, palette, indices, transparent, durations, scale, loop)]
+
+    from PIL import Image
+    split = palette_indices(np.stack(frames)) if fmt == "APNG" else None
+    if split is not None:
+        palette, indices = split
+        images = []
+        for index in indices:
+            image = Image.fromarray(np.ascontiguousarray(scale_nearest(index, scale)), "P")
+            image.putpalette(palette[:, :3].tobytes())
+            if (palette[:, 3] < 255).any():
+                image.info["transparency"] = palette[:, 3].tobytes()
+            images.append(image)
+    else:
+        images = [to_image(frame, scale) for frame in frames]
+    options = {"lossless": True, "method": 4} if fmt == "WEBP" else {"disposal": 0, "blend": 0}
+    # Pillow stores only the changed rectangle of each APNG or WebP frame
+    images[0].save(path, "PNG" if fmt == "APNG" else fmt, save_all=True, append_images=images[1:],
+                   duration=durations, loop=loop, **options)
+    return [path]
+
+
+def export_gif(project, path, scale=1, background=None):
+    """Save the frames (or the composite if there are none) as a looping GIF."""
+    return export_animation(project, path, scale, background, "GIF")
+
+
+def export_apng(project, path, scale=1, background=None):
+    return export_animation(project, path, scale, background, "APNG")
+
+
+def export_webp(project, path, scale=1, background=None):
+    return export_animation(project, path, scale, background, "WEBP")
+
+
+def sheet_pixels(frames, columns=None):
+    """Lay equally sized frames out left to right, top to bottom, in one buffer."""
+    frames = common_canvas(frames)
+    columns = columns or math.ceil(math.sqrt(len(frames)))
+    rows = math.ceil(len(frames) / columns)
+    h, w = frames[0].shape[:2]
+    sheet = np.zeros((rows * h, columns * w, 4), np.uint8)
+    for index, frame in enumerate(frames):
+        row, col = divmod(index, columns)
+        sheet[row * h:(row + 1) * h, col * w:(col + 1) * w] = frame
+    return sheet
+
+
+def export_sheet(project, path, scale=1, background=None, indexed=False, compress_level=9, columns=None):
+    """Save the frames (or the composite if there are none) as a sprite-sheet PNG."""
+    return [write_png(sheet_pixels(project.animation(), columns), path, scale, background, indexed, compress_level)]
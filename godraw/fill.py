@@ -0,0 +1,84 @@
+"""Scanline flood fill that works on whole spans of a layer buffer."""
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+def match_mask(pixels, color, tolerance=0):
+    """Pixels whose every channel is within tolerance of color."""
+    if tolerance == 0:
+        # Compare whole RGBA pixels as single 32-bit words
+        packed = np.ascontiguousarray(pixels).view(np.uint32)[..., 0]
+        return packed == np.asarray(color, np.uint8).view(np.uint32)[0]
+    mask = np.ones(pixels.shape[:2], bool)
+    for channel, value in enumerate(color):
+        plane = pixels[..., channel]
+        mask &= (plane >= max(int(value) - tolerance, 0)) & (plane <= min(int(value) + tolerance, 255))
+    return mask
+
+
+def _runs(mask):
+    """Horizontal runs of True cells as (rows, starts, ends), ordered by row then column."""
+    h, w = mask.shape
+    padded = np.zeros((h, w + 2), np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    return rows, starts, ends
+
+
+def contiguous_mask(mask, x, y, connectivity=4):
+    """The part of mask connected to (x, y), walked one span at a time."""
+    h, w = mask.shape
+    if not mask[y, x]:
+        return np.zeros_like(mask)
+    rows, starts, ends = _runs(mask)
+    row_start = np.searchsorted(rows, np.arange(h + 1)).tolist()  # first run of every row
+    starts_l, ends_l = starts.tolist(), ends.tolist()
+    reach = 1 if connectivity == 8 else 0  # diagonal neighbours also touch
+
+    seed = bisect_right(ends_l, x, row_start[y], row_start[y + 1])
+    seen = bytearray(len(starts_l))
+    seen[seed] = 1
+    stack = [(y, seed)]
+    filled = []
+    while stack:
+        row, run = stack.pop()
+        filled.append(run)
+        lo, hi = starts_l[run] - reach, ends_l[run] + reach
+        for other in (row - 1, row + 1):
+            if not 0 <= other < h:
+                continue
+            first, last = row_start[other], row_start[other + 1]
+            # Runs in the next row overlapping [lo, hi)
+            for j in range(bisect_right(ends_l, lo, first, last), bisect_left(starts_l, hi, first, last)):
+                if not seen[j]:
+                    seen[j] = 1
+                    stack.append((other, j))
+
+    # Rasterize the filled spans at once: +1 at each start, -1 at each end, then a running sum
+    filled = np.array(filled)
+    edges = np.zeros((h, w + 1), np.int8)
+    edges[rows[filled], starts[filled]] = 1
+    edges[rows[filled], ends[filled]] = -1
+    return np.cumsum(edges[:, :w], axis=1, dtype=np.int8) > 0
+
+
+def fill_mask(pixels, x, y, tolerance=0, connectivity=4, contiguous=True):
+    """Mask of the pixels a fill started at (x, y) would recolour.
+
+    With contiguous=False every pixel matching the start colour is
+    selected, wherever it is on the layer.
+    """
+    mask = match_mask(pixels, pixels[y, x], tolerance)
+    if contiguous:
+        mask = contiguous_mask(mask, x, y, connectivity)
+    return mask
+
+
+def flood_fill(document, x, y, color, tolerance=0, connectivity=4, contiguous=True, index=None):
+    """Fill on a document layer; returns the rect that changed, or None."""
+    pixels = document.snapshot(index)
+    mask = fill_mask(pixels, x, y, tolerance, connectivity, contiguous)
+    return document.fill_mask(mask, color, index)
@@ -0,0 +1,100 @@
+"""Animation frames kept at the document's resolution, with identical frames stored once."""
+import hashlib
+
+import numpy as np
+
+
+def frame_key(pixels):
+    """Content hash of an RGBA buffer, including its shape."""
+    digest = hashlib.blake2b(np.ascontiguousarray(pixels).data, digest_size=16)
+    digest.update(repr(pixels.shape).encode("ascii"))
+    return digest.hexdigest()
+
+
+class FrameStore:
+    """Ordered frames that share one read-only buffer per distinct image.
+
+    Frames are RGBA arrays at the sprite's own size; scaling for the
+    screen or an export happens when they are shown or written. Adding a
+    frame that matches an existing one, or duplicating a frame, only adds
+    a reference. Each frame may also have its own duration in milliseconds
+    (None for the project's default).
+    """
+
+    def __init__(self, frames=(), durations=None):
+        self._order = []  # content key of each frame, in playback order
+        self._pixels = {}  # content key -> shared read-only buffer
+        self._refs = {}  # content key -> number of frames using it
+        self.durations = []  # milliseconds per frame, or None for the default
+        durations = list(durations or [])
+        for index, pixels in enumerate(frames):
+            self.append(pixels, durations[index] if index < len(durations) else None)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return (self._pixels[key] for key in self._order)
+
+    def __getitem__(self, index):
+        return self._pixels[self._order[index]]
+
+    def __delitem__(self, index):
+        self._release(self._order.pop(index))
+        del self.durations[index]
+
+    def key(self, index):
+        return self._order[index]
+
+    def insert(self, index, pixels, duration=None):
+        """Insert a frame; returns its content key."""
+        key = frame_key(pixels)
+        if key not in self._pixels:
+            stored = np.array(pixels, np.uint8)
+            stored.setflags(write=False)  # Shared between frames, so never edited in place
+            self._pixels[key] = stored
+        self._refs[key] = self._refs.get(key, 0) + 1
+        self._order.insert(index, key)
+        self.durations.insert(index, duration)
+        return key
+
+    def append(self, pixels, duration=None):
+        return self.insert(len(self._order), pixels, duration)
+
+    def duplicate(self, index):
+        """Insert a copy of a frame right after it, sharing its pixels."""
+        key = self._order[index]
+        self._refs[key] += 1
+        self._order.insert(index + 1, key)
+        self.durations.insert(index + 1, self.durations[index])
+
+    def move(self, index, target):
+        self._order.insert(target, self._order.pop(index))
+        self.durations.insert(target, self.durations.pop(index))
+
+    def clear(self):
+        self._order.clear()
+        self.durations.clear()
+        self._pixels.clear()
+        self._refs.clear()
+
+    def map(self, function):
+        """Replace every distinct image with function(pixels), keeping the order and durations."""
+        replaced = {key: function(pixels) for key, pixels in self._pixels.items()}
+        order, durations = self._order, self.durations
+        self.__init__()
+        for key, duration in zip(order, durations):
+            self.append(replaced[key], duration)
+
+    def unique(self):
+        """Number of distinct images."""
+        return len(self._pixels)
+
+    @property
+    def nbytes(self):
+        return sum(pixels.nbytes for pixels in self._pixels.values())
+
+    def _release(self, key):
+        self._refs[key] -= 1
+        if not self._refs[key]:
+            del self._refs[key], self._pixels[key]
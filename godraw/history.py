@@ -0,0 +1,159 @@
+"""Undo/redo history that stores only the pixels each action changed."""
+from collections import deque
+
+import numpy as np
+
+from .document import clip_rect, mask_bbox, union_rect
+from .tiles import tile_rect, tile_spans
+
+DEFAULT_BUDGET = 64 * 1024 * 1024  # bytes of history kept before evicting
+
+
+class PixelDelta:
+    """Before/after cells (colours, or palette indices) of the pixels one action changed on one layer.
+
+    The change is kept per layer tile, each part covering only the
+    changed pixels' bounding box inside its tile, so a long thin stroke
+    costs its own pixels rather than the rectangle around it.
+    """
+
+    def __init__(self, layer, parts):
+        self.layer = layer
+        # (rect, packed mask of the changed cells in rect, mask shape, before, after) per tile;
+        # before/after are (n, channels) colours or (n,) indices, in mask order
+        self.parts = [(rect, np.packbits(mask), mask.shape, before, after) for rect, mask, before, after in parts]
+        self.rect = None  # bounding rectangle of the whole change
+        for rect, *_ in parts:
+            self.rect = union_rect(self.rect, rect)
+
+    @property
+    def nbytes(self):
+        return sum(mask.nbytes + before.nbytes + after.nbytes for _, mask, _, before, after in self.parts)
+
+    def undo(self, document):
+        self._apply(0)
+
+    def redo(self, document):
+        self._apply(1)
+
+    def _apply(self, which):
+        for rect, packed, shape, *values in self.parts:
+            mask = np.unpackbits(packed, count=shape[0] * shape[1]).view(bool).reshape(shape)
+            region = self.layer.read_cells(rect)
+            region[mask] = values[which]
+            self.layer.write_cells(rect[0], rect[1], region)
+
+
+class LayersChange:
+    """Swap of the whole layer stack, e.g. after merging layers."""
+
+    def __init__(self, document, before_layers, before_index):
+        self.before = (list(before_layers), before_index)
+        self.after = (list(document.layers), document.active_index)
+        # Only the layers that were replaced are kept alive by this entry
+        current = {id(layer) for layer in self.after[0]}
+        self.nbytes = sum(layer.nbytes for layer in self.before[0] if id(layer) not in current)
+
+    def undo(self, document):
+        document.layers, document.active_index = list(self.before[0]), self.before[1]
+
+    def redo(self, document):
+        document.layers, document.active_index = list(self.after[0]), self.after[1]
+
+
+class Edit:
+    """Collects the original cells of every layer tile one action writes to."""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.saved = {}  # tile key -> (tile rect, cells before the action's first write to it)
+
+    def capture(self, rect, mask=None):
+        """Remember the cells of the tiles under rect the first time each is written; call before writing.
+
+        With a mask (rect-sized), tiles where it is clear are skipped, as
+        the write leaves them alone.
+        """
+        x0, y0 = rect[:2]
+        for key, (sx0, sy0, sx1, sy1) in tile_spans(rect):
+            if key in self.saved:
+                continue
+            if mask is None or mask[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0].any():
+                tile = clip_rect(tile_rect(key), self.layer.width, self.layer.height)
+                if tile is not None:
+                    self.saved[key] = (tile, self.layer.read_cells(tile))
+
+    def delta(self):
+        """Build the PixelDelta for everything written so far, or None."""
+        parts = []
+        for (x0, y0, x1, y1), before in self.saved.values():
+            after = self.layer.read_cells((x0, y0, x1, y1))
+            changed = before != after
+            if changed.ndim == 3:
+                changed = changed.any(axis=-1)
+            bbox = mask_bbox(changed)
+            if bbox is None:
+                continue
+            c0, r0, c1, r1 = bbox
+            mask = changed[r0:r1, c0:c1]
+            parts.append(((x0 + c0, y0 + r0, x0 + c1, y0 + r1), mask,
+                          before[r0:r1, c0:c1][mask], after[r0:r1, c0:c1][mask]))
+        return PixelDelta(self.layer, parts) if parts else None
+
+
+class History:
+    """Undo/redo stacks of compact entries, capped at a byte budget."""
+
+    def __init__(self, document, budget=DEFAULT_BUDGET):
+        self.document = document
+        self.budget = budget
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def begin(self, layer=None):
+        """Start recording writes to a layer (the active one by default)."""
+        self.end()
+        self.document.edit = Edit(layer or self.document.active_layer)
+
+    def end(self):
+        """Finish the current edit and push its delta; returns it or None."""
+        edit, self.document.edit = self.document.edit, None
+        delta = edit.delta() if edit else None
+        if delta is not None:
+            self.push(delta)
+        return delta
+
+    def push(self, entry):
+        self.undo_stack.append(entry)
+        self.nbytes += entry.nbytes
+        self.nbytes -= sum(e.nbytes for e in self.redo_stack)
+        self.redo_stack.clear()
+        # Evict the oldest entries, but always keep the newest one undoable
+        while self.nbytes > self.budget and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.popleft().nbytes
+
+    def undo(self):
+        """Revert the newest entry; returns it so the caller can redraw."""
+        self.end()
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        entry.undo(self.document)
+        self.redo_stack.append(entry)
+        return entry
+
+    def redo(self):
+        self.end()
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        entry.redo(self.document)
+        self.undo_stack.append(entry)
+        return entry
+
+    def clear(self):
+        self.document.edit = None
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
@@ -0,0 +1,164 @@
+"""Reading existing art into a document: images, animations and sprite sheets.
+
+Each source frame is decoded once to an RGBA array. Shrinking it to the
+document, cutting a sheet into cells and quantizing are whole-array numpy
+operations, so a 60-frame GIF costs a few array passes per frame and no
+per-pixel Python or Tk work. Sources that already fit keep their size;
+nothing is scaled up.
+"""
+import numpy as np
+
+from .document import Palette
+from .palette import packed
+
+IMPORT_FORMATS = (".png", ".gif", ".apng", ".webp", ".bmp")
+RESAMPLING = ("nearest", "box")
+HISTOGRAM_BITS = 5  # Bits kept per channel when binning colours for a quantized palette
+
+
+def read_frames(path):
+    """RGBA frames of an image file and their durations in milliseconds."""
+    from PIL import Image, ImageSequence
+    frames, durations = [], []
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            frames.append(np.asarray(frame.convert("RGBA")))
+            durations.append(frame.info.get("duration") or 100)
+    return frames, durations
+
+
+def fit_size(width, height, max_width, max_height):
+    """The largest size of the same aspect within the limits, never larger than (width, height)."""
+    factor = min(max_width / width, max_height / height, 1)
+    return max(round(width * factor), 1), max(round(height * factor), 1)
+
+
+def downsample(pixels, width, height, method="nearest"):
+    """Shrink RGBA pixels to width x height by nearest-neighbour sampling or box averaging.
+
+    Box averaging weights colours by alpha, so transparent pixels do not
+    darken the edges of a sprite.
+    """
+    h, w = pixels.shape[:2]
+    if (w, h) == (width, height):
+        return pixels
+    if method == "nearest" or width > w or height > h:
+        # The source cell under the centre of each target cell
+        rows = (2 * np.arange(height) + 1) * h // (2 * height)
+        cols = (2 * np.arange(width) + 1) * w // (2 * width)
+        return pixels[rows[:, None], cols]
+    if method != "box":
+        raise ValueError(f"unknown resampling {method!r}; expected one of {', '.join(RESAMPLING)}")
+    # Channel planes, so the weighting and the sums run over long contiguous rows
+    planes = np.empty((4, h, w), np.float32)
+    alpha = pixels[..., 3].astype(np.uint16)
+    for channel in range(3):
+        planes[channel] = pixels[..., channel] * alpha
+    planes[3] = alpha
+    rows, cols = box_weights(h, height), box_weights(w, width)
+    sums = rows @ planes @ cols.T  # Two small matrix products sum every box at once
+    area = rows.sum(axis=1)[:, None] * cols.sum(axis=1)
+    out = np.zeros((height, width, 4), np.uint8)
+    shown = sums[3] > 0
+    out[shown, :3] = np.rint(sums[:3, shown] / sums[3, shown]).T
+    out[..., 3] = np.rint(sums[3] / area)
+    return out
+
+
+def box_weights(size, target):
+    """(target, size) matrix adding up the run of source cells that falls in each target cell."""
+    weights = np.zeros((target, size), np.float32)
+    weights[np.arange(size) * target // size, np.arange(size)] = 1
+    return weights
+
+
+def split_sheet(pixels, columns, rows, keep_empty=False):
+    """Cut a sprite sheet into columns x rows equal cells, left to right, top to bottom.
+
+    Fully transparent cells, such as the unused end of the last row, are
+    dropped unless keep_empty is set.
+    """
+    h, w = pixels.shape[0] // rows, pixels.shape[1] // columns
+    if not (w and h):
+        raise ValueError(f"a {pixels.shape[1]}x{pixels.shape[0]} sheet has no {columns}x{rows} grid of cells")
+    cells = pixels[:rows * h, :columns * w].reshape(rows, h, columns, w, 4).swapaxes(1, 2).reshape(-1, h, w, 4)
+    if not keep_empty:
+        cells = cells[cells[..., 3].any(axis=(1, 2))]
+    return list(cells)
+
+
+def histogram_palette(frames, colors=255):
+    """Up to `colors` RGBA colours for the frames: exact if they use that few, else from a histogram.
+
+    The histogram bins colours by their top HISTOGRAM_BITS bits per
+    channel; the most used bins give the palette, each as the mean of
+    the colours that fell in it. Most used colours come first.
+    """
+    codes = np.concatenate([packed(frame).ravel() for frame in frames])
+    codes = codes[codes.view(np.uint8).reshape(-1, 4)[:, 3] > 0]
+    if not len(codes):
+        return []
+    used, counts = np.unique(codes, return_counts=True)
+    if len(used) <= colors:
+        rgba = used.view(np.uint8).reshape(-1, 4)[np.argsort(-counts, kind="stable")]
+        return [tuple(int(c) for c in color) for color in rgba]
+    rgb = used.view(np.uint8).reshape(-1, 4)[:, :3].astype(np.int64)
+    shift = 8 - HISTOGRAM_BITS
+    bins = ((rgb[:, 0] >> shift) << 2 * HISTOGRAM_BITS) | ((rgb[:, 1] >> shift) << HISTOGRAM_BITS) | (rgb[:, 2] >> shift)
+    size = 1 << 3 * HISTOGRAM_BITS
+    weight = np.bincount(bins, counts, size)
+    top = np.argsort(-weight, kind="stable")[:colors]
+    top = top[weight[top] > 0]
+    means = np.stack([np.bincount(bins, rgb[:, c] * counts, size)[top] for c in range(3)], axis=1) / weight[top, None]
+    return [tuple(int(c) for c in color) + (255,) for color in np.rint(means)]
+
+
+def quantize(frames, colors=255):
+    """The frames with every colour replaced by its nearest entry of a histogram palette.
+
+    Each distinct colour of all the frames together is matched once.
+    Returns (frames, palette colours).
+    """
+    palette = Palette(histogram_palette(frames, colors))
+    cells = palette.index(np.concatenate([frame.reshape(-1, 4) for frame in frames]))
+    pixels = palette.colors[cells]
+    ends = np.cumsum([frame.shape[0] * frame.shape[1] for frame in frames])[:-1]
+    return [part.reshape(frame.shape) for part, frame in zip(np.split(pixels, ends), frames)], palette.entries()
+
+
+def import_image(path, width, height, method="nearest", colors=None, sheet=None):
+    """Frames of an image, animation or sprite sheet fitted into width x height: (frames, durations).
+
+    sheet is (columns, rows) to cut a single image into cells; colors
+    quantizes every frame to that many colours.
+    """
+    frames, durations = read_frames(path)
+    if sheet is not None and sheet != (1, 1):
+        frames = [cell for frame in frames for cell in split_sheet(frame, *sheet)]
+        durations = [durations[0]] * len(frames)
+        if not frames:
+            raise ValueError(f"{path} has nothing drawn in its sheet cells")
+    h, w = frames[0].shape[:2]
+    size = fit_size(w, h, width, height)
+    frames = [downsample(frame, *size, method) for frame in frames]
+    if colors:
+        frames, _ = quantize(frames, colors)
+    return frames, durations
+
+
+def padded(pixels, width, height):
+    """pixels placed at the top-left of a transparent width x height buffer."""
+    h, w = pixels.shape[:2]
+    if (w, h) == (width, height):
+        return pixels
+    out = np.zeros((height, width, 4), np.uint8)
+    out[:min(h, height), :min(w, width)] = pixels[:height, :width]
+    return out
+
+
+def add_image_layers(document, frames, name):
+    """Append one layer per frame, named after the source, and make the last one active."""
+    for index, pixels in enumerate(frames):
+        layer = document.add_layer(name if len(frames) == 1 else f"{name} {index + 1}")
+        layer.write_region(0, 0, padded(pixels, document.width, document.height))
+    return document.layers[len(document.layers) - len(frames):]
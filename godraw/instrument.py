@@ -0,0 +1,127 @@
+"""Opt-in latency instrumentation: per-call timings, Tcl call counts and Chrome traces.
+
+An Instrument wraps chosen methods of live objects. Every call becomes a
+span with its duration and the number of Tcl commands issued while it
+ran, which feeds a per-name latency histogram and, up to a limit, a
+trace that chrome://tracing and Perfetto can open. Nothing here imports
+Tk; Tcl calls are counted by a proxy around the interpreter object.
+"""
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 133, 250, 500, 1000)  # Upper edges of the histogram
+MAX_EVENTS = 200000  # Trace events kept; older ones are dropped first
+SAMPLES = 4096  # Recent durations kept per name for percentiles
+
+
+class TclCounter:
+    """Stands in for a tkapp and counts its call() invocations; everything else passes through."""
+
+    def __init__(self, tk, instrument):
+        self._tk = tk
+        self._instrument = instrument
+
+    def call(self, *args):
+        self._instrument.tcl_calls += 1
+        return self._tk.call(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._tk, name)
+
+
+class Stats:
+    """Histogram and recent samples of one name's durations."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.tcl_calls = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.recent = deque(maxlen=SAMPLES)
+
+    def add(self, ms, tcl_calls):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.tcl_calls += tcl_calls
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.recent.append(ms)
+
+    def percentile(self, fraction):
+        ordered = sorted(self.recent)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+    def summary(self):
+        labels = [f"<={edge}ms" for edge in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        return {"calls": self.count, "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+                "p50_ms": round(self.percentile(0.5), 3), "p95_ms": round(self.percentile(0.95), 3),
+                "p99_ms": round(self.percentile(0.99), 3), "max_ms": round(self.max_ms, 3),
+                "tcl_calls_per_call": round(self.tcl_calls / self.count, 1) if self.count else 0.0,
+                "histogram": {label: n for label, n in zip(labels, self.buckets) if n}}
+
+
+class Instrument:
+    def __init__(self):
+        self.stats = defaultdict(Stats)
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.tcl_calls = 0  # Running total, read at the start and end of each span
+        self.started = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    def count_tcl(self, widget):
+        """Count Tcl calls made through widget's interpreter and every widget created after this."""
+        counter = TclCounter(widget.tk, self)
+        widget.tk = counter
+        return counter
+
+    def timed(self, name, function):
+        """function wrapped so each call is recorded under name."""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tcl_before = self.tcl_calls
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end = time.perf_counter_ns()
+                self.record(name, start, end, self.tcl_calls - tcl_before)
+        return wrapper
+
+    def wrap(self, obj, names, prefix=None):
+        """Replace obj's methods with timed ones; bindings made afterwards see the wrappers."""
+        prefix = prefix or type(obj).__name__
+        for name in names:
+            setattr(obj, name, self.timed(f"{prefix}.{name}", getattr(obj, name)))
+
+    def record(self, name, start_ns, end_ns, tcl_calls=0):
+        ms = (end_ns - start_ns) / 1e6
+        self.stats[name].add(ms, tcl_calls)
+        self.events.append({"name": name, "ph": "X", "ts": (start_ns - self.started) / 1000,
+                            "dur": (end_ns - start_ns) / 1000, "pid": self.pid,
+                            "tid": threading.get_ident(), "args": {"tcl_calls": tcl_calls}})
+
+    def summary(self):
+        return {name: stats.summary() for name, stats in sorted(self.stats.items())}
+
+    def overlay_text(self, names):
+        """A few lines of recent latency for an on-screen overlay."""
+        lines = []
+        for name in names:
+            stats = self.stats.get(name)
+            if stats and stats.count:
+                lines.append(f"{name.split('.')[-1]}: {stats.recent[-1]:.1f} ms "
+                             f"(p95 {stats.percentile(0.95):.1f}, {stats.tcl_calls / stats.count:.0f} tcl)")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """Write a Chrome trace (chrome://tracing, Perfetto) with the summary as metadata."""
+        with open(path, "w", encoding="utf-8") as out:
+            json.dump({"traceEvents": list(self.events), "displayTimeUnit": "ms",
+                       "otherData": {"summary": self.summary(), "tcl_calls": self.tcl_calls}}, out)
+        return path
@@ -0,0 +1,295 @@
+"""Crash-safe autosave: an append-only journal of edits plus periodic project snapshots.
+
+The UI thread only puts records on a queue; a background thread encodes
+them, appends them to the journal file and, when asked, writes a snapshot
+of the whole project and starts an empty journal. Every journal record
+sets pixels or layer settings to known values, so replaying a record that
+the snapshot already contains is harmless.
+
+Each record is framed as (payload length, crc32) followed by the payload:
+a JSON description and the raw arrays it refers to. Recovery stops at the
+first torn or corrupt record.
+
+Every editor journals into its own session directory under AUTOSAVE_DIR
+and holds an exclusive lock on a file in it while it runs. A session whose
+lock is free was left by an editor that is gone, so only those are offered
+for recovery; a second window never mistakes a live session for a crash.
+"""
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from .project import load_project, save_project
+
+AUTOSAVE_DIR = os.path.join(os.path.expanduser("~"), ".godraw", "autosave")
+SNAPSHOT = "autosave.godraw"
+JOURNAL = "autosave.journal"
+LOCK = "session.lock"
+SESSION_PREFIX = "session-"
+FRAME = struct.Struct("<II")
+COMPACT_BYTES = 8 * 1024 * 1024  # journal size that makes a snapshot worthwhile
+COMPACT_RECORDS = 500
+
+
+def encode(meta, arrays):
+    """One framed journal record."""
+    meta = dict(meta, arrays=[[list(a.shape), a.dtype.str] for a in arrays])
+    head = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    payload = b"".join([struct.pack("<I", len(head)), head] + [np.ascontiguousarray(a).tobytes() for a in arrays])
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(data):
+    """Yield (meta, arrays) for every intact record in journal bytes."""
+    pos = 0
+    while pos + FRAME.size <= len(data):
+        length, crc = FRAME.unpack_from(data, pos)
+        payload = data[pos + FRAME.size:pos + FRAME.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return  # Torn write at the moment of the crash
+        pos += FRAME.size + length
+        (head_length,) = struct.unpack_from("<I", payload)
+        meta = json.loads(payload[4:4 + head_length].decode("utf-8"))
+        arrays, offset = [], 4 + head_length
+        for shape, dtype in meta["arrays"]:
+            count = int(np.prod(shape))
+            arrays.append(np.frombuffer(payload, dtype, count, offset).reshape(shape))
+            offset += count * np.dtype(dtype).itemsize
+        yield meta, arrays
+
+
+class Journal:
+    """Background autosave into a directory holding one snapshot and one journal.
+
+    The directory is locked for as long as the journal is open; raises
+    OSError if another editor holds it.
+    """
+
+    def __init__(self, directory, fsync=True):
+        self.lock = lock_session(directory)
+        if self.lock is None:
+            raise OSError(f"autosave directory {directory} is in use by another editor")
+        self.directory = directory
+        self.fsync = fsync
+        self.queue = queue.Queue()
+        self.compact_due = False  # Set by the writer; the UI answers with snapshot()
+        self.records = 0  # since the last snapshot
+        self.journal_bytes = 0
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+        self.error = None  # Last exception raised while writing
+        self.thread = threading.Thread(target=self._run, name="godraw-autosave", daemon=True)
+        self.thread.start()
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, SNAPSHOT)
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.directory, JOURNAL)
+
+    # Called from the UI thread; none of these touch the disk
+
+    def record(self, document, delta, undone=False):
+        """Journal the state a PixelDelta leaves behind (its before state if it was undone)."""
+        if delta.layer not in document.layers:
+            return
+        index = document.layers.index(delta.layer)
+        for rect, mask, shape, before, after in delta.parts:
+            meta = {"kind": "pixels", "layer": index, "rect": list(rect), "shape": list(shape)}
+            self.queue.put(("record", meta, [mask, before if undone else after]))
+
+    def record_layer(self, document, index):
+        """Journal a layer's name, visibility, opacity and blend mode."""
+        layer = document.layers[index]
+        meta = {"kind": "layer", "layer": index, "name": layer.name, "visible": layer.visible,
+                "opacity": layer.opacity, "blend_mode": layer.blend_mode}
+        self.queue.put(("record", meta, []))
+
+    def snapshot(self, project):
+        """Save a project the UI will not modify (e.g. built from Document.copy()) and restart the journal."""
+        self.compact_due = False
+        self.queue.put(("snapshot", project, None))
+
+    def flush(self):
+        """Wait until everything queued so far is on disk (for tests and shutdown)."""
+        self.queue.join()
+
+    def close(self, discard=False):
+        """Stop the writer; discard=True removes the autosave after a clean exit."""
+        self.queue.put(("stop", None, None))
+        self.thread.join()
+        if discard:
+            discard_autosave(self.directory, self.lock)
+        else:
+            self.lock.close()
+
+    def stats(self):
+        seconds = self.write_seconds
+        return {"records": self.records, "journal_bytes": self.journal_bytes, "bytes_written": self.bytes_written,
+                "write_seconds": round(seconds, 4),
+                "throughput_mb_s": round(self.bytes_written / seconds / 1e6, 1) if seconds else None}
+
+    # Writer thread
+
+    def _run(self):
+        out = None
+        while True:
+            batch = [self.queue.get()]
+            # Drain whatever else is queued so one write and one fsync cover it all
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                start = time.perf_counter()
+                pending = []
+                for action, meta, arrays in batch:
+                    if action == "record":
+                        pending.append(encode(meta, arrays))
+                        continue
+                    out = self._write(out, pending)
+                    pending = []
+                    if action == "snapshot":
+                        out = self._snapshot(out, meta)
+                    elif action == "stop":
+                        if out is not None:
+                            out.close()
+                        return
+                out = self._write(out, pending)
+                self.write_seconds += time.perf_counter() - start
+            except Exception as error:  # Keep the editor running; autosave is best effort
+                self.error = error
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, out, records):
+        if not records:
+            return out
+        if out is None:
+            out = open(self.journal_path, "ab")
+        data = b"".join(records)
+        out.write(data)
+        out.flush()
+        if self.fsync:
+            os.fsync(out.fileno())
+        self.records += len(records)
+        self.journal_bytes += len(data)
+        self.bytes_written += len(data)
+        if self.journal_bytes > COMPACT_BYTES or self.records > COMPACT_RECORDS:
+            self.compact_due = True
+        return out
+
+    def _snapshot(self, out, project):
+        save_project(project, self.snapshot_path)
+        self.bytes_written += os.path.getsize(self.snapshot_path)
+        # Records written before this point are in the snapshot now
+        if out is not None:
+            out.close()
+        self.records = self.journal_bytes = 0
+        return open(self.journal_path, "wb")
+
+
+def has_autosave(directory):
+    return os.path.exists(os.path.join(directory, SNAPSHOT))
+
+
+def lock_session(directory):
+    """Open and exclusively lock the directory's lock file; None if another process holds it.
+
+    The lock lasts until the returned file is closed or the process ends,
+    however it ends.
+    """
+    os.makedirs(directory, exist_ok=True)
+    handle = open(os.path.join(directory, LOCK), "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def new_session(root):
+    """A fresh session directory under root for this editor."""
+    return os.path.join(root, f"{SESSION_PREFIX}{os.getpid()}-{time.time_ns()}")
+
+
+def claim_autosave(root):
+    """(directory, lock) of the newest autosave under root whose editor is gone, or None.
+
+    The lock is held so no other editor recovers the same session; close
+    it, or pass it to discard_autosave, when done.
+    """
+    if not os.path.isdir(root):
+        return None
+    directories = [root] + [os.path.join(root, name) for name in os.listdir(root) if name.startswith(SESSION_PREFIX)]
+    directories = [directory for directory in directories if has_autosave(directory)]
+    directories.sort(key=lambda directory: os.path.getmtime(os.path.join(directory, SNAPSHOT)), reverse=True)
+    for directory in directories:
+        lock = lock_session(directory)
+        if lock is not None:
+            return directory, lock
+    return None
+
+
+def discard_autosave(directory, lock):
+    """Delete a locked session's snapshot, journal and lock, and its directory if it is a session's own."""
+    lock.close()
+    for name in (SNAPSHOT, JOURNAL, LOCK):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    if os.path.basename(directory).startswith(SESSION_PREFIX):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass  # Something else was put there; leave it
+
+
+def recover(directory):
+    """Rebuild the autosaved project: load the snapshot, then replay the journal.
+
+    Returns (project, stats) where stats has the records replayed and the
+    seconds it took.
+    """
+    start = time.perf_counter()
+    project = load_project(os.path.join(directory, SNAPSHOT))
+    document = project.document
+    path = os.path.join(directory, JOURNAL)
+    data = b""
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            data = f.read()
+    replayed = 0
+    for meta, arrays in decode(data):
+        if not 0 <= meta["layer"] < len(document.layers):
+            continue
+        layer = document.layers[meta["layer"]]
+        if meta["kind"] == "pixels":
+            packed, values = arrays
+            rows, cols = meta["shape"]
+            mask = np.unpackbits(packed, count=rows * cols).view(bool).reshape(rows, cols)
+            region = layer.read_cells(tuple(meta["rect"]))
+            region[mask] = values
+            layer.write_cells(meta["rect"][0], meta["rect"][1], region)
+        elif meta["kind"] == "layer":
+            layer.name, layer.visible = meta["name"], meta["visible"]
+            layer.opacity, layer.blend_mode = meta["opacity"], meta["blend_mode"]
+        replayed += 1
+    return project, {"records": replayed, "seconds": round(time.perf_counter() - start, 4)}
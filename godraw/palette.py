@@ -0,0 +1,145 @@
+"""Indexed colour: converting documents to and from palettes, palette files and palette swaps.
+
+An indexed document keeps one Palette shared by all its layers, and each
+layer stores a byte per pixel that is looked up in it when rendered. So
+editing, swapping or cycling palette entries costs O(palette) however
+many pixels use them. Animation frames are flattened RGBA, so a swap
+remaps them colour by colour, once per distinct frame.
+"""
+import os
+
+import numpy as np
+
+from .document import IndexedLayer, Layer, Palette, parse_color, to_hex
+from .tiles import TILE_SIZE
+
+PALETTE_FORMATS = (".hex", ".gpl", ".pal")  # Plus any image Pillow reads
+
+
+def packed(pixels):
+    """RGBA pixels as one uint32 per pixel."""
+    return np.ascontiguousarray(pixels, np.uint8).view(np.uint32)[..., 0]
+
+
+def document_palette(document, colors=255):
+    """A palette for every layer's colours: exact if they fit in `colors`, else median-cut.
+
+    Exact palettes list the most used colours first.
+    """
+    tiles = [tile for layer in document.layers for tile in layer.tiles.values()]
+    if not tiles:
+        return Palette()
+    codes, counts = np.unique(np.concatenate([packed(tile).ravel() for tile in tiles]), return_counts=True)
+    rgba = codes.view(np.uint8).reshape(-1, 4)
+    visible = rgba[:, 3] > 0
+    rgba, counts = rgba[visible], counts[visible]
+    if len(rgba) <= colors:
+        return Palette(tuple(color) for color in rgba[np.argsort(-counts, kind="stable")])
+    from .export import global_palette
+    rgb, _, _ = global_palette(tiles, colors)
+    return Palette(tuple(color) + (255,) for color in rgb)
+
+
+def to_indexed(document, palette=None):
+    """Turn every layer into an IndexedLayer in place; colours the palette lacks get its nearest entry.
+
+    Without a palette one is made from the document's colours. Returns
+    the palette.
+    """
+    if palette is None:
+        palette = document_palette(document)
+    layers = []
+    for layer in document.layers:
+        indexed = IndexedLayer(layer.width, layer.height, palette, layer.name)
+        indexed.visible, indexed.opacity, indexed.blend_mode = layer.visible, layer.opacity, layer.blend_mode
+        for (col, row), tile in layer.tiles.items():
+            indexed.write_region(col * TILE_SIZE, row * TILE_SIZE, tile)
+        layers.append(indexed)
+    document.palette = palette
+    document.layers = layers
+    return palette
+
+
+def to_rgba(document):
+    """Turn every indexed layer back into an RGBA layer in place, with the palette's current colours."""
+    layers = []
+    for layer in document.layers:
+        if isinstance(layer, IndexedLayer):
+            rgba = Layer(layer.width, layer.height, layer.name)
+            rgba.visible, rgba.opacity, rgba.blend_mode = layer.visible, layer.opacity, layer.blend_mode
+            rgba.tiles = {key: layer.palette.colors[tile] for key, tile in layer.tiles.items()}
+            layer = rgba
+        layers.append(layer)
+    document.palette = None
+    document.layers = layers
+
+
+def remap_colors(pixels, old, new):
+    """pixels with each colour in old replaced by the colour at the same position in new.
+
+    Each distinct colour of pixels is looked up once in the sorted old
+    colours; colours not in old are kept.
+    """
+    count = min(len(old), len(new))
+    if not count:
+        return pixels
+    old_codes, new_codes = packed(np.array(old[:count])), packed(np.array(new[:count]))
+    order = np.argsort(old_codes, kind="stable")
+    old_codes, new_codes = old_codes[order], new_codes[order]
+    codes, inverse = np.unique(packed(pixels), return_inverse=True)
+    position = np.searchsorted(old_codes, codes).clip(0, count - 1)
+    mapped = np.where(old_codes[position] == codes, new_codes[position], codes)
+    return mapped[inverse].reshape(pixels.shape[:2]).view(np.uint8).reshape(pixels.shape)
+
+
+def swap_palette(document, frames, colors):
+    """Give the document's palette new colours and recolour the frames to match.
+
+    The indexed layers change through the lookup table alone. frames may
+    be a FrameStore, remapped in place, or a list; returns the frames.
+    Entries past the end of a shorter palette become transparent.
+    """
+    old = document.palette.entries()
+    document.palette.set_colors(colors)
+    new = document.palette.entries()
+    if hasattr(frames, "map"):
+        frames.map(lambda pixels: remap_colors(pixels, old, new))
+        return frames
+    return [remap_colors(frame, old, new) for frame in frames]
+
+
+def load_palette(path):
+    """RGBA colours of a palette file: .hex, GIMP .gpl, JASC .pal, or the distinct colours of an image."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in PALETTE_FORMATS:
+        with open(path, encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        if ext == ".hex":
+            colors = [parse_color("#" + line.lstrip("#")[:6]) for line in lines]
+        elif ext == ".gpl":
+            # A header ("GIMP Palette", Name:, Columns:) and comments, then "r g b name" lines
+            colors = [tuple(int(c) for c in line.split()[:3]) + (255,) for line in lines
+                      if line[0].isdigit()]
+        else:
+            # JASC-PAL, version, count, then "r g b" lines
+            colors = [tuple(int(c) for c in line.split()[:3]) + (255,) for line in lines[3:]]
+    else:
+        from PIL import Image
+        with Image.open(path) as image:
+            pixels = packed(np.asarray(image.convert("RGBA"))).ravel()
+        codes, first = np.unique(pixels, return_index=True)
+        rgba = codes[np.argsort(first)].view(np.uint8).reshape(-1, 4)  # In order of first use
+        colors = [tuple(int(c) for c in color) for color in rgba if color[3] > 0]
+    if len(colors) >= Palette.SIZE:
+        raise ValueError(f"{path} has {len(colors)} colours; a palette holds at most {Palette.SIZE - 1}")
+    return colors
+
+
+def save_palette(palette, path):
+    """Write the palette's colours as .hex, or as GIMP .gpl for any other extension."""
+    with open(path, "w", encoding="utf-8") as out:
+        if os.path.splitext(path)[1].lower() == ".hex":
+            out.writelines(to_hex(color)[1:] + "\n" for color in palette.entries())
+        else:
+            out.write(f"GIMP Palette\nName: {os.path.splitext(os.path.basename(path))[0]}\nColumns: 16\n#\n")
+            out.writelines("%3d %3d %3d\t%s\n" % (color[:3] + (to_hex(color),)) for color in palette.entries())
@@ -0,0 +1,96 @@
+"""Animation preview timing and onion skins, without Tk."""
+import bisect
+import math
+import time
+
+import numpy as np
+
+from .compositor import composite, to_rgba8
+
+ONION_TINTS = ((255, 48, 48), (48, 128, 255))  # Colour of the frames before and after the current one
+
+
+class PlaybackClock:
+    """Which frame is due, measured from a fixed start on the monotonic clock.
+
+    Each tick works out the frame from the time elapsed since playback
+    started, so slow ticks never push later frames back. When a tick
+    comes late, the frames it missed are skipped and counted. duration
+    is milliseconds per frame, or a list with one entry per frame.
+    """
+
+    def __init__(self, count, duration, now=None):
+        self.count = count
+        self._set_ends(duration)
+        self.start = time.perf_counter() if now is None else now
+        self.step = -1  # Frames since start at the last tick
+        self.sample_start = self.start  # fps() counts the frames shown since then
+        self.shown = 0
+        self.skipped = 0
+
+    def _set_ends(self, duration):
+        if not isinstance(duration, (list, tuple)):
+            duration = [duration] * self.count
+        self.ends = []  # seconds from the start of a loop to the end of each frame
+        total = 0.0
+        for ms in duration[:self.count]:
+            total += ms / 1000
+            self.ends.append(total)
+        self.loop = total
+
+    def offset(self, step):
+        """Seconds from the start to the moment frame `step` (counted across loops) is due."""
+        loops, index = divmod(step, self.count)
+        return loops * self.loop + (self.ends[index - 1] if index else 0.0)
+
+    def tick(self, now=None):
+        """Returns (frame index to show or None, milliseconds until the next frame is due)."""
+        now = time.perf_counter() if now is None else now
+        elapsed = now - self.start
+        loops, into = divmod(elapsed, self.loop)
+        step = int(loops) * self.count + min(bisect.bisect_right(self.ends, into), self.count - 1)
+        index = None
+        if step != self.step:
+            if self.step >= 0:
+                self.skipped += max(step - self.step - 1, 0)
+            self.step = step
+            self.shown += 1
+            index = step % self.count
+        delay = self.offset(step + 1) - elapsed
+        return index, max(math.ceil(round(delay * 1000, 6)), 1)  # Rounded so float noise adds no millisecond
+
+    def set_duration(self, duration, now=None):
+        """Change the speed, carrying on from the frame on screen; the fps sample starts again."""
+        now = time.perf_counter() if now is None else now
+        self._set_ends(duration)
+        self.start = now - self.offset(max(self.step, 0))
+        self.sample_start = now
+        self.shown = 0
+
+    def fps(self, now=None):
+        """Frames shown per second since playback started or last changed speed."""
+        elapsed = (time.perf_counter() if now is None else now) - self.sample_start
+        return self.shown / elapsed if elapsed > 0 else 0.0
+
+
+def onion_neighbours(count, index, before, after):
+    """Indices of the frames shown faintly around index, nearest first within each side."""
+    return ([i for i in range(index - 1, index - before - 1, -1) if i >= 0],
+            [i for i in range(index + 1, index + after + 1) if i < count])
+
+
+def onion_skin(current, earlier, later, opacity=0.35):
+    """The current frame over tinted, fading copies of its neighbours.
+
+    earlier and later are lists of RGBA frames, nearest first; each step
+    further away is drawn fainter.
+    """
+    dst = np.zeros(current.shape, np.float32)
+    for frames, tint in ((earlier, ONION_TINTS[0]), (later, ONION_TINTS[1])):
+        # Farthest first so nearer frames end up on top
+        for distance, frame in reversed(list(enumerate(frames, 1))):
+            ghost = frame.copy()
+            ghost[..., :3] = (frame[..., :3].astype(np.uint16) + tint) // 2
+            composite(dst, ghost, opacity / distance)
+    composite(dst, current)
+    return to_rgba8(dst)
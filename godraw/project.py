@@ -0,0 +1,206 @@
+"""A sprite project: the layered document plus its animation frames, saved as one file.
+
+Version 2 files are chunked binary:
+
+    magic (8 bytes) | version (u16) | flags (u16) | header offset (u64) | header length (u64)
+    chunks ...
+    header (UTF-8 JSON)
+
+Every layer tile and every frame is one chunk, stored zlib-compressed or
+raw when compression does not pay off. The header at the end lists the
+offset, length and codec of each chunk, so opening a project reads only
+the header and the frames; layer tiles are read when a layer is first
+used, and raw chunks are memory-mapped instead of copied. Indexed
+documents also store their palette, and their layer tiles hold one
+palette index per pixel. Version 1 zip projects can still be opened.
+"""
+import io
+import json
+import os
+import struct
+import zipfile
+import zlib
+
+import numpy as np
+
+from .document import Document, IndexedLayer, Layer, Palette
+from .tiles import TILE_SIZE
+
+FORMAT = "godraw"
+VERSION = 2
+EXTENSION = ".godraw"
+MAGIC = b"GODRAW\r\n"  # The line ending catches files mangled by text-mode transfers
+PREAMBLE = struct.Struct("<8sHHQQ")
+COMPRESS_LEVEL = 6  # zlib level for chunks; fast to write and still small
+
+
+class Project:
+    """Everything that makes up one sprite, with no GUI state."""
+
+    def __init__(self, document=None, frames=None, frame_duration=100, durations=None):
+        self.document = document or Document()
+        self.frames = frames if frames is not None else []  # RGBA arrays at document size, or a FrameStore
+        self.frame_duration = frame_duration  # milliseconds per frame
+        self.durations = durations  # Per-frame milliseconds (None entries use frame_duration), or None
+
+    def animation(self):
+        """Frames to animate; a project without saved frames animates its composite."""
+        return self.frames or [self.document.flatten()]
+
+    def frame_durations(self):
+        """Milliseconds to show each frame of animation()."""
+        durations = list(self.durations or [])[:len(self.frames)]
+        durations += [None] * (max(len(self.frames), 1) - len(durations))
+        return [self.frame_duration if duration is None else duration for duration in durations]
+
+
+class _ChunkWriter:
+    def __init__(self, out, compress):
+        self.out = out
+        self.compress = compress
+
+    def write(self, array):
+        """Append one buffer as a chunk; returns its [offset, length, codec]."""
+        raw = np.ascontiguousarray(array).tobytes()
+        data, codec = raw, "raw"
+        if self.compress:
+            packed = zlib.compress(raw, COMPRESS_LEVEL)
+            if len(packed) < len(raw):
+                data, codec = packed, "zlib"
+        offset = self.out.tell()
+        self.out.write(data)
+        return [offset, len(data), codec]
+
+
+def save_project(project, path, compress=True):
+    """Write a project as a version 2 chunked file.
+
+    With compress=False every chunk is stored raw, which makes the file
+    larger but lets load_project memory-map it. The file is written next
+    to path and moved into place, so a crash never leaves half a project
+    and projects already open from path keep their mapped data.
+    """
+    document = project.document
+    header = {
+        "format": FORMAT,
+        "version": VERSION,
+        "width": document.width,
+        "height": document.height,
+        "tile_size": TILE_SIZE,
+        "active": document.active_index,
+        "frame_duration": project.frame_duration,
+        "durations": project.durations,
+        "palette": None if document.palette is None else [list(color) for color in document.palette.entries()],
+        "layers": [],
+        "frames": [],
+    }
+    temp = path + ".tmp"
+    with open(temp, "wb") as out:
+        out.write(PREAMBLE.pack(MAGIC, VERSION, 0, 0, 0))
+        chunks = _ChunkWriter(out, compress)
+        for layer in document.layers:
+            tiles = [[col, row] + chunks.write(tile) for (col, row), tile in sorted(layer.tiles.items())]
+            header["layers"].append({"name": layer.name, "visible": layer.visible, "opacity": layer.opacity,
+                                     "blend_mode": layer.blend_mode, "indexed": isinstance(layer, IndexedLayer),
+                                     "tiles": tiles})
+        written = {}  # Frames shared by a FrameStore are stored once
+        for frame in project.frames:
+            if id(frame) not in written:
+                written[id(frame)] = chunks.write(frame)
+            header["frames"].append({"shape": list(frame.shape), "chunk": written[id(frame)]})
+        data = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        offset = out.tell()
+        out.write(data)
+        out.seek(0)
+        out.write(PREAMBLE.pack(MAGIC, VERSION, 0, offset, len(data)))
+    os.replace(temp, path)
+
+
+class _ChunkReader:
+    def __init__(self, path):
+        self.path = path
+        self.mapped = None  # Copy-on-write map of the file, opened for the first raw chunk
+
+    def read(self, entries):
+        """Read (key, chunk, shape) entries with one open file; returns {key: array}.
+
+        The arrays are writable: decompressed chunks are private copies and
+        raw chunks are copy-on-write views of the mapped file.
+        """
+        out = {}
+        with open(self.path, "rb") as f:
+            for key, (offset, length, codec), shape in entries:
+                if codec == "zlib":
+                    f.seek(offset)
+                    data = np.frombuffer(bytearray(zlib.decompress(f.read(length))), np.uint8)
+                elif codec == "raw":
+                    if self.mapped is None:
+                        self.mapped = np.memmap(self.path, np.uint8, mode="c")
+                    data = self.mapped[offset:offset + length]
+                else:
+                    raise ValueError(f"{self.path}: unknown chunk codec {codec!r}")
+                out[key] = data.reshape(shape)
+        return out
+
+    def read_tiles(self, entries, size, layer):
+        """Tiles of an empty layer's kind, re-cut if the file was written with another tile size."""
+        tiles = self.read([(key, chunk, (size, size) + layer.CELL) for key, chunk in entries])
+        if size == TILE_SIZE:
+            return tiles
+        for (col, row), tile in tiles.items():
+            layer.write_cells(col * size, row * size, tile)
+        return layer.tiles
+
+
+def load_project(path):
+    """Read a project written by save_project (version 1 or 2)."""
+    if zipfile.is_zipfile(path):
+        return _load_zip(path)
+    with open(path, "rb") as f:
+        magic, version, _, offset, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != MAGIC or version > VERSION:
+            raise ValueError(f"{path} is not a GoDraw project this version can read")
+        f.seek(offset)
+        header = json.loads(f.read(length).decode("utf-8"))
+
+    reader = _ChunkReader(path)
+    size = header["tile_size"]
+    document = Document(header["width"], header["height"])
+    if header.get("palette") is not None:
+        document.palette = Palette(tuple(color) for color in header["palette"])
+    for entry in header["layers"]:
+        if entry.get("indexed"):
+            layer = IndexedLayer(document.width, document.height, document.palette, entry["name"])
+        else:
+            layer = Layer(document.width, document.height, entry["name"])
+        layer.visible, layer.opacity, layer.blend_mode = entry["visible"], entry["opacity"], entry["blend_mode"]
+        tiles = [((col, row), chunk) for col, row, *chunk in entry["tiles"]]
+        layer.defer(lambda tiles=tiles, layer=layer: reader.read_tiles(tiles, size, layer.blank()))
+        document.layers.append(layer)
+    document.active_index = min(header["active"], max(len(document.layers) - 1, 0))
+    chunks = {entry["chunk"][0]: (entry["chunk"], tuple(entry["shape"])) for entry in header["frames"]}
+    shared = reader.read([(offset, chunk, shape) for offset, (chunk, shape) in chunks.items()])
+    frames = [shared[entry["chunk"][0]] for entry in header["frames"]]
+    return Project(document, frames, header["frame_duration"], header.get("durations"))
+
+
+def _png_pixels(data):
+    from PIL import Image
+    return np.asarray(Image.open(io.BytesIO(data)).convert("RGBA"))
+
+
+def _load_zip(path):
+    """Read a version 1 project: a zip of a JSON manifest and one PNG per layer and frame."""
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read("project.json"))
+        if manifest.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a GoDraw project")
+        document = Document(manifest["width"], manifest["height"])
+        for entry in manifest["layers"]:
+            layer = Layer(document.width, document.height, entry["name"])
+            layer.pixels = _png_pixels(archive.read(entry["file"]))
+            layer.visible, layer.opacity, layer.blend_mode = entry["visible"], entry["opacity"], entry["blend_mode"]
+            document.layers.append(layer)
+        document.active_index = min(manifest["active"], max(len(document.layers) - 1, 0))
+        frames = [_png_pixels(archive.read(entry["file"])) for entry in manifest["frames"]]
+    return Project(document, frames, manifest["frame_duration"])
@@ -0,0 +1,39 @@
+"""Turn layer buffers into display pixels without touching Tk."""
+import numpy as np
+
+WHITE = (255, 255, 255)
+
+
+def scale_nearest(pixels, scale):
+    """Nearest-neighbour upscale of an (h, w, c) buffer by an integer factor."""
+    if scale == 1:
+        return pixels
+    return pixels.repeat(scale, axis=0).repeat(scale, axis=1)
+
+
+def render_cells(compositor, cols, rows, background=WHITE):
+    """RGB image of the composite at every (row, col) pair of sorted cell indices.
+
+    Cells outside the document show the background colour.
+    """
+    document = compositor.document
+    out = np.empty((len(rows), len(cols), 3), np.uint8)
+    out[...] = background
+    c0, c1 = np.searchsorted(cols, (0, document.width))
+    r0, r1 = np.searchsorted(rows, (0, document.height))
+    if c0 < c1 and r0 < r1:
+        out[r0:r1, c0:c1] = flatten_rgb(compositor.sample(cols[c0:c1], rows[r0:r1]))
+    return out
+
+
+def flatten_rgb(pixels, background=WHITE):
+    """Composite an RGBA buffer over a solid background, returning RGB uint8."""
+    alpha = pixels[..., 3:4].astype(np.uint16)
+    rgb = pixels[..., :3] * alpha + np.array(background, np.uint16) * (255 - alpha)
+    return ((rgb + 127) // 255).astype(np.uint8)
+
+
+def ppm_data(rgb):
+    """Encode an RGB uint8 buffer as binary PPM, which Tk photo images read natively."""
+    h, w = rgb.shape[:2]
+    return b"P6 %d %d 255\n" % (w, h) + np.ascontiguousarray(rgb).tobytes()
@@ -0,0 +1,149 @@
+"""Rectangular and lasso selections, and transforms of the selected pixels.
+
+A selection is a rect plus a boolean mask over it. Transforms lift the
+selected pixels out of the layer, reshape them with array operations
+(flips, quarter turns, moves, nearest-neighbour scaling) and write them
+back with one masked write, so inside a History edit each transform is
+one compact undo step.
+"""
+import numpy as np
+
+from .document import clip_rect, mask_bbox, union_rect
+from .stroke import bresenham
+
+
+class Selection:
+    def __init__(self, rect, mask=None):
+        x0, y0, x1, y1 = rect
+        self.rect = rect
+        self.mask = np.ones((y1 - y0, x1 - x0), bool) if mask is None else mask
+
+    @classmethod
+    def rectangle(cls, x0, y0, x1, y1, width, height):
+        """The cells between two corners (inclusive, in any order), clipped to the document, or None."""
+        rect = clip_rect((min(x0, x1), min(y0, y1), max(x0, x1) + 1, max(y0, y1) + 1), width, height)
+        return cls(rect) if rect else None
+
+    @classmethod
+    def lasso(cls, points, width, height):
+        """The cells on or inside a closed path of (x, y) pointer cells, or None.
+
+        Every polygon edge contributes its crossings with the cell-centre
+        rows at once; sorting them by row and x pairs them into spans, which
+        a cumulative sum turns into the mask. The cells the path itself
+        passes through are added on top.
+        """
+        if len(points) < 3:
+            return None
+        outline = np.array([cell for a, b in zip(points, points[1:] + points[:1]) for cell in bresenham(*a, *b)])
+        points = np.asarray(points, np.float64) + 0.5  # Pointer cells to their centres
+        xs, ys = points[:, 0], points[:, 1]
+        x0, y0 = max(int(np.floor(xs.min())), 0), max(int(np.floor(ys.min())), 0)
+        x1, y1 = min(int(np.ceil(xs.max())), width), min(int(np.ceil(ys.max())), height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        ax, ay, bx, by = xs, ys, np.roll(xs, -1), np.roll(ys, -1)
+        rows, cuts = [], []
+        for i in np.flatnonzero(ay != by):
+            lo, hi = sorted((ay[i], by[i]))
+            # Half-open in y, so a vertex shared by two edges counts once
+            centres = np.arange(max(np.ceil(lo - 0.5), y0), min(np.ceil(hi - 0.5), y1)) + 0.5
+            if len(centres):
+                rows.append(centres - 0.5)
+                cuts.append(ax[i] + (centres - ay[i]) * (bx[i] - ax[i]) / (by[i] - ay[i]))
+        edges = np.zeros((y1 - y0, x1 - x0 + 1), np.int32)
+        if rows:
+            rows, cuts = np.concatenate(rows).astype(int), np.concatenate(cuts)
+            order = np.lexsort((cuts, rows))
+            rows, cuts = rows[order], cuts[order]
+            # Cells whose centre x lies in [start, end) of each span
+            starts = np.clip(np.ceil(cuts[0::2] - 0.5), x0, x1).astype(int) - x0
+            ends = np.clip(np.ceil(cuts[1::2] - 0.5), x0, x1).astype(int) - x0
+            np.add.at(edges, (rows[0::2] - y0, starts), 1)
+            np.add.at(edges, (rows[0::2] - y0, ends), -1)
+        mask = np.cumsum(edges, axis=1)[:, :-1] > 0
+        inside = (outline[:, 0] >= x0) & (outline[:, 0] < x1) & (outline[:, 1] >= y0) & (outline[:, 1] < y1)
+        mask[outline[inside, 1] - y0, outline[inside, 0] - x0] = True
+        bbox = mask_bbox(mask)
+        if bbox is None:
+            return None
+        c0, r0, c1, r1 = bbox
+        return cls((x0 + c0, y0 + r0, x0 + c1, y0 + r1), mask[r0:r1, c0:c1])
+
+    def contains(self, x, y):
+        x0, y0, x1, y1 = self.rect
+        return x0 <= x < x1 and y0 <= y < y1 and bool(self.mask[y - y0, x - x0])
+
+
+def flip_horizontal(pixels, mask):
+    return pixels[:, ::-1], mask[:, ::-1], (0, 0)
+
+
+def flip_vertical(pixels, mask):
+    return pixels[::-1], mask[::-1], (0, 0)
+
+
+def rotate_90(pixels, mask):
+    """Quarter turn clockwise about the selection's centre."""
+    h, w = mask.shape
+    return np.rot90(pixels, -1), np.rot90(mask, -1), ((w - h) // 2, (h - w) // 2)
+
+
+def scaler(sx, sy, limit=None):
+    """Nearest-neighbour scale by (sx, sy), keeping the selection's top-left corner.
+
+    limit is the (width, height) of the document right of and below that
+    corner; only the source rows and columns that land inside it are
+    sampled, so scaling up near an edge never builds the cut-off part.
+    """
+    def scale(pixels, mask):
+        h, w = mask.shape
+        height, width = max(round(h * sy), 1), max(round(w * sx), 1)
+        if limit is not None:
+            width, height = min(width, limit[0]), min(height, limit[1])
+        rows = (np.arange(height) / sy).astype(int).clip(0, h - 1)
+        cols = (np.arange(width) / sx).astype(int).clip(0, w - 1)
+        return pixels[rows[:, None], cols], mask[rows[:, None], cols], (0, 0)
+    return scale
+
+
+def mover(dx, dy):
+    return lambda pixels, mask: (pixels, mask, (dx, dy))
+
+
+def transform(document, selection, operation):
+    """Apply operation to the selected pixels of the active layer.
+
+    operation takes (pixels, mask) of the selection and returns the new
+    (pixels, mask, (dx, dy)), where (dx, dy) moves the top-left corner.
+    The selected pixels are cleared and the result is pasted over the
+    layer, in one buffer covering both, which is written back with a
+    single masked write; what lands outside the document is dropped.
+    The stored cells are moved as they are, so an indexed layer keeps
+    every pixel's palette index even where entries share a colour.
+    Returns (selection of the result or None, dirty rect).
+    """
+    layer = document.active_layer
+    x0, y0, x1, y1 = selection.rect
+    pixels, mask, (dx, dy) = operation(layer.read_cells(selection.rect), selection.mask)
+    h, w = mask.shape
+    nx, ny = x0 + dx, y0 + dy
+    target = clip_rect((nx, ny, nx + w, ny + h), document.width, document.height)
+
+    dirty = union_rect(selection.rect, target)
+    ux0, uy0, ux1, uy1 = dirty
+    out = layer.read_cells(dirty)
+    written = np.zeros(out.shape[:2], bool)
+    source = (slice(y0 - uy0, y1 - uy0), slice(x0 - ux0, x1 - ux0))
+    out[source][selection.mask] = 0
+    written[source] = selection.mask
+    result = None
+    if target is not None:
+        tx0, ty0, tx1, ty1 = target
+        part = (slice(ty0 - ny, ty1 - ny), slice(tx0 - nx, tx1 - nx))
+        dest = (slice(ty0 - uy0, ty1 - uy0), slice(tx0 - ux0, tx1 - ux0))
+        np.copyto(out[dest], pixels[part], where=mask[part].reshape(mask[part].shape + (1,) * len(layer.CELL)))
+        written[dest] |= mask[part]
+        result = Selection(target, np.ascontiguousarray(mask[part]))
+    document.write_cells(ux0, uy0, out, written)
+    return result, dirty
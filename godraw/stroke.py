@@ -0,0 +1,111 @@
+"""Stroke pipeline: queue pointer samples, join them with lines, stamp in batches."""
+import numpy as np
+
+from .brush import make_brush
+from .document import parse_color, union_rect
+
+
+def bresenham(x0, y0, x1, y1):
+    """Grid cells on the line from (x0, y0) to (x1, y1), both ends included."""
+    points = []
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx + dy
+    while True:
+        points.append((x0, y0))
+        if x0 == x1 and y0 == y1:
+            return points
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+
+
+class Stroke:
+    """One pen or eraser drag on a document layer.
+
+    Pointer samples are only queued by add(); flush() joins them to the
+    previous sample with Bresenham lines and stamps the whole batch into
+    the layer with a single masked write. The brush defaults to a square
+    of `size` cells centred on the pointer.
+    """
+
+    def __init__(self, document, color, size=1, index=None, brush=None):
+        self.document = document
+        self.index = index
+        self.color = parse_color(color)
+        self.brush = brush or make_brush("square", size)
+        self.pending = []
+        self.last = None
+        self.corner = (None, None)  # Last two path cells of a pixel-perfect stroke; the second is not painted yet
+
+    def add(self, x, y):
+        self.pending.append((x, y))
+
+    def flush(self):
+        """Paint every queued sample; returns the dirty rect or None."""
+        points = []
+        for x, y in self.pending:
+            if self.last is None:
+                points.append((x, y))
+            elif (x, y) != self.last:
+                points.extend(bresenham(*self.last, x, y)[1:])
+            self.last = (x, y)
+        self.pending = []
+        if self.brush.pixel_perfect:
+            points = self.pixel_perfect(points)
+        return self.stamp(points) if points else None
+
+    def finish(self):
+        """Paint the queued samples and any cell held back; returns the dirty rect or None."""
+        rect = self.flush()
+        held, self.corner = self.corner[1], (None, None)
+        if held is not None:
+            rect = union_rect(rect, self.stamp([held]))
+        return rect
+
+    def pixel_perfect(self, points):
+        """The path without the corner cell of each L it turns, which a 1-pixel line would show as a blob.
+
+        Whether a cell is such a corner depends on the cell after it, so
+        the newest cell is held back until the next flush or finish().
+        """
+        out = []
+        before, held = self.corner
+        for point in points:
+            if before is not None and abs(point[0] - before[0]) == 1 and abs(point[1] - before[1]) == 1:
+                held = point  # The held cell joined two diagonal neighbours: drop it
+            else:
+                if held is not None:
+                    out.append(held)
+                before, held = held, point
+        self.corner = (before, held)
+        return out
+
+    def stamp(self, points):
+        """OR the brush mask centred on every point into one buffer and paint it with one masked write."""
+        brush = self.brush
+        h, w = brush.mask.shape
+        corners = np.array(points) - brush.anchor
+        (bx0, by0), (bx1, by1) = corners.min(axis=0), corners.max(axis=0) + (w, h)
+        rect = self.document.clip((int(bx0), int(by0), int(bx1), int(by1)))
+        if rect is None:
+            return None
+        # Only the part inside the document is allocated; stamps are cut to it
+        x0, y0, x1, y1 = rect
+        mask = np.zeros((y1 - y0, x1 - x0), bool)
+        for x, y in corners.tolist():
+            cx0, cy0, cx1, cy1 = max(x, x0), max(y, y0), min(x + w, x1), min(y + h, y1)
+            if cx0 < cx1 and cy0 < cy1:
+                mask[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] |= brush.mask[cy0 - y:cy1 - y, cx0 - x:cx1 - x]
+        if brush.pattern is not None:
+            mask &= brush.pattern_at(rect)
+
+        data = np.empty(mask.shape + (4,), np.uint8)
+        data[...] = self.color
+        self.document.write_region(x0, y0, data, mask, self.index)
+        return rect
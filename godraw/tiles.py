@@ -0,0 +1,28 @@
+"""Square tiles that split a document so storage and caches follow the painted area."""
+TILE_SIZE = 64  # cells per side of a tile
+
+
+def tile_rect(key, size=TILE_SIZE):
+    """Rectangle of cells covered by the tile at (col, row)."""
+    col, row = key
+    return (col * size, row * size, (col + 1) * size, (row + 1) * size)
+
+
+def tile_keys(rect, size=TILE_SIZE):
+    """(col, row) of every tile overlapping rect, row by row."""
+    x0, y0, x1, y1 = rect
+    return [(col, row)
+            for row in range(y0 // size, (y1 - 1) // size + 1)
+            for col in range(x0 // size, (x1 - 1) // size + 1)]
+
+
+def tile_spans(rect, size=TILE_SIZE):
+    """Split rect along tile borders.
+
+    Yields (key, (x0, y0, x1, y1)) with the part of rect inside each tile,
+    in document cells.
+    """
+    x0, y0, x1, y1 = rect
+    for key in tile_keys(rect, size):
+        tx0, ty0, tx1, ty1 = tile_rect(key, size)
+        yield key, (max(x0, tx0), max(y0, ty0), min(x1, tx1), min(y1, ty1))
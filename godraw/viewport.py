@@ -0,0 +1,133 @@
+"""Map between document cells and screen pixels for a zoomed and panned view."""
+import math
+
+import numpy as np
+
+MIN_ZOOM = 0.125  # screen pixels per cell
+MAX_ZOOM = 64.0
+
+
+class Viewport:
+    """A window of width x height screen pixels onto the document.
+
+    zoom is the number of screen pixels per cell and may be fractional;
+    (x, y) is the document point, in cells, at the screen's top-left
+    corner. The document is drawn in "zoomed pixels" (cells times zoom)
+    and the screen is offset from them by a whole number of pixels, so
+    every zoomed pixel always samples the same cell, the one under its
+    centre, wherever the view is panned.
+    """
+
+    def __init__(self, width, height, zoom=1.0, x=0.0, y=0.0):
+        self.width = width
+        self.height = height
+        self.zoom = zoom
+        self.x = x
+        self.y = y
+
+    def resize(self, width, height):
+        self.width, self.height = max(int(width), 1), max(int(height), 1)
+
+    def origin(self):
+        """Zoomed pixel shown at the screen's top-left corner."""
+        return round(self.x * self.zoom), round(self.y * self.zoom)
+
+    def to_document(self, sx, sy):
+        """Document point (in fractional cells) under screen pixel (sx, sy)."""
+        ox, oy = self.origin()
+        return (sx + ox) / self.zoom, (sy + oy) / self.zoom
+
+    def to_screen(self, col, row):
+        """Screen position of the top-left corner of a cell."""
+        ox, oy = self.origin()
+        return col * self.zoom - ox, row * self.zoom - oy
+
+    def cell_at(self, sx, sy):
+        """Cell (col, row) shown by screen pixel (sx, sy)."""
+        x, y = self.to_document(sx + 0.5, sy + 0.5)
+        return math.floor(x), math.floor(y)
+
+    def zoom_at(self, zoom, sx, sy):
+        """Change the zoom while keeping the point under screen (sx, sy) in place."""
+        zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+        x, y = self.to_document(sx, sy)
+        self.zoom = zoom
+        self.x, self.y = x - sx / zoom, y - sy / zoom
+
+    def pan(self, dx, dy):
+        """Move the view by a drag of (dx, dy) screen pixels."""
+        self.x -= dx / self.zoom
+        self.y -= dy / self.zoom
+
+    def fit(self, doc_width, doc_height):
+        """Zoom so the whole document fits and centre it."""
+        zoom = min(self.width / doc_width, self.height / doc_height)
+        self.zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+        self.x = (doc_width - self.width / self.zoom) / 2
+        self.y = (doc_height - self.height / self.zoom) / 2
+
+    def clamp(self, doc_width, doc_height):
+        """Stop the document from being panned out of view.
+
+        A document larger than the view always fills it; a smaller one
+        stays entirely on screen.
+        """
+        span_x, span_y = self.width / self.zoom, self.height / self.zoom
+        lo, hi = sorted((0, doc_width - span_x))
+        self.x = min(max(self.x, lo), hi)
+        lo, hi = sorted((0, doc_height - span_y))
+        self.y = min(max(self.y, lo), hi)
+
+    def visible_rect(self, doc_width, doc_height):
+        """Rect of the cells on screen, clipped to the document, or None."""
+        x0 = max(math.floor(self.x), 0)
+        y0 = max(math.floor(self.y), 0)
+        x1 = min(math.ceil(self.x + self.width / self.zoom), doc_width)
+        y1 = min(math.ceil(self.y + self.height / self.zoom), doc_height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+
+    def grid_lines(self, doc_width, doc_height, spacing=1):
+        """Screen positions of the visible cell boundaries at multiples of spacing: (xs, ys, bounds).
+
+        bounds is the screen rect (left, top, right, bottom) of the visible
+        cells, which the lines span; None if no cell is visible.
+        """
+        rect = self.visible_rect(doc_width, doc_height)
+        if rect is None:
+            return None
+        x0, y0, x1, y1 = rect
+        ox, oy = self.origin()
+        xs = [col * self.zoom - ox for col in range(-(-x0 // spacing) * spacing, x1 + 1, spacing)]
+        ys = [row * self.zoom - oy for row in range(-(-y0 // spacing) * spacing, y1 + 1, spacing)]
+        return xs, ys, (x0 * self.zoom - ox, y0 * self.zoom - oy, x1 * self.zoom - ox, y1 * self.zoom - oy)
+
+    def zoomed_rect(self, rect):
+        """Zoomed pixels (zx0, zy0, zx1, zy1) whose centres fall in the cells of rect."""
+        return tuple(math.ceil(v * self.zoom - 0.5) for v in rect)
+
+    def tile_axes(self, key, size):
+        """Cells sampled by the columns and rows of a size x size tile of zoomed pixels."""
+        offsets = np.arange(size) + 0.5
+        cols = np.floor((key[0] * size + offsets) / self.zoom).astype(np.intp)
+        rows = np.floor((key[1] * size + offsets) / self.zoom).astype(np.intp)
+        return cols, rows
+
+    def visible_tiles(self, size, doc_width, doc_height, margin=0):
+        """Keys of the tiles of zoomed pixels on screen that show part of the document."""
+        ox, oy = self.origin()
+        last_col = math.ceil(doc_width * self.zoom - 0.5) - 1  # last zoomed pixel inside the document
+        last_row = math.ceil(doc_height * self.zoom - 0.5) - 1
+        col0 = max(ox // size - margin, 0)
+        row0 = max(oy // size - margin, 0)
+        col1 = min((ox + self.width - 1) // size + margin, last_col // size)
+        row1 = min((oy + self.height - 1) // size + margin, last_row // size)
+        return [(col, row) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+    def scroll_fractions(self, doc_width, doc_height):
+        """Visible part of the document along each axis, as scrollbar fractions."""
+        span_x, span_y = self.width / self.zoom, self.height / self.zoom
+        fx = (max(self.x / doc_width, 0), min((self.x + span_x) / doc_width, 1))
+        fy = (max(self.y / doc_height, 0), min((self.y + span_y) / doc_height, 1))
+        return fx, fy
@@ -1,49 +1,296 @@
-from tkinter import Tk, Button, Scale, Canvas, Label, StringVar, Listbox, Toplevel, messagebox, Frame, Scrollbar, END, NW, Frame
+import json
+import math
+import os
+import sys
+import time
+STARTED = time.perf_counter()  # Reference point for --startup-time
+
+from tkinter import Tk, Button, Scale, Canvas, Label, StringVar, Listbox, Toplevel, messagebox, Frame, Scrollbar, END, NW, Frame, PhotoImage, BooleanVar, Checkbutton, OptionMenu, Radiobutton
 from tkinter.colorchooser import askcolor
-from tkinter.simpledialog import askinteger
-import ttkbootstrap as ttk
-from ttkbootstrap.constants import *
-from PIL import Image, ImageDraw, ImageTk
-from PyQt5.QtGui import QImage, QPainter, QColor
-from PyQt5.QtCore import Qt
+from tkinter.simpledialog import askinteger, askstring
+from tkinter.filedialog import asksaveasfilename, askopenfilename
+from godraw.document import Document, Palette, TRANSPARENT, parse_color, to_hex
+from godraw.render import render_cells, ppm_data, flatten_rgb, scale_nearest
+from godraw.history import History, LayersChange, PixelDelta
+from godraw.fill import flood_fill as scanline_fill
+from godraw.selection import (Selection, transform, flip_horizontal as mirror_horizontal,
+                              flip_vertical as mirror_vertical, rotate_90 as quarter_turn, scaler, mover)
+from godraw.stroke import Stroke
+from godraw.brush import DITHER_LEVELS, SHAPES, bitmap_brush, make_brush
+from godraw.compositor import Compositor, BLEND_MODES
+from godraw.viewport import MAX_ZOOM, MIN_ZOOM, Viewport
+from godraw.project import Project, EXTENSION, load_project, save_project
+from godraw.export import ANIMATION_FORMATS, export_animation, export_png
+from godraw.frames import FrameStore
+from godraw.atlas import export_atlas
+from godraw.playback import PlaybackClock, onion_neighbours, onion_skin
+from godraw.journal import AUTOSAVE_DIR, Journal, claim_autosave, discard_autosave, new_session, recover
+from godraw.palette import PALETTE_FORMATS, document_palette, load_palette, swap_palette, to_indexed, to_rgba
+from godraw.importer import IMPORT_FORMATS, RESAMPLING, add_image_layers, import_image, padded
+from godraw.instrument import Instrument
+IMPORTED = time.perf_counter()
 
 class Tile:
     def __init__(self, x, y, image):
         self.x = x  # Tile's position in the grid
         self.y = y
         self.image = image  # A PhotoImage or PIL image object
+        self.item = None  # Canvas image item showing the tile
+        self.dirty = True  # The image no longer matches the document
+
+class CanvasView:
+    """Shows the document as a grid of cached PhotoImage tiles of zoomed pixels.
+
+    Tiles live in a dict keyed by (col, row) and only the ones on screen are
+    looked up. Panning just moves their canvas items; a tile's image is
+    rendered again only when it is new or dirty, and all tiles are dropped
+    when the zoom changes.
+    """
+    TILE_SIZE = 256  # Zoomed pixels per side of a display tile
+    BACKGROUND = (96, 96, 96)  # Screen area outside the document
+
+    def __init__(self, canvas, compositor, viewport):
+        self.canvas = canvas
+        self.compositor = compositor
+        self.viewport = viewport
+        self.tiles = {}
+        self.zoom = None  # Zoom the cached tiles were rendered at
+        self.origin = None  # Viewport origin the tile items are placed for
+
+    def clear(self):
+        self.canvas.delete("view")
+        self.tiles = {}
+        self.zoom = self.origin = None
+
+    def invalidate(self):
+        """Mark every tile dirty, e.g. after the layer stack changed."""
+        for tile in self.tiles.values():
+            tile.dirty = True
+
+    def draw(self):
+        """Place the tiles on screen, rendering only the new and dirty ones."""
+        viewport, document, size = self.viewport, self.compositor.document, self.TILE_SIZE
+        if viewport.zoom != self.zoom:
+            self.clear()
+            self.zoom = viewport.zoom
+        ox, oy = viewport.origin()
+        if self.origin is not None:
+            self.canvas.move("view", self.origin[0] - ox, self.origin[1] - oy)  # One call pans every tile
+        self.origin = (ox, oy)
+
+        for key in viewport.visible_tiles(size, document.width, document.height):
+            tile = self.tiles.get(key)
+            if tile is None:
+                image = PhotoImage(master=self.canvas, width=size, height=size)
+                tile = self.tiles[key] = Tile(key[0], key[1], image)
+                tile.item = self.canvas.create_image(key[0] * size - ox, key[1] * size - oy,
+                                                     anchor=NW, image=image, tags="view")
+                self.canvas.tag_lower(tile.item)
+            if tile.dirty:
+                self.render(tile, (0, 0, size, size))
+
+        # Forget tiles that scrolled more than one tile out of view
+        keep = set(viewport.visible_tiles(size, document.width, document.height, margin=1))
+        for key in [key for key in self.tiles if key not in keep]:
+            self.canvas.delete(self.tiles.pop(key).item)
+
+    def update(self, rect):
+        """Render again the part of each cached tile that shows a dirty rect of cells."""
+        if self.zoom is None:
+            return self.draw()
+        size = self.TILE_SIZE
+        zx0, zy0, zx1, zy1 = self.viewport.zoomed_rect(rect)
+        for key, tile in self.tiles.items():
+            x0, y0 = key[0] * size, key[1] * size
+            part = (max(zx0 - x0, 0), max(zy0 - y0, 0), min(zx1 - x0, size), min(zy1 - y0, size))
+            if part[0] < part[2] and part[1] < part[3] and not tile.dirty:
+                self.render(tile, part)
+
+    def render(self, tile, part):
+        """Draw part (x0, y0, x1, y1, in the tile's own pixels) of a tile's image."""
+        cols, rows = self.viewport.tile_axes((tile.x, tile.y), self.TILE_SIZE)
+        x0, y0, x1, y1 = part
+        rgb = render_cells(self.compositor, cols[x0:x1], rows[y0:y1], self.BACKGROUND)
+        tile.image.put(ppm_data(rgb), to=(x0, y0))
+        if part == (0, 0, self.TILE_SIZE, self.TILE_SIZE):
+            tile.dirty = False
 
 class Paint:
     DEFAULT_COLOR = 'black'
     GRID_SIZE = 16
     PIXEL_SIZE = 30
-
-    def __init__(self):
+    ZOOM_STEP = MIN_ZOOM  # Resolution of the zoom slider, in screen pixels per cell
+    MAX_GRID_SIZE = 4096  # Layers are tiled, so memory follows the painted area
+    GRID_MIN_ZOOM = 4  # Grid lines are hidden when the cells between them are smaller than this on screen
+    GRID_COLOR = 'lightgray'
+    GRID_MAJOR_COLOR = 'gray40'
+    GRID_MAJOR_SPACINGS = ('Off', '8', '16', '32', '64')  # Cells between the darker major grid lines
+    HISTORY_BUDGET = 64 * 1024 * 1024  # Bytes of undo history kept before the oldest steps are dropped
+    AUTOSAVE_DIR = AUTOSAVE_DIR  # Holds a locked session directory per running editor
+    SWATCHES = ('#FF0000', '#00FF00', '#0000FF', '#FFFF00', '#FF00FF', '#00FFFF', '#000000', '#FFFFFF')
+    SWATCH_COLUMNS = 32  # Palette swatches per row in indexed mode
+    CYCLE_MS = 150  # Milliseconds per step of colour cycling
+    # Handlers and render steps timed by --profile
+    PROFILED = ('paint_pixel', 'flush_stroke', 'finish_stroke', 'start_pan', 'pan', 'update_zoom', 'zoom_wheel',
+                'scroll_view', 'resize_view', 'flood_fill', 'use_pen', 'use_eraser', 'use_flood_fill', 'use_pan',
+                'switch_layer', 'undo', 'redo', 'render_view', 'redraw_view', 'refresh_view', 'draw_grid',
+                'drag_selection', 'transform_selection')
+    OVERLAY_NAMES = ('Paint.paint_pixel', 'Paint.flush_stroke', 'Paint.pan', 'Paint.update_zoom',
+                     'Paint.flood_fill', 'CanvasView.draw', 'CanvasView.update', 'Compositor.render')
+
+    def __init__(self, autosave=True, profile=False):
+        # The themed window is the first use of ttkbootstrap, so it is imported here
+        import ttkbootstrap as ttk
         self.root = ttk.Window(themename="vapor")
         self.root.title("GoDraw Sprite Editor")
+        self.instrument = None
+        if profile:
+            # Before any widget or binding exists, so all of them go through the counters and wrappers
+            self.instrument = Instrument()
+            self.instrument.count_tcl(self.root)
+            self.instrument.wrap(self, self.PROFILED)
 
         # Initialize attributes
         self.x = 0  # Tile's position in the grid
         self.y = 0
         
-        self.layers = []  # List of canvases for layers
+        self.document = Document(self.GRID_SIZE, self.GRID_SIZE)  # Pixel data for every layer
+        self.compositor = Compositor(self.document)  # Blends the layers shown on the canvas
         self.active_layer_index = 0
         self.color = self.DEFAULT_COLOR
+        self.eraser_on = False
         self.canvas_width = self.GRID_SIZE * self.PIXEL_SIZE
         self.canvas_height = self.GRID_SIZE * self.PIXEL_SIZE
-        self.undo_stack = []
-        self.redo_stack = []
-        self.frames = []
+        self.history = History(self.document, self.HISTORY_BUDGET)
+        self.tool_bindings = {}  # Event sequence -> handler for the selected tool
+        self.stroke = None  # Stroke being drawn by the pen or eraser
+        self.custom_brush = None  # Brush taken from a selection
+        self.flush_job = None  # Pending after_idle call that paints queued samples
+        self.view_job = None  # Pending after_idle call that re-blits the viewport
+        self.pan_start = None  # Last pointer position while panning
+        self.selection = None  # Cells the transforms act on; None means the whole layer
+        self.selection_mode = 'rect'  # 'rect' or 'lasso'
+        self.selection_path = []  # Pointer cells of the selection being dragged
+        self.grid_items = {}  # Grid line colour -> (canvas line items, how many are shown), reused between redraws
+        self.frames = FrameStore()  # Composites at grid resolution, scaled only when shown or exported
         self.is_playing = False
+        self.animation_job = None  # Pending after call of the animation preview
+        self.preview_images = {}  # Preview key -> PhotoImage, kept between plays
+        self.export_pool = None  # Worker process for animation exports, started on first use
+        self.journal = None  # Background autosave, written off the UI thread
+        self.cycle_job = None  # Pending after call of colour cycling
+        self.cycle_clock = None
+        self.cycle_range = None  # (first, end) palette entries being cycled
+        self.cycle_step = 0  # Rotation applied to that range so far
+        self.cycle_colors = None  # Palette colours to restore when cycling stops
 
         # Setup UI
         self.setup_ui()
 
         # Create the first (base) layer
         self.add_layer()
-
+        self.redraw_view()
+        self.use_pen()
+        if autosave:
+            self.start_autosave()
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
+        if self.instrument:
+            self.instrument_view()
+            self.root.bind_all('<F12>', self.dump_profile)
+            self.overlay = self.canvas.create_text(8, 8, anchor=NW, fill="#ffff66", font=("TkFixedFont", 9),
+                                                   tags="overlay")
+            self.update_overlay()
+
+    def run(self):
+        """Hand control to Tk until the window is closed."""
         self.root.mainloop()
 
+    def quit(self):
+        """Close the window; a clean exit leaves no autosave to recover."""
+        if self.journal:
+            self.journal.close(discard=True)
+        if self.instrument:
+            summary = self.instrument.summary()
+            if self.journal:
+                summary["autosave"] = self.journal.stats()
+            print(json.dumps(summary, indent=1))
+        self.root.destroy()
+
+    def instrument_view(self):
+        """Time the display tiles and the compositor behind them (again after the document changes)."""
+        self.instrument.wrap(self.view, ('draw', 'update', 'render'))
+        self.instrument.wrap(self.compositor, ('render', 'sample'))
+
+    def update_overlay(self):
+        """Show the latest handler and render latencies in the canvas corner, four times a second."""
+        self.canvas.itemconfigure(self.overlay, text=self.instrument.overlay_text(self.OVERLAY_NAMES))
+        self.canvas.tag_raise(self.overlay)
+        self.root.after(250, self.update_overlay)
+
+    def dump_profile(self, event=None):
+        """Save the recorded spans as a Chrome trace to attach to a bug report."""
+        path = asksaveasfilename(defaultextension=".json", initialfile="godraw-trace.json",
+                                 filetypes=[("Chrome trace", "*.json")])
+        if path:
+            self.instrument.dump(path)
+            self.var_status.set(f"Trace saved as {path}")
+
+    def start_autosave(self):
+        """Offer to recover an autosave left by a crash, then start journaling this session.
+
+        Sessions of editors still running are locked and never offered. A
+        recovered or declined autosave is deleted; one that fails to load
+        is kept for `python -m godraw recover`.
+        """
+        claimed = claim_autosave(self.AUTOSAVE_DIR)
+        if claimed is not None:
+            directory, lock = claimed
+            keep = False
+            if messagebox.askyesno("Recover", "GoDraw did not close cleanly. Recover the autosaved sprite?"):
+                try:
+                    project, stats = recover(directory)
+                except (OSError, ValueError) as error:
+                    messagebox.showerror("Recover", f"Could not recover the autosave: {error}")
+                    keep = True
+                else:
+                    self.frames = FrameStore(project.frames, project.durations)
+                    self.load_document(project.document)
+                    self.var_status.set(f"Recovered {stats['records']} edits in {stats['seconds'] * 1000:.0f} ms")
+            if keep:
+                lock.close()
+            else:
+                discard_autosave(directory, lock)
+        self.journal = Journal(new_session(self.AUTOSAVE_DIR))
+        self.autosave_snapshot()
+
+    def autosave_snapshot(self):
+        """Queue a full snapshot, e.g. after the layer stack or the grid changed."""
+        if self.journal:
+            # The copy is what the writer thread saves, so later edits cannot race it
+            project = self.current_project()
+            project.document = project.document.copy()
+            self.journal.snapshot(project)
+            self.report_autosave_error()
+
+    def report_autosave_error(self):
+        """Show the last error of the autosave writer in the status bar, once."""
+        error, self.journal.error = self.journal.error, None  # Cleared so each failure is shown once
+        if error is not None:
+            self.var_status.set(f"Autosave failed: {error}")
+
+    def autosave_layer(self):
+        """Queue the active layer's settings for the autosave journal."""
+        if self.journal:
+            self.journal.record_layer(self.document, self.active_layer_index)
+
+    @property
+    def active_layer_index(self):
+        return self.document.active_index
+
+    @active_layer_index.setter
+    def active_layer_index(self, index):
+        self.document.active_index = index
+
     def setup_ui(self):
         """Setup UI components."""
         
@@ -63,17 +310,45 @@ class Paint:
         self.canvas_frame.grid(row=0, column=1, padx=10, pady=10, sticky="nsew")
         # Pan Tool Button
         Button(toolbar, text='Pan Tool', command=self.use_pan).pack(fill='x', pady=2)
+        # Selection tools and transforms of the selected pixels
+        Button(toolbar, text='Select Rect', command=self.use_select_rect).pack(fill='x', pady=2)
+        Button(toolbar, text='Lasso', command=self.use_lasso).pack(fill='x', pady=2)
+        transform_buttons = Frame(toolbar)
+        transform_buttons.pack(fill='x', pady=2)
+        for text, command in (('Flip H', self.flip_horizontal), ('Flip V', self.flip_vertical),
+                              ('Rotate', self.rotate_90), ('Scale', self.scale_selection)):
+            Button(transform_buttons, text=text, command=command).pack(side='left', expand=True, fill='x')
         # Brush size slider
-        self.size_scale = Scale(toolbar, from_=1, to=10, orient='horizontal', label="Brush Size")
+        self.size_scale = Scale(toolbar, from_=1, to=64, orient='horizontal', label="Brush Size")
         self.size_scale.pack(fill='x', pady=5)
+        # Brush shape, ordered dithering and pixel-perfect 1-pixel lines
+        self.brush_shape = StringVar(value='square')
+        OptionMenu(toolbar, self.brush_shape, *SHAPES, 'custom').pack(fill='x', pady=2)
+        self.dither_scale = Scale(toolbar, from_=1, to=DITHER_LEVELS, orient='horizontal', label="Dither Density")
+        self.dither_scale.set(DITHER_LEVELS)
+        self.dither_scale.pack(fill='x', pady=5)
+        self.pixel_perfect = BooleanVar(value=False)
+        Checkbutton(toolbar, text='Pixel Perfect', variable=self.pixel_perfect).pack(anchor='w')
+        Button(toolbar, text='Brush from Selection', command=self.brush_from_selection).pack(fill='x', pady=2)
 
         # Layer management
         Button(toolbar, text='Add Layer', command=self.add_layer).pack(fill='x', pady=2)
         Button(toolbar, text='Clear Layer', command=self.clear_canvas).pack(fill='x', pady=2)
         Button(toolbar, text='Merge Layers', command=self.merge_layers).pack(fill='x', pady=2)
+        Button(toolbar, text='Merge Down', command=self.merge_down).pack(fill='x', pady=2)
+        Button(toolbar, text='Show/Hide Layer', command=self.toggle_layer_visibility).pack(fill='x', pady=2)
+        self.opacity_scale = Scale(toolbar, from_=0, to=100, orient='horizontal', label="Layer Opacity %",
+                                   command=self.set_layer_opacity)
+        self.opacity_scale.set(100)
+        self.opacity_scale.pack(fill='x', pady=5)
+        self.blend_mode = StringVar(value="normal")
+        OptionMenu(toolbar, self.blend_mode, *BLEND_MODES, command=self.set_blend_mode).pack(fill='x', pady=2)
 
         # Save and Undo/Redo
         Button(toolbar, text='Save', command=self.save_file).pack(fill='x', pady=2)
+        Button(toolbar, text='Save Project', command=self.save_project).pack(fill='x', pady=2)
+        Button(toolbar, text='Open Project', command=self.open_project).pack(fill='x', pady=2)
+        Button(toolbar, text='Import Image', command=self.import_image).pack(fill='x', pady=2)
         Button(toolbar, text='Undo', command=self.undo).pack(fill='x', pady=2)
         Button(toolbar, text='Redo', command=self.redo).pack(fill='x', pady=2)
 
@@ -81,27 +356,48 @@ class Paint:
         Button(toolbar, text='Save Frame', command=self.save_frame).pack(fill='x', pady=2)
         Button(toolbar, text='Play Animation', command=self.play_animation).pack(fill='x', pady=2)
         Button(toolbar, text='Export GIF', command=self.export_as_gif).pack(fill='x', pady=2)
+        Button(toolbar, text='Export Atlas', command=self.export_atlas).pack(fill='x', pady=2)
+        Label(toolbar, text="Frames:").pack(anchor='w', pady=5)
+        self.frame_listbox = Listbox(toolbar, height=5)
+        self.frame_listbox.pack(fill='x', pady=2)
+        self.frame_listbox.bind('<<ListboxSelect>>', self.select_frame)
+        frame_buttons = Frame(toolbar)
+        frame_buttons.pack(fill='x', pady=2)
+        for text, command in (('Del', self.delete_frame), ('Dup', self.duplicate_frame),
+                              ('Up', self.move_frame_up), ('Down', self.move_frame_down),
+                              ('Time', self.set_frame_duration)):
+            Button(frame_buttons, text=text, command=command).pack(side='left', expand=True, fill='x')
         
-        self.zoom_scale = Scale(toolbar, from_=1, to=5, orient='horizontal', label="Zoom Level")
-        self.zoom_scale.set(1)  # Default zoom level
+        self.zoom_scale = Scale(toolbar, from_=MIN_ZOOM, to=MAX_ZOOM, resolution=self.ZOOM_STEP,
+                                orient='horizontal', label="Zoom (pixels per cell)", command=self.update_zoom)
+        self.zoom_scale.set(self.PIXEL_SIZE)  # Default zoom level
         self.zoom_scale.pack(fill='x', pady=5)
-        self.zoom_scale.bind("<Motion>", self.update_zoom)  # Bind the zoom update function
      # Canvas with scrollbars
-        self.canvas = Canvas(self.canvas_frame, bg="white", width=self.canvas_width, height=self.canvas_height,
-                            scrollregion=(0, 0, self.canvas_width, self.canvas_height))
+        self.canvas = Canvas(self.canvas_frame, bg="#%02x%02x%02x" % CanvasView.BACKGROUND, width=self.canvas_width, height=self.canvas_height,
+                             highlightthickness=0)
         self.canvas.grid(row=0, column=0, sticky="nsew")
 
-        self.v_scrollbar = Scrollbar(self.canvas_frame, orient="vertical", command=self.canvas.yview)
+        # The scrollbars move the viewport; the canvas itself never scrolls
+        self.v_scrollbar = Scrollbar(self.canvas_frame, orient="vertical", command=lambda *args: self.scroll_view('y', *args))
         self.v_scrollbar.grid(row=0, column=1, sticky="ns")
-        self.h_scrollbar = Scrollbar(self.canvas_frame, orient="horizontal", command=self.canvas.xview)
+        self.h_scrollbar = Scrollbar(self.canvas_frame, orient="horizontal", command=lambda *args: self.scroll_view('x', *args))
         self.h_scrollbar.grid(row=1, column=0, sticky="ew")
 
-        self.canvas.config(yscrollcommand=self.v_scrollbar.set, xscrollcommand=self.h_scrollbar.set)
-
+        viewport = Viewport(self.canvas_width, self.canvas_height, zoom=self.PIXEL_SIZE)
+        self.view = CanvasView(self.canvas, self.compositor, viewport)  # The canvas only displays the document composite
+        self.canvas.bind('<Configure>', self.resize_view)
 
         # Bind pan functionality
         self.canvas.bind('<ButtonPress-3>', self.start_pan)
         self.canvas.bind('<B3-Motion>', self.pan)
+        # Zoom around the mouse pointer with the wheel
+        self.canvas.bind('<MouseWheel>', self.zoom_wheel)
+        self.canvas.bind('<Button-4>', self.zoom_wheel)
+        self.canvas.bind('<Button-5>', self.zoom_wheel)
+        # Arrow keys move the selected pixels once a click has given the canvas focus
+        for key, (dx, dy) in (('<Left>', (-1, 0)), ('<Right>', (1, 0)), ('<Up>', (0, -1)), ('<Down>', (0, 1))):
+            self.canvas.bind(key, lambda event, dx=dx, dy=dy: self.move_selection(dx, dy))
+        self.canvas.bind('<Escape>', self.clear_selection)
 
         # Configure canvas frame to resize properly
         self.canvas_frame.grid_rowconfigure(0, weight=1)
@@ -120,153 +416,198 @@ class Paint:
         self.var_status = StringVar(value='Selected Tool: Pen')
         Label(toolbar, textvariable=self.var_status).pack(fill='x', pady=5)
 
-        # Grid area (center)
-        self.canvas_frame = Canvas(self.root, width=self.canvas_width, height=self.canvas_height, bg="white")
-        self.canvas_frame.grid(row=0, column=1, padx=10, pady=10)
-
         Button(toolbar, text='Flood Fill', command=self.use_flood_fill).pack(fill='x', pady=2)
+        # Flood fill options
+        self.fill_tolerance = Scale(toolbar, from_=0, to=255, orient='horizontal', label="Fill Tolerance")
+        self.fill_tolerance.pack(fill='x', pady=5)
+        self.fill_diagonal = BooleanVar(value=False)
+        Checkbutton(toolbar, text='Fill Diagonals', variable=self.fill_diagonal).pack(anchor='w')
+        self.fill_global = BooleanVar(value=False)
+        Checkbutton(toolbar, text='Replace All Matching', variable=self.fill_global).pack(anchor='w')
 
         Button(toolbar, text='Adjust Grid Size', command=self.adjust_grid_size).pack(fill='x', pady=2)
-
-        color_frame = Frame(self.root)
-        color_frame.grid(row=5, column=0, columnspan=4, pady=10)  # Adjust row/column as needed
-
-        colors = ['#FF0000', '#00FF00', '#0000FF', '#FFFF00', '#FF00FF', '#00FFFF', '#000000', '#FFFFFF']
-        for color in colors:
-            color_button = Button(color_frame, bg=color, width=2, height=1,
-                                command=lambda c=color: self.set_color(c))
-            color_button.pack(side='left', padx=2)
+        self.show_grid = BooleanVar(value=True)
+        Checkbutton(toolbar, text='Show Grid', variable=self.show_grid, command=self.refresh_view).pack(anchor='w')
+        Label(toolbar, text="Major Grid Lines:").pack(anchor='w')
+        self.grid_major = StringVar(value='Off')
+        OptionMenu(toolbar, self.grid_major, *self.GRID_MAJOR_SPACINGS,
+                   command=lambda _: self.refresh_view()).pack(fill='x', pady=2)
+        # Indexed colour
+        Button(toolbar, text='Indexed Mode', command=self.toggle_indexed_mode).pack(fill='x', pady=2)
+        Button(toolbar, text='Load Palette', command=self.load_palette_file).pack(fill='x', pady=2)
+        Button(toolbar, text='Cycle Colors', command=self.toggle_color_cycle).pack(fill='x', pady=2)
+
+        self.color_frame = Frame(self.root)
+        self.color_frame.grid(row=5, column=0, columnspan=4, pady=10)  # Adjust row/column as needed
+        self.refresh_swatches()
 
     def draw_grid(self, canvas):
-        """Draw the grid on a given canvas."""
-        for row in range(self.GRID_SIZE):
-            for col in range(self.GRID_SIZE):
-                x1 = col * self.PIXEL_SIZE
-                y1 = row * self.PIXEL_SIZE
-                x2 = x1 + self.PIXEL_SIZE
-                y2 = y1 + self.PIXEL_SIZE
-                canvas.create_rectangle(x1, y1, x2, y2, outline="lightgray", fill="white",
-                                        tags=(f"pixel-{row}-{col}", "grid"))
-    def create_tiles(self):
-        """Generate tiles for the grid."""
-        self.tiles = []
-        tile_size = 256  # Size of each tile in pixels
-        rows = (self.canvas_height + tile_size - 1) // tile_size
-        cols = (self.canvas_width + tile_size - 1) // tile_size
-
-        for row in range(rows):
-            for col in range(cols):
-                # Create a blank or default image for now
-                image = Image.new("RGBA", (tile_size, tile_size), "white")
-                self.tiles.append(Tile(col * tile_size, row * tile_size, ImageTk.PhotoImage(image)))
-
-    def visible_tiles(self):
-        """Yield visible tiles based on canvas viewport."""
-        tile_size = 256  # Match the tile size used earlier
-
-        # Get the scroll position
-        x0, y0, x1, y1 = self.canvas.bbox("all")  # Viewport bounds in canvas coordinates
-
-        # Determine the range of tiles visible
-        start_col = x0 // tile_size
-        end_col = (x1 + tile_size - 1) // tile_size
-        start_row = y0 // tile_size
-        end_row = (y1 + tile_size - 1) // tile_size
-
-        for tile in self.tiles:
-            if start_col <= tile.x // tile_size <= end_col and start_row <= tile.y // tile_size <= end_row:
-                yield tile
-    
-    def render_tiles(self):
-        """Render visible tiles on the canvas."""
-        self.canvas.delete("tile")  # Remove existing tiles tagged as "tile"
+        """Draw the grid as lines over the visible cells, above the pixels and independent of them.
+
+        One line per visible row and column boundary, so a redraw costs
+        O(cells across the view). Minor lines are hidden when cells are
+        smaller than GRID_MIN_ZOOM on screen, and major lines when the
+        spacing between them is.
+        """
+        spacings = []
+        if self.show_grid.get():
+            major = self.grid_major.get()
+            spacings = [(1, self.GRID_COLOR)] + ([] if major == 'Off' else [(int(major), self.GRID_MAJOR_COLOR)])
+        viewport = self.view.viewport
+        for spacing, color in spacings:
+            found = None
+            if viewport.zoom * spacing >= self.GRID_MIN_ZOOM:
+                found = viewport.grid_lines(self.document.width, self.document.height, spacing)
+            lines = []
+            if found is not None:
+                xs, ys, (left, top, right, bottom) = found
+                lines = [(x, top, x, bottom) for x in xs] + [(left, y, right, y) for y in ys]
+            self.place_lines(canvas, color, lines)
+        for color in self.grid_items.keys() - {color for _, color in spacings}:
+            self.place_lines(canvas, color, [])
+        # Above display tiles created since the last redraw, and major lines above minor ones
+        for _, color in spacings:
+            canvas.tag_raise("grid_" + color)
+
+    def place_lines(self, canvas, color, lines):
+        """Move the grid line items of one colour to lines, creating or hiding items as needed."""
+        items, shown = self.grid_items.get(color, ([], 0))
+        for item, coords in zip(items, lines):
+            canvas.coords(item, *coords)
+        # Only items crossing between shown and hidden are reconfigured
+        for item in items[shown:min(len(items), len(lines))]:
+            canvas.itemconfigure(item, state='normal')
+        for item in items[len(lines):shown]:
+            canvas.itemconfigure(item, state='hidden')
+        for coords in lines[len(items):]:
+            items.append(canvas.create_line(*coords, fill=color, tags=("grid", "grid_" + color)))
+        self.grid_items[color] = (items, len(lines))
+
+    def render_view(self, rect=None):
+        """Blend the layers inside rect and re-blit it (the whole view if rect is None)."""
+        self.canvas.delete("frame_preview")
+        if rect is None:
+            self.view.invalidate()
+            self.view.draw()
+        else:
+            self.view.update(rect)
+
+    def redraw_view(self):
+        """Blend the visible area again and redraw the grid, e.g. after a resize."""
+        self.view.invalidate()
+        self.refresh_view()
+
+    def schedule_view(self):
+        """Re-blit the viewport once the pending zoom, pan and resize events are handled."""
+        if self.view_job is None:
+            self.view_job = self.root.after_idle(self.refresh_view)
+
+    def refresh_view(self):
+        """Re-blit the visible area and grid at the current zoom and offset."""
+        if self.view_job is not None:
+            self.root.after_cancel(self.view_job)
+            self.view_job = None
+        self.view.viewport.clamp(self.document.width, self.document.height)
+        self.canvas.delete("frame_preview")
+        self.view.draw()
+        self.draw_grid(self.canvas)
+        self.draw_selection()
+        self.refresh_scrollbars()
 
-        for tile in self.visible_tiles():
-            self.canvas.create_image(tile.x, tile.y, anchor=NW, image=tile.image, tags="tile")
+    def resize_view(self, event):
+        """Follow the canvas size when the window is resized."""
+        viewport = self.view.viewport
+        if (event.width, event.height) != (viewport.width, viewport.height):
+            viewport.resize(event.width, event.height)
+            self.schedule_view()
 
     def adjust_grid_size(self):
         """Prompt user to adjust the grid size and update all canvases."""
-        new_grid_size = askinteger("Grid Size", "Enter new grid size (e.g., 16):", minvalue=1, maxvalue=150)
+        new_grid_size = askinteger("Grid Size", "Enter new grid size (e.g., 16):", minvalue=1, maxvalue=self.MAX_GRID_SIZE)
         if new_grid_size:
-            self.GRID_SIZE = new_grid_size
-
-            # Recalculate pixel size dynamically to ensure the grid fills the window
-            self.PIXEL_SIZE = min(self.canvas_width // self.GRID_SIZE, self.canvas_height // self.GRID_SIZE)
-            # Calculate canvas dimensions to fill the window
-            self.canvas_width = self.GRID_SIZE * self.PIXEL_SIZE
-            self.canvas_height = self.GRID_SIZE * self.PIXEL_SIZE
-
-            for layer in self.layers:
-                layer.config(scrollregion=(0, 0, self.canvas_width, self.canvas_height))
-                layer.delete("all")  # Clear the layer
-                self.draw_grid(layer)  # Redraw the grid
-                 # Update scrollbars for the active layer
-                self.setup_layer_bindings(self.layers[self.active_layer_index])
-                # Update scrollbars for the active layer
-                active_canvas = self.layers[self.active_layer_index]
-                self.v_scrollbar.config(command=active_canvas.yview)
-                self.h_scrollbar.config(command=active_canvas.xview)
-
-            
-        active_canvas.delete("all")  # Clear the old grid
-        self.draw_grid(active_canvas)
-           
-    def update_zoom(self, event=None):
-        """Update the zoom level and redraw the grid."""
-
-
-        zoom_level = self.zoom_scale.get()  # Get zoom level from slider
-        self.PIXEL_SIZE = 20 * zoom_level   # Base pixel size is 20, scale it up/down
-
-        # Update canvas dimensions based on new pixel size
-        self.canvas_width = self.GRID_SIZE * self.PIXEL_SIZE
-        self.canvas_height = self.GRID_SIZE * self.PIXEL_SIZE
-
-           # Save the current state of the active canvas
-        active_canvas = self.layers[self.active_layer_index]
-        current_state = self.capture_canvas_state(active_canvas)
-        
-        # Update all layers
-        for layer in self.layers:
-            
-            layer.config(scrollregion=(0, 0, self.canvas_width, self.canvas_height))
-            layer.delete("all")  # Clear existing grid
-            self.draw_grid(layer)  # Redraw the grid
-        
-        self.apply_canvas_state(current_state,layer)    # Apply to the same layer
-  
+            self.set_grid_size(new_grid_size)
+
+            # Crop or pad the pixel buffers, then show the whole new grid
+            self.document.resize(self.GRID_SIZE, self.GRID_SIZE)
+            # Saved frames are composites of the old grid; crop or pad them the same way
+            self.frames.map(lambda pixels: padded(pixels, self.GRID_SIZE, self.GRID_SIZE))
+            self.history.clear()  # Recorded deltas refer to the old grid
+            self.selection = None
+            self.autosave_snapshot()
+            self.view.viewport.fit(self.document.width, self.document.height)
+            self.zoom_scale.set(self.view.viewport.zoom)
+            self.redraw_view()
+
+    def set_grid_size(self, size):
+        """Take a new grid size and the pixel size that fits it in the canvas, as frame previews and exports use.
+
+        The pixel size is worked out from the canvas size the window was
+        built with, which never changes, so it cannot creep from one grid
+        size to the next.
+        """
+        self.GRID_SIZE = size
+        self.PIXEL_SIZE = max(min(self.canvas_width // self.GRID_SIZE, self.canvas_height // self.GRID_SIZE), 1)
+
+    def update_zoom(self, value):
+        """Zoom around the centre of the view when the slider moves."""
+        viewport = self.view.viewport
+        zoom = float(value)
+        # The slider is also moved to follow wheel zooming and fitting; ignore that echo
+        if zoom != self.slider_zoom(viewport.zoom):
+            viewport.zoom_at(zoom, viewport.width / 2, viewport.height / 2)
+            self.schedule_view()
+
+    def slider_zoom(self, zoom):
+        """The value the zoom slider shows for zoom: rounded half up to its resolution and clamped, as Tk does."""
+        zoom = math.floor(zoom / self.ZOOM_STEP + 0.5) * self.ZOOM_STEP
+        return min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+
+    def zoom_wheel(self, event):
+        """Zoom in or out keeping the cell under the mouse pointer in place."""
+        viewport = self.view.viewport
+        factor = 1.25 if event.num == 4 or event.delta > 0 else 0.8
+        viewport.zoom_at(viewport.zoom * factor, event.x, event.y)
+        self.zoom_scale.set(viewport.zoom)
+        self.schedule_view()
+
+    def scroll_view(self, axis, action, amount, unit=None):
+        """Scrollbar command: move the viewport along one axis."""
+        viewport = self.view.viewport
+        if axis == 'x':
+            size, span, position = self.document.width, viewport.width / viewport.zoom, viewport.x
+        else:
+            size, span, position = self.document.height, viewport.height / viewport.zoom, viewport.y
+        if action == 'moveto':
+            position = float(amount) * size
+        elif unit == 'pages':
+            position += int(amount) * span * 0.9
+        else:
+            position += int(amount) * max(span / 10, 1)
+        if axis == 'x':
+            viewport.x = position
+        else:
+            viewport.y = position
+        self.schedule_view()
 
   
     def use_pan(self):
         """Activate the pan tool."""
         self.var_status.set("Selected Tool: Pan")
-        for layer in self.layers:
-            layer.unbind('<Button-1>')
-            layer.unbind('<Button-1>')
-        self.canvas.bind('<ButtonPress-1>', self.start_pan)
-        self.canvas.bind('<B1-Motion>', self.pan)
-        self.refresh_scrollbars()
+        self.bind_tool({'<ButtonPress-1>': self.start_pan, '<B1-Motion>': self.pan})
 
     def start_pan(self, event):
         """Record the starting point for panning."""
-        self.layers[self.active_layer_index].scan_mark(event.x,event.y) 
+        self.pan_start = (event.x, event.y)
     
 
     def pan(self, event):
-        """Handle panning."""
-        self.layers[self.active_layer_index].scan_dragto(event.x, event.y, gain=1)
-        self.refresh_scrollbars()
+        """Move the viewport with the drag; the re-blit happens once per batch of events."""
+        if self.pan_start is None:
+            return self.start_pan(event)
+        self.view.viewport.pan(event.x - self.pan_start[0], event.y - self.pan_start[1])
+        self.pan_start = (event.x, event.y)
+        self.schedule_view()
         
-    def paint_tile(self, x, y, color):
-        """Modify a specific tile."""
-        tile_size = 256
-        col, row = x // tile_size, y // tile_size
-        tile = self.get_tile(col, row)  # Find the correct tile
-        draw = ImageDraw.Draw(tile.image)  # Modify the tile's image
-        draw.rectangle([x % tile_size, y % tile_size, (x % tile_size) + 10, (y % tile_size) + 10], fill=color)
-        tile.image = ImageTk.PhotoImage(tile.image)  # Update the tile image
-
-
     def set_color(self, color):
         """Set the active drawing color."""
         self.color = color
@@ -274,40 +615,47 @@ class Paint:
 
     
     def add_layer(self):
-        """Add a new layer and configure its size and scrollbars."""
-        new_canvas = Canvas(self.canvas_frame, bg="white",
-                            width=self.canvas_width, height=self.canvas_height,
-                            scrollregion=(0, 0, self.canvas_width, self.canvas_height))
-        new_canvas.grid(row=0, column=0, sticky="nsew")
+        """Add a new transparent layer on top and make it active."""
+        self.document.add_layer()  # Also makes the new layer active
+        self.refresh_layer_list()
+        self.autosave_snapshot()
 
-        if self.layers:
-            self.layers[self.active_layer_index].grid_remove()
-
-        self.layers.append(new_canvas)
-        self.active_layer_index = len(self.layers) - 1
-
-        # Set up bindings for the new canvas
-        self.setup_layer_bindings(new_canvas)
-
-        # Draw the grid
-        self.draw_grid(new_canvas)
-
-        
-
-        self.refresh_scrollbars()
-
-        # Add layer name to the listbox
-        self.layer_listbox.insert("end", f"Layer {len(self.layers)}")
-
-        # Update scrollbars for the new canvas
-       # new_canvas.config(scrollregion=(0, 0, self.canvas_width, self.canvas_height))
-        self.v_scrollbar.config(command=new_canvas.yview)
-        self.h_scrollbar.config(command=new_canvas.xview)
+    def refresh_layer_list(self):
+        """Show every document layer in the listbox and select the active one."""
+        self.layer_listbox.delete(0, "end")
+        for layer in self.document.layers:
+            self.layer_listbox.insert("end", layer.name if layer.visible else f"{layer.name} (hidden)")
+        self.layer_listbox.selection_set(self.active_layer_index)
+        self.show_layer_settings()
+
+    def show_layer_settings(self):
+        """Set the opacity slider and blend menu from the active layer."""
+        layer = self.document.active_layer
+        self.opacity_scale.set(round(layer.opacity * 100))
+        self.blend_mode.set(layer.blend_mode)
+
+    def sync_layers(self):
+        """Refresh the layer list and the view after the document's layer stack changed."""
+        self.compositor.invalidate()
+        self.refresh_layer_list()
+        self.render_view()
 
     def bind_canvas_events(self, canvas):
         """Bind events to the canvas for painting."""
-        canvas.bind('<B3-Motion>', self.paint_pixel)  # Bind for painting while dragging
-        canvas.bind('<Button-3>', self.paint_pixel)   # Bind for painting on click
+        canvas.bind('<ButtonRelease-1>', self.finish_stroke)  # A whole drag becomes one undo step
+        for sequence, handler in self.tool_bindings.items():
+            canvas.bind(sequence, handler)
+
+    def bind_tool(self, bindings):
+        """Bind the selected tool's handlers on the canvas."""
+        for sequence in self.tool_bindings:
+            if sequence not in bindings:
+                self.canvas.unbind(sequence)
+        if '<ButtonRelease-1>' not in bindings:
+            self.canvas.bind('<ButtonRelease-1>', self.finish_stroke)  # Back from a tool that replaced it
+        for sequence, handler in bindings.items():
+            self.canvas.bind(sequence, handler)
+        self.tool_bindings = bindings
 
 
     def switch_layer(self, event):
@@ -316,398 +664,555 @@ class Paint:
         if not selected_index:
             return
 
-        # Hide the current layer
-        self.layers[self.active_layer_index].grid_remove()
-
-        # Show the selected layer
+        # The compositor re-splits its cached stacks around the new active layer
+        self.finish_stroke()
         self.active_layer_index = selected_index[0]
-        active_canvas = self.layers[self.active_layer_index]
-        active_canvas.grid(row=0, column=0, sticky="nsew")
-
-        # Update scrollbar links
-        active_canvas.config(yscrollcommand=self.v_scrollbar.set, xscrollcommand=self.h_scrollbar.set)
-        self.v_scrollbar.config(command=active_canvas.yview)
-        self.h_scrollbar.config(command=active_canvas.xview)
-
-    def setup_layer_bindings(self,layer):
-       """Bind scrollbars and events to the given canvas."""
-       layer.config(yscrollcommand=self.v_scrollbar.set, xscrollcommand=self.h_scrollbar.set)
-       self.v_scrollbar.config(command=layer.yview)
-       self.h_scrollbar.config(command=layer.xview)
-
-        # Bind events for painting
-       self.bind_canvas_events(layer)
-
-        # Bind events for panning
-       layer.bind('<ButtonPress-3>', self.start_pan)  # Right mouse button to start panning
-       layer.bind('<B3-Motion>', self.pan)  # Drag with right mouse button to pan
-
-       # Update scroll region for the active canvas
-       active_canvas = self.layers[self.active_layer_index]
-       active_canvas.config(scrollregion=(0, 0, self.canvas_width, self.canvas_height))
-       self.v_scrollbar.config(command=active_canvas.yview)
-       self.h_scrollbar.config(command=active_canvas.xview)
+        self.show_layer_settings()
+
+    def toggle_layer_visibility(self):
+        """Show or hide the active layer."""
+        layer = self.document.active_layer
+        layer.visible = not layer.visible
+        self.sync_layers()
+        self.autosave_layer()
+
+    def set_layer_opacity(self, value):
+        """Apply the opacity slider to the active layer."""
+        layer = self.document.active_layer
+        opacity = int(value) / 100
+        if opacity != layer.opacity:
+            layer.opacity = opacity
+            self.render_view()
+            self.autosave_layer()
+
+    def set_blend_mode(self, mode):
+        """Apply the blend mode menu to the active layer."""
+        layer = self.document.active_layer
+        if mode != layer.blend_mode:
+            layer.blend_mode = mode
+            self.render_view()
+            self.autosave_layer()
 
     def merge_layers(self):
-        """Merge all layers into the active layer on the canvas."""
-        if not self.layers:
+        """Flatten all layers into a single layer."""
+        if len(self.document.layers) < 2:
             messagebox.showinfo("Merge Layers", "No layers to merge.")
             return
 
-        # Get the active layer to merge everything onto
-        active_canvas = self.layers[self.active_layer_index]
-
-        # Loop through all layers and merge their contents onto the active canvas
-        for i, canvas in enumerate(self.layers):
-            if i == self.active_layer_index:
-                continue  # Skip the active layer itself
-
-            # Copy each pixel from this layer to the active layer
-            for item in canvas.find_withtag("grid"):
-                coords = canvas.coords(item)
-                if len(coords) == 4:  # Only process rectangle items
-                    x1, y1, x2, y2 = map(int, coords)
-                    color = canvas.itemcget(item, "fill")
-                    if color != "white":  # Ignore white pixels
-                        active_canvas.itemconfig(f"pixel-{y1 // self.PIXEL_SIZE}-{x1 // self.PIXEL_SIZE}", fill=color)
-
-        # Clear all other layers and keep only the active one
-        for i, canvas in enumerate(self.layers):
-            if i != self.active_layer_index:
-                canvas.delete("all")
-
-        # Reset layers list to only contain the active layer
-        self.layers = [active_canvas]
-        self.layer_listbox.delete(0, "end")
-        self.layer_listbox.insert("end", "Merged Layer")
-        self.active_layer_index = 0
-        messagebox.showinfo("Merge Layers", "All layers merged into the active layer.")
+        # Composite every visible layer, bottom to top, into a single layer
+        before = list(self.document.layers), self.active_layer_index
+        self.document.merge_all()
+        self.history.push(LayersChange(self.document, *before))
 
+        # Only the merged layer remains
+        self.sync_layers()
+        self.autosave_snapshot()
+        messagebox.showinfo("Merge Layers", "All layers merged into the active layer.")
 
-    def capture_canvas_state(self,canvas):
-        """Capture the current state of the active layer."""
-        
-        state = {}
-        for item in canvas.find_withtag("grid"):
-            coords = canvas.coords(item)
-            if len(coords) == 4:
-                row = int(coords[1] // self.PIXEL_SIZE)
-                col = int(coords[0] // self.PIXEL_SIZE)
-                color = canvas.itemcget(item, "fill")
-                if color != "white":
-                    state[(row, col)] = color
-        return state
-    
-        
-    def save_state(self):
-        """Save the current state to the undo stack and clear the redo stack."""
-        active_canvas = self.layers[self.active_layer_index]  # Get the active canvas
-        self.state = self.capture_canvas_state(active_canvas)  # Pass the active canvas
-       # if not self.undo_stack or current_state != self.undo_stack[-1]:
-          #  self.undo_stack.append(current_state)
-           # self.redo_stack.clear()  # Clear redo stack on a new action
-           # print(f"State saved. Undo stack size: {len(self.undo_stack)}")
-
-    def do_state_save(self):
-        if not self.drawing_changes:
+    def merge_down(self):
+        """Merge the active layer into the layer below it."""
+        if self.active_layer_index == 0:
+            messagebox.showinfo("Merge Down", "There is no layer below the active layer.")
             return
 
-        current_state = self.capture_canvas_state()
-
-
-        if not self.undo_stack or current_state != self.undo_stack[-1]:
-            self.undo_stack.append(current_state)
-            self.redo_stack.clear()
-
-        print(f"State saved. Undo stack size: {len(self.undo_stack)}")
-
-    def bind_canvas_events(self, canvas):
-        canvas.bind('<B3-Motion>', self.paint_pixel)
-        canvas.bind('<Button-3>', self.paint_pixel)
+        before = list(self.document.layers), self.active_layer_index
+        self.document.merge_down()
+        self.history.push(LayersChange(self.document, *before))
+        self.sync_layers()
+        self.autosave_snapshot()
+
+
+    def begin_edit(self):
+        """Start recording changes to the active layer as one undo step."""
+        # Painting looks colours up in the palette, so it must see the entries unrotated
+        self.stop_color_cycle()
+        self.history.begin()
+
+    def end_edit(self, event=None):
+        """Close the current undo step, storing only the pixels it changed."""
+        delta = self.history.end()
+        if self.journal and delta:
+            self.journal.record(self.document, delta)
+            if self.journal.compact_due:
+                self.autosave_snapshot()
+            else:
+                self.report_autosave_error()
+
+    def event_to_cell(self, event):
+        """Grid (col, row) under a mouse event, accounting for scrolling and zoom."""
+        return self.view.viewport.cell_at(event.x, event.y)
 
     def paint_pixel(self, event):
-        """Paint pixels on the canvas."""
-        active_canvas = self.layers[self.active_layer_index]
-
-        # Convert event coordinates to actual canvas coordinates
-        x = active_canvas.canvasx(event.x)
-        y = active_canvas.canvasy(event.y)
-
+        """Queue a pen/eraser sample; the buffer is painted once per frame by flush_stroke."""
         # Determine the grid cell to paint
-        col = int(x // self.PIXEL_SIZE)
-        row = int(y // self.PIXEL_SIZE)
-        
-        if event.type == "4":
-            self.drawing_changes = []
-            self.save_state()
-
-        brush_size = self.size_scale.get()  # Get the brush size from the scale
-        color = self.color if not self.eraser_on else "white"
-
-        # Draw multiple pixels based on brush size
-        for r in range(row, row + brush_size):
-            for c in range(col, col + brush_size):
-                # Ensure the drawn pixel is within the grid bounds
-                if 0 <= c < self.GRID_SIZE and 0 <= r < self.GRID_SIZE:
-                    active_canvas.itemconfig(f"pixel-{r}-{c}", fill=color)
-                    self.drawing_changes.append((r,c,color))
-
-    def update_canvas_grid(self):
-        self.canvas_width = self.GRID_SIZE * self.PIXEL_SIZE
-        self.canvas_height = self.GRID_SIZE * self.PIXEL_SIZE
-
-        # Clear all items and reconfigure canvas
-        self.canvas.delete("all")  # Ensure the old grid is removed
-        self.canvas.config(scrollregion=(0, 0, self.canvas_width, self.canvas_height))
-        self.draw_grid(self.canvas)
-
-        # Update the canvas size and scrollregion
-        self.canvas.config(scrollregion=(0, 0, self.canvas_width, self.canvas_height))
-        self.canvas.delete("all")
-        self.draw_grid(self.canvas)
-
-    # Force the canvas to respect the scrollbars' positions
-        self.force_resize()
-
-    def force_resize(self):
-        """Force canvas layout recalculation."""
-        self.canvas.update_idletasks()
-
-
-    
-    def restore_canvas_state(self, state):
-        """Restore a canvas state."""
-        canvas = self.layers[self.active_layer_index]
-        for (row, col), color in state.items():
-            pixel_tag = f"pixel-{row}-{col}"
-            canvas.itemconfig(pixel_tag, fill=color)
+        col, row = self.event_to_cell(event)
+
+        if event.type == "4" or self.stroke is None:
+            self.finish_stroke()
+            self.begin_edit()
+            color = self.color if not self.eraser_on else TRANSPARENT
+            self.stroke = Stroke(self.document, color, brush=self.current_brush())
+
+        self.stroke.add(col, row)
+        if self.flush_job is None:
+            self.flush_job = self.root.after_idle(self.flush_stroke)
+
+    def flush_stroke(self):
+        """Stamp the queued samples into the layer buffer and upload the dirty rectangle."""
+        self.flush_job = None
+        if self.stroke:
+            rect = self.stroke.flush()
+            if rect:
+                self.render_view(rect)
+
+    def finish_stroke(self, event=None):
+        """Paint any samples still queued and close the stroke as one undo step."""
+        if self.flush_job is not None:
+            self.root.after_cancel(self.flush_job)
+            self.flush_job = None
+        if self.stroke:
+            rect = self.stroke.finish()  # Includes the cell a pixel-perfect stroke holds back
+            if rect:
+                self.render_view(rect)
+        self.stroke = None
+        self.end_edit()
+
+    def current_brush(self):
+        """The brush described by the size, shape, dither and pixel-perfect controls."""
+        dither = self.dither_scale.get()
+        shape = self.brush_shape.get()
+        if shape == 'custom':
+            if self.custom_brush is not None:
+                return self.custom_brush.dithered(dither)
+            shape = 'square'
+        return make_brush(shape, self.size_scale.get(), dither, self.pixel_perfect.get())
+
+    def brush_from_selection(self):
+        """Use the selected cells' shape as a custom brush."""
+        brush = bitmap_brush(self.selection.mask) if self.selection else None
+        if brush is None:
+            messagebox.showinfo("Brush from Selection", "Select the cells to use as a brush first.")
+            return
+        self.custom_brush = brush
+        self.brush_shape.set('custom')
+        self.use_pen()
+
+    def show_history_entry(self, entry, undone):
+        """Redraw whatever an undone or redone history entry touched, and journal it."""
+        if isinstance(entry, PixelDelta):
+            if entry.layer in self.document.layers:
+                # The layer may sit inside one of the compositor's cached stacks
+                self.compositor.invalidate(entry.rect)
+                self.render_view(entry.rect)
+                if self.journal:
+                    self.journal.record(self.document, entry, undone)
+        else:
+            self.sync_layers()
+            self.autosave_snapshot()
 
     def undo(self):
         """Undo the last action."""
-        if self.undo_stack:
-            current_state = self.capture_canvas_state()
-            self.redo_stack.append(current_state)
-            prev_state = self.undo_stack.pop()
-            self.restore_canvas_state(prev_state)
-            self.drawing_changes = []
-            print(f"Undo stack size: {len(self.undo_stack)}, Redo stack size: {len(self.redo_stack)}")
+        self.end_edit()  # An open edit is journaled before it can be undone
+        entry = self.history.undo()
+        if entry:
+            self.show_history_entry(entry, undone=True)
 
     def redo(self):
         """Redo the last undone action."""
-        if self.redo_stack:
-            current_state = self.capture_canvas_state()
-            self.undo_stack.append(current_state)
-
-            next_state = self.redo_stack.pop()
-            self.restore_canvas_state(next_state)
-            
-            print(f"Undo stack size: {len(self.undo_stack)}, Redo stack size: {len(self.redo_stack)}")
-
-    def rebind_canvas_events(self):
-        """Reset canvas bindings to the default paint behavior."""
-        for canvas in self.layers:
-            self.bind_canvas_events(canvas)
-
+        self.end_edit()
+        entry = self.history.redo()
+        if entry:
+            self.show_history_entry(entry, undone=False)
 
     def clear_canvas(self):
         """Clear the entire current layer including the grid and any drawn pixels."""
-        canvas = self.layers[self.active_layer_index]
-        
-        # Delete all items on the canvas (both grid and drawn pixels)
-        canvas.delete("all")
-        
-        # Redraw the grid to the cleared canvas
-        self.draw_grid(canvas)
-        self.save_state()
+        # Clear the pixel buffer as one undo step, then re-upload the canvas image from it
+        self.begin_edit()
+        self.document.clear_layer()
+        self.end_edit()
+        self.render_view()
 
     def flood_fill(self, event):
         """Flood-fill operation starting from the clicked pixel."""
-        self.save_state()
-        canvas = self.layers[self.active_layer_index]
-        col = event.x // self.PIXEL_SIZE
-        row = event.y // self.PIXEL_SIZE
-
-    # Get the color of the starting pixel
-        start_pixel_tag = f"pixel-{row}-{col}"
-        start_color = canvas.itemcget(start_pixel_tag, "fill")
-
-    # If the starting pixel is already the target color, do nothing
-        if start_color == self.color:
+        col, row = self.event_to_cell(event)
+        if not (0 <= row < self.document.height and 0 <= col < self.document.width):
             return
 
-    # Stack for storing pixels to process
-        stack = [(row, col)]
+        # Span-based fill on the layer buffer, recorded as a single undo step
+        self.begin_edit()
+        rect = scanline_fill(self.document, col, row, self.color,
+                             tolerance=self.fill_tolerance.get(),
+                             connectivity=8 if self.fill_diagonal.get() else 4,
+                             contiguous=not self.fill_global.get())
+        self.end_edit()
+        if rect:
+            self.render_view(rect)
 
-        while stack:
-            r, c = stack.pop()
-            pixel_tag = f"pixel-{r}-{c}"
-
-            # Skip if pixel is out of bounds or already the target color
-            if not (0 <= r < self.GRID_SIZE and 0 <= c < self.GRID_SIZE):
-                continue
-            if canvas.itemcget(pixel_tag, "fill") != start_color:
-                continue
-
-            # Change the color of the current pixel
-            canvas.itemconfig(pixel_tag, fill=self.color)
-
-            # Add neighboring pixels to the stack
-            stack.extend([(r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)])
-        
     def use_flood_fill(self):
         """Activate the flood-fill tool."""
         self.eraser_on = False
         self.var_status.set("Selected Tool: Flood Fill")
-        for canvas in self.layers:
-            canvas.bind('<Button-1>', self.flood_fill)
-        self.save_state()
+        self.bind_tool({'<Button-1>': self.flood_fill})
     def choose_color(self):
             """Choose a new drawing color."""
             self.eraser_on = False
             color = askcolor(color=self.color)
             if color[1]:
                 self.color = color[1]
+                if self.document.palette is not None:
+                    self.add_palette_colors([self.color])
         
     def use_pen(self):
         """Switch to pen tool."""
         self.eraser_on = False
         self.var_status.set("Selected Tool: Pen")
-        for canvas in self.layers:
-            canvas.bind('<Button-1>', self.paint_pixel)  # Save state in paint_pixel
-            canvas.bind('<B1-Motion>', self.paint_pixel)
-        self.save_state()
+        self.bind_tool({'<Button-1>': self.paint_pixel, '<B1-Motion>': self.paint_pixel})
     def use_eraser(self):
         """Switch to eraser tool."""
         self.eraser_on = True
         self.var_status.set("Selected Tool: Eraser")
-        for canvas in self.layers:
-            canvas.bind('<Button-1>', self.paint_pixel)  
-            canvas.bind('<B1-Motion>', self.paint_pixel)
-        self.save_state()    
-    def capture_canvas_state(self,canvas):
-            """Capture the current state of the canvas (grid colors)."""
-            
-            state = {}
-            for item in canvas.find_withtag("grid"):
-                coords = canvas.coords(item)
-                
-                if len(coords) == 4:
-                     row = int(coords[1] // self.PIXEL_SIZE)  # Calculate the row
-                     col = int(coords[0] // self.PIXEL_SIZE)
-                     color = canvas.itemcget(item, "fill")
-                     if color != "white":
-                        state[(row, col)] = color
-            return state
-
-    def apply_canvas_state(self, state,canvas):
-            """Apply a saved state to the canvas."""
-            for (row, col), color in state.items():
-                
-                # Translate logical grid coordinates into visual pixel coordinates
-                x1 = col * self.PIXEL_SIZE
-                y1 = row * self.PIXEL_SIZE
-                x2 = x1 + self.PIXEL_SIZE
-                y2 = y1 + self.PIXEL_SIZE
-                canvas.create_rectangle(x1, y1, x2, y2, outline="lightgray", fill=color,
-                                        tags=(f"pixel-{row}-{col}", "grid"))
+        self.bind_tool({'<Button-1>': self.paint_pixel, '<B1-Motion>': self.paint_pixel})
+    def use_select_rect(self):
+        """Activate the rectangle selection tool."""
+        self.use_selection_tool('rect', "Select Rect")
+
+    def use_lasso(self):
+        """Activate the lasso selection tool."""
+        self.use_selection_tool('lasso', "Lasso")
+
+    def use_selection_tool(self, mode, name):
+        self.eraser_on = False
+        self.selection_mode = mode
+        self.var_status.set(f"Selected Tool: {name}")
+        self.bind_tool({'<ButtonPress-1>': self.start_selection, '<B1-Motion>': self.drag_selection,
+                        '<ButtonRelease-1>': self.finish_selection})
+
+    def start_selection(self, event):
+        """Start a new selection at the clicked cell."""
+        self.canvas.focus_set()  # For the arrow keys
+        self.selection_path = [self.event_to_cell(event)]
+        self.draw_selection()
+
+    def drag_selection(self, event):
+        """Follow the drag with the rectangle's far corner or the lasso's path."""
+        if not self.selection_path:
+            return self.start_selection(event)
+        cell = self.event_to_cell(event)
+        if self.selection_mode == 'lasso':
+            if cell != self.selection_path[-1]:
+                self.selection_path.append(cell)
+        else:
+            self.selection_path[1:] = [cell]
+        self.draw_selection()
+
+    def finish_selection(self, event=None):
+        """Turn the dragged outline into the selection; a click without a drag selects nothing."""
+        path, self.selection_path = self.selection_path, []
+        width, height = self.document.width, self.document.height
+        if self.selection_mode == 'lasso':
+            self.selection = Selection.lasso(path, width, height)
+        elif len(path) > 1:
+            self.selection = Selection.rectangle(*path[0], *path[-1], width, height)
+        else:
+            self.selection = None
+        self.draw_selection()
+
+    def clear_selection(self, event=None):
+        self.selection = None
+        self.draw_selection()
+
+    def draw_selection(self):
+        """Outline the path being dragged, or else the selection's bounds, over the viewport."""
+        self.canvas.delete("selection")
+        viewport = self.view.viewport
+        outline = dict(fill="white", dash=(4, 4), tags="selection")
+        if len(self.selection_path) > 1 and self.selection_mode == 'lasso':
+            points = [coord for col, row in self.selection_path for coord in viewport.to_screen(col + 0.5, row + 0.5)]
+            self.canvas.create_line(*points, *points[:2], **outline)
+            return
+        if self.selection_path:
+            (ax, ay), (bx, by) = self.selection_path[0], self.selection_path[-1]
+            rect = (min(ax, bx), min(ay, by), max(ax, bx) + 1, max(ay, by) + 1)
+        elif self.selection:
+            rect = self.selection.rect
+        else:
+            return
+        x0, y0, x1, y1 = rect
+        outline["outline"] = outline.pop("fill")
+        self.canvas.create_rectangle(*viewport.to_screen(x0, y0), *viewport.to_screen(x1, y1), **outline)
+
+    def transform_selection(self, operation):
+        """Apply a selection transform to the selected pixels, or the whole layer, as one undo step."""
+        selection = self.selection or Selection((0, 0, self.document.width, self.document.height))
+        self.begin_edit()
+        result, rect = transform(self.document, selection, operation)
+        self.end_edit()
+        if self.selection:
+            self.selection = result  # The selection follows the pixels it moved
+        self.render_view(rect)
+        self.draw_selection()
 
     def flip_horizontal(self):
-            """Flip the canvas horizontally."""
-            state = self.capture_canvas_state()
-            flipped_state = {(row, self.GRID_SIZE - col - 1): color for (row, col), color in state.items()}
-            self.apply_canvas_state(flipped_state)
+        """Flip the selection, or the whole layer, horizontally."""
+        self.transform_selection(mirror_horizontal)
 
     def flip_vertical(self):
-            """Flip the canvas vertically."""
-            state = self.capture_canvas_state()
-            flipped_state = {(self.GRID_SIZE - row - 1, col): color for (row, col), color in state.items()}
-            self.apply_canvas_state(flipped_state)
+        """Flip the selection, or the whole layer, vertically."""
+        self.transform_selection(mirror_vertical)
 
     def rotate_90(self):
-            """Rotate the canvas 90° clockwise."""
-            state = self.capture_canvas_state()
-            rotated_state = {(col, self.GRID_SIZE - row - 1): color for (row, col), color in state.items()}
-            self.apply_canvas_state(rotated_state)
+        """Rotate the selection, or the whole layer, 90° clockwise about its centre."""
+        self.transform_selection(quarter_turn)
+
+    def scale_selection(self):
+        """Scale the selection, or the whole layer, by a percentage with nearest-neighbour sampling."""
+        percent = askinteger("Scale", "Scale (%):", initialvalue=200, minvalue=1, maxvalue=1600)
+        if percent:
+            x0, y0 = self.selection.rect[:2] if self.selection else (0, 0)
+            limit = (self.document.width - x0, self.document.height - y0)
+            self.transform_selection(scaler(percent / 100, percent / 100, limit))
+
+    def move_selection(self, dx, dy):
+        """Move the selected pixels, or the whole layer, by (dx, dy) cells."""
+        self.transform_selection(mover(dx, dy))
+
+#-------------------------------------------------- Indexed Colour --------------------------------------------
+
+    def refresh_swatches(self):
+        """Show the fixed swatches, or every palette entry of an indexed document (right-click edits one)."""
+        for widget in self.color_frame.winfo_children():
+            widget.destroy()
+        palette = self.document.palette
+        colors = self.SWATCHES if palette is None else [to_hex(color) for color in palette.entries()]
+        for index, color in enumerate(colors):
+            button = Button(self.color_frame, bg=color, width=2, height=1,
+                            command=lambda c=color: self.set_color(c))
+            button.grid(row=index // self.SWATCH_COLUMNS, column=index % self.SWATCH_COLUMNS, padx=2)
+            if palette is not None:
+                button.bind('<Button-3>', lambda event, i=index + 1: self.edit_palette_entry(i))
+
+    def edit_palette_entry(self, index):
+        """Change one palette colour; every pixel drawn with it follows without being touched.
+
+        Saved frames are flattened RGBA, so they are recoloured to match.
+        """
+        self.stop_color_cycle()
+        color = askcolor(color=to_hex(self.document.palette.colors[index]))
+        if color[1]:
+            colors = self.document.palette.entries()
+            colors[index - 1] = parse_color(color[1])
+            swap_palette(self.document, self.frames, colors)
+            self.refresh_swatches()
+            self.redraw_view()
+            self.autosave_snapshot()
+
+    def toggle_indexed_mode(self):
+        """Convert the document between RGBA layers and palette-indexed layers."""
+        self.stop_color_cycle()
+        self.finish_stroke()
+        if self.document.palette is None:
+            # Seed the palette with the swatches and the pen colour, so a blank document has colours to paint with
+            palette = document_palette(self.document)
+            for color in [self.color] + list(self.SWATCHES):
+                palette.ensure(color)
+            to_indexed(self.document, palette)
+            self.var_status.set(f"Indexed Mode: {len(palette) - 1} colours")
+        else:
+            to_rgba(self.document)
+            self.var_status.set("RGBA Mode")
+        self.show_new_layers()
+
+    def add_palette_colors(self, colors):
+        """Append the colours an indexed document's palette lacks while it has room, and show them."""
+        count = len(self.document.palette)
+        for color in colors:
+            self.document.palette.ensure(color)
+        if len(self.document.palette) != count:
+            self.refresh_swatches()
+            self.autosave_snapshot()
+
+    def load_palette_file(self):
+        """Swap in the colours of a palette file, across the layers and every frame.
+
+        An RGBA document is converted to the palette instead, each colour
+        becoming its nearest palette entry.
+        """
+        patterns = " ".join("*" + ext for ext in PALETTE_FORMATS + (".png", ".gif"))
+        path = askopenfilename(filetypes=[("Palettes", patterns), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            colors = load_palette(path)
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Load Palette", f"Could not read {path}: {error}")
+            return
+        self.stop_color_cycle()
+        self.finish_stroke()
+        if self.document.palette is None:
+            to_indexed(self.document, Palette(colors))
+            self.show_new_layers()
+        else:
+            swap_palette(self.document, self.frames, colors)
+            self.refresh_swatches()
+            self.redraw_view()
+            self.autosave_snapshot()
+
+    def show_new_layers(self):
+        """Redraw after the layers were converted to another kind of cells."""
+        self.history.clear()  # Recorded deltas hold the old kind of cells
+        self.sync_layers()
+        self.refresh_swatches()
+        self.autosave_snapshot()
+
+    def toggle_color_cycle(self):
+        """Start or stop rotating a range of palette entries on the canvas; stopping restores the colours."""
+        if self.cycle_job is not None:
+            return self.stop_color_cycle()
+        palette = self.document.palette
+        if palette is None or len(palette) < 3:
+            messagebox.showinfo("Cycle Colors", "Colour cycling needs an indexed document with two or more colours.")
+            return
+        answer = askstring("Cycle Colors", "Palette entries to cycle (first-last):",
+                           initialvalue=f"1-{len(palette) - 1}")
+        try:
+            first, last = (int(part) for part in answer.split("-"))
+        except (AttributeError, ValueError):
+            return
+        first, last = max(first, 1), min(last, len(palette) - 1)
+        if last <= first:
+            return
+        self.cycle_range = (first, last + 1)
+        self.cycle_colors = palette.entries()
+        self.cycle_step = 0
+        self.cycle_clock = PlaybackClock(last + 1 - first, self.CYCLE_MS)
+        self.cycle_palette()
+
+    def cycle_palette(self):
+        """Rotate the cycled entries to the step due now; only the lookup table changes."""
+        index, delay = self.cycle_clock.tick()
+        if index is not None:
+            self.document.palette.cycle(*self.cycle_range, index - self.cycle_step)
+            self.cycle_step = index
+            self.redraw_view()
+        self.cycle_job = self.root.after(delay, self.cycle_palette)
+
+    def stop_color_cycle(self):
+        if self.cycle_job is None:
+            return
+        self.root.after_cancel(self.cycle_job)
+        self.cycle_job = None
+        self.document.palette.set_colors(self.cycle_colors)
+        self.redraw_view()
 
 #-------------------------------------------------- Frame/Animation Functionality --------------------------------------------
 
     def save_frame(self):
         """Save the current canvas state as an in-memory frame."""
-        canvas = self.layers[self.active_layer_index]
-        image = Image.new("RGBA", (self.canvas_width, self.canvas_height), "white")
-        draw = ImageDraw.Draw(image)
-
-        # Draw canvas items on the image
-        for item in canvas.find_withtag("grid"):
-            coords = canvas.coords(item)
-            if len(coords) == 4:  # Handle rectangle items
-                x1, y1, x2, y2 = map(int, coords)
-                color = canvas.itemcget(item, "fill")
-                if color != "white":
-                    draw.rectangle([x1, y1, x2, y2], fill=color)
-
-        # Save the image in the in-memory list
-        self.frames.append(image)
+        # Keep the visible composite at grid resolution; an unchanged canvas shares the earlier frame's pixels
+        self.frames.append(self.document.flatten())
+        self.update_frame_listbox()
+        self.autosave_snapshot()
         messagebox.showinfo("Save Frame", f"Frame {len(self.frames)} saved.")
 
-    def delete_frame(self):
-        """Delete a selected frame."""
-        selected = self.frame_listbox.curselection()
-        if selected:
-            index = selected[0]
-            del self.frames[index]
-            self.update_frame_list()
+    def frame_photo(self, pixels):
+        """A PhotoImage of RGBA pixels scaled to the canvas zoom over white."""
+        rgb = flatten_rgb(scale_nearest(pixels, self.PIXEL_SIZE))
+        image = PhotoImage(master=self.root, width=rgb.shape[1], height=rgb.shape[0])
+        image.put(ppm_data(rgb))
+        return image
+
+    def preview_neighbours(self, index):
+        """Frames drawn as onion skins around index, or none when onion skinning is off."""
+        if not self.onion_skin.get():
+            return [], []
+        depth = self.onion_depth.get()
+        return onion_neighbours(len(self.frames), index, depth, depth)
+
+    def preview_key(self, index):
+        """What a preview image shows: the zoom and the content of the frame and its onion skins."""
+        earlier, later = self.preview_neighbours(index)
+        keys = self.frames.key
+        return (self.PIXEL_SIZE, keys(index),
+                tuple(keys(i) for i in earlier), tuple(keys(i) for i in later))
+
+    def build_previews(self):
+        """Convert every frame to a preview image once, reusing cached images whose frames did not change."""
+        cache, self.preview_images = self.preview_images, {}
+        self.preview_frames = []
+        for index in range(len(self.frames)):
+            key = self.preview_key(index)
+            image = cache.get(key) or self.preview_images.get(key)
+            if image is None:
+                # Onion skins are blended here once, not on every tick
+                earlier, later = self.preview_neighbours(index)
+                image = self.frame_photo(onion_skin(self.frames[index], [self.frames[i] for i in earlier],
+                                                    [self.frames[i] for i in later]) if earlier or later
+                                         else self.frames[index])
+            self.preview_images[key] = image
+            self.preview_frames.append(image)
 
     def play_animation(self):
         """Play saved frames as an animation in a separate window."""
         if not self.frames:
             messagebox.showinfo("Animation", "No frames to play.")
             return
+        self.stop_animation()
 
         # Create a new Toplevel window for the animation preview
         self.animation_window = Toplevel(self.root)
         self.animation_window.title("Animation Preview")
-        self.animation_window.geometry(f"{self.canvas_width}x{self.canvas_height}")
         self.animation_window.protocol("WM_DELETE_WINDOW", self.stop_animation)  # Stop animation on close
 
         # Add a Label to display frames
         self.animation_label = Label(self.animation_window)
         self.animation_label.pack()
 
-        # Create a slider to adjust animation speed
+        # Create a slider to adjust the speed of frames that have no time of their own
         self.speed_scale = Scale(self.animation_window, from_=10, to=500, 
-                                orient='horizontal', label='Speed (ms/frame)')
+                                orient='horizontal', label='Default speed (ms/frame)')
         self.speed_scale.set(100)  # Default speed
         self.speed_scale.pack()
+        self.onion_skin = BooleanVar(value=False)
+        Checkbutton(self.animation_window, text='Onion Skin', variable=self.onion_skin,
+                    command=self.build_previews).pack(anchor='w')
+        self.onion_depth = Scale(self.animation_window, from_=1, to=3, orient='horizontal', label='Onion Frames',
+                                 command=lambda value: self.build_previews())
+        self.onion_depth.pack()
+        self.playback_status = StringVar()
+        Label(self.animation_window, textvariable=self.playback_status).pack()
 
         # Start animation
+        self.build_previews()
+        self.playback = PlaybackClock(len(self.frames), self.preview_durations(self.speed_scale.get()))
+        self.speed_scale.config(command=lambda value: self.playback.set_duration(self.preview_durations(int(value))))
         self.is_playing = True
         self.current_frame_index = 0
         self.animate_frames()
 
-    def animate_frames(self):
-        """Display frames in the animation window."""
-        if not self.is_playing or self.current_frame_index >= len(self.frames):
-            self.current_frame_index = 0  # Restart animation
-            if not self.is_playing:
-                return
-
-        # Convert the current frame to a PhotoImage
-        frame_image = ImageTk.PhotoImage(self.frames[self.current_frame_index])
-        self.animation_label.config(image=frame_image)
-        self.animation_label.image = frame_image  # Keep a reference to avoid garbage collection
-
-        # Move to the next frame
-        self.current_frame_index += 1
+    def preview_durations(self, default):
+        """Milliseconds each frame shows for, as exported: its own time, or default."""
+        return [default if duration is None else duration for duration in self.frames.durations]
 
-        # Schedule the next frame based on the speed slider
-        speed = self.speed_scale.get()  # Get the speed value from the slider
-        self.animation_window.after(speed, self.animate_frames)
+    def animate_frames(self):
+        """Show the frame that is due and schedule the next tick for when the following one is."""
+        self.animation_job = None
+        if not self.is_playing:
+            return
+        index, delay = self.playback.tick()
+        if index is not None:
+            self.current_frame_index = index
+            self.animation_label.config(image=self.preview_frames[index])
+            if index == 0:
+                self.playback_status.set(f"{self.playback.fps():.1f} fps, {self.playback.skipped} frames skipped")
+        self.animation_job = self.animation_window.after(delay, self.animate_frames)
 
 
     def stop_animation(self):
         """Stop the animation and close the preview window."""
         self.is_playing = False
+        if self.animation_job is not None:
+            self.animation_window.after_cancel(self.animation_job)
+            self.animation_job = None
         if hasattr(self, 'animation_window') and self.animation_window.winfo_exists():
             self.animation_window.destroy()
 
@@ -715,22 +1220,25 @@ class Paint:
     def update_frame_listbox(self):
         """Update the Listbox to reflect the current frames."""
         self.frame_listbox.delete(0, END)  # Clear the listbox
-        for idx, frame in enumerate(self.frames):
-            self.frame_listbox.insert(END, f"Frame {idx + 1}")
+        for idx, duration in enumerate(self.frames.durations):
+            self.frame_listbox.insert(END, f"Frame {idx + 1}" if duration is None else f"Frame {idx + 1} ({duration} ms)")
 
     def refresh_scrollbars(self):
-        """Refresh scrollbar configuration for the active canvas."""
-        active_canvas = self.layers[self.active_layer_index]
-        self.v_scrollbar.config(command=active_canvas.yview)
-        self.h_scrollbar.config(command=active_canvas.xview)
+        """Show the viewport's position in the document on the scrollbars."""
+        fx, fy = self.view.viewport.scroll_fractions(self.document.width, self.document.height)
+        self.h_scrollbar.set(*fx)
+        self.v_scrollbar.set(*fy)
 
     def select_frame(self, event):
         """Select a frame from the Listbox."""
         try:
             selected_index = self.frame_listbox.curselection()[0]
             self.current_frame_index = selected_index
-            self.canvas_image = ImageTk.PhotoImage(self.frames[selected_index])
-            self.canvas.create_image(0, 0, anchor=NW, image=self.canvas_image)
+            self.canvas_image = self.frame_photo(self.frames[selected_index])
+            # A preview over the document's corner until the view is next drawn; the layers are left alone
+            self.canvas.delete("frame_preview")
+            self.canvas.create_image(*self.view.viewport.to_screen(0, 0), anchor=NW, image=self.canvas_image,
+                                     tags="frame_preview")
         except IndexError:
             pass  # No selection made
 
@@ -740,6 +1248,7 @@ class Paint:
             selected_index = self.frame_listbox.curselection()[0]
             del self.frames[selected_index]
             self.update_frame_listbox()
+            self.autosave_snapshot()
         except IndexError:
             messagebox.showinfo("Delete Frame", "No frame selected.")
 
@@ -747,21 +1256,34 @@ class Paint:
         """Duplicate the selected frame."""
         try:
             selected_index = self.frame_listbox.curselection()[0]
-            self.frames.insert(selected_index + 1, self.frames[selected_index].copy())
+            self.frames.duplicate(selected_index)  # Shares the pixels instead of copying them
             self.update_frame_listbox()
+            self.autosave_snapshot()
         except IndexError:
             messagebox.showinfo("Duplicate Frame", "No frame selected.")
 
+    def set_frame_duration(self):
+        """Set how long the selected frame shows in exported animations."""
+        try:
+            selected_index = self.frame_listbox.curselection()[0]
+        except IndexError:
+            messagebox.showinfo("Frame Time", "No frame selected.")
+            return
+        duration = askinteger("Frame Time", "Milliseconds to show this frame (0 for the default):",
+                              minvalue=0, maxvalue=60000)
+        if duration is not None:
+            self.frames.durations[selected_index] = duration or None
+            self.update_frame_listbox()
+            self.autosave_snapshot()
+
     def move_frame_up(self):
         """Move the selected frame up in the order."""
         try:
             selected_index = self.frame_listbox.curselection()[0]
             if selected_index > 0:
-                self.frames[selected_index], self.frames[selected_index - 1] = (
-                    self.frames[selected_index - 1],
-                    self.frames[selected_index],
-                )
+                self.frames.move(selected_index, selected_index - 1)
                 self.update_frame_listbox()
+                self.autosave_snapshot()
                 self.frame_listbox.select_set(selected_index - 1)
         except IndexError:
             messagebox.showinfo("Move Frame", "No frame selected or already at the top.")
@@ -771,11 +1293,9 @@ class Paint:
         try:
             selected_index = self.frame_listbox.curselection()[0]
             if selected_index < len(self.frames) - 1:
-                self.frames[selected_index], self.frames[selected_index + 1] = (
-                    self.frames[selected_index + 1],
-                    self.frames[selected_index],
-                )
+                self.frames.move(selected_index, selected_index + 1)
                 self.update_frame_listbox()
+                self.autosave_snapshot()
                 self.frame_listbox.select_set(selected_index + 1)
         except IndexError:
             messagebox.showinfo("Move Frame", "No frame selected or already at the bottom.")
@@ -784,48 +1304,201 @@ class Paint:
 
 
     def save_file(self):
-        """Save the current layer as an image using PyQt5."""
-        # Create a QImage to capture the canvas drawing
-        image = QImage(self.canvas_width, self.canvas_height, QImage.Format_ARGB32)
-        image.fill(Qt.white)  # Set background to white        
-
-            # Use QPainter to render the current canvas to the QImage
-        painter = QPainter(image)
-        current_canvas = self.layers[self.active_layer_index]
-
-            # Loop through each pixel and draw it using the painter
-        for item in current_canvas.find_withtag("grid"):
-            coords = current_canvas.coords(item)
-            if len(coords) == 4:  # Only handle rectangle items
-                x1, y1, x2, y2 = map(int, coords)
-                color = current_canvas.itemcget(item, "fill")
-                if color != "white":  # Only draw non-white pixels
-                    painter.fillRect(x1, y1, x2 - x1, y2 - y1, QColor(color))
-
-        painter.end()
-
-            # Save the image as a PNG file
-        file_name = "layer_output.png"
-        image.save(file_name)
-        messagebox.showinfo("Save", f"Layer saved as {file_name}")
+        """Ask what to export and how, then write PNGs straight from the pixel buffers."""
+        dialog = Toplevel(self.root)
+        dialog.title("Export PNG")
+
+        source = StringVar(value="active")
+        for value, text in (("active", "Active layer"), ("composite", "All visible layers"),
+                            ("layers", "Every layer as its own file")):
+            Radiobutton(dialog, text=text, variable=source, value=value).pack(anchor='w')
+        scale = Scale(dialog, from_=1, to=32, orient='horizontal', label="Scale")
+        scale.pack(fill='x', pady=5)
+        transparent = BooleanVar(value=True)
+        Checkbutton(dialog, text='Keep Transparency', variable=transparent).pack(anchor='w')
+        indexed = BooleanVar(value=False)
+        Checkbutton(dialog, text='Indexed Palette', variable=indexed).pack(anchor='w')
+        compression = Scale(dialog, from_=0, to=9, orient='horizontal', label="Compression")
+        compression.set(9)
+        compression.pack(fill='x', pady=5)
+
+        def export():
+            path = asksaveasfilename(parent=dialog, defaultextension=".png", initialfile="layer_output.png",
+                                     filetypes=[("PNG image", "*.png")])
+            if not path:
+                return
+            background = None if transparent.get() else "white"
+            written = export_png(Project(self.document), path, scale.get(), background, indexed.get(),
+                                 compression.get(), source.get())
+            dialog.destroy()
+            messagebox.showinfo("Save", "Saved " + ", ".join(written))
+
+        Button(dialog, text='Export', command=export).pack(fill='x', pady=2)
+
+    def current_project(self):
+        """The document and frames as a GUI-free project."""
+        # The stored frames are read-only, so the list can be handed to another thread as is
+        return Project(self.document, list(self.frames), durations=list(self.frames.durations))
+
+    def save_project(self):
+        """Write the layers and frames to a project file."""
+        path = asksaveasfilename(defaultextension=EXTENSION, initialfile="sprite" + EXTENSION,
+                                 filetypes=[("GoDraw project", "*" + EXTENSION)])
+        if path:
+            save_project(self.current_project(), path)
+            messagebox.showinfo("Save Project", f"Project saved as {path}")
+
+    def open_project(self):
+        """Replace the document and frames with those of a project file."""
+        path = askopenfilename(filetypes=[("GoDraw project", "*" + EXTENSION)])
+        if not path:
+            return
+        try:
+            project = load_project(path)
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Open Project", f"Could not open {path}: {error}")
+            return
+        self.finish_stroke()
+        self.frames = FrameStore(project.frames, project.durations)
+        self.load_document(project.document)
+
+    def import_image(self):
+        """Ask how, then bring a PNG, GIF, APNG or sprite sheet in as new layers or frames.
+
+        Sources larger than the grid are shrunk to fit it, keeping their
+        aspect; every frame is converted as a whole array, so the canvas is
+        redrawn once at the end however many frames there are.
+        """
+        dialog = Toplevel(self.root)
+        dialog.title("Import Image")
+
+        target = StringVar(value="layers")
+        for value, text in (("layers", "As new layers"), ("frames", "As animation frames")):
+            Radiobutton(dialog, text=text, variable=target, value=value).pack(anchor='w')
+        method = StringVar(value="nearest")
+        for value, text in zip(RESAMPLING, ("Nearest neighbour", "Box average")):
+            Radiobutton(dialog, text=text, variable=method, value=value).pack(anchor='w')
+        colors = Scale(dialog, from_=0, to=Palette.SIZE - 1, orient='horizontal', label="Colours (0 keeps all)")
+        colors.pack(fill='x', pady=5)
+        columns = Scale(dialog, from_=1, to=32, orient='horizontal', label="Sheet Columns")
+        columns.pack(fill='x', pady=5)
+        rows = Scale(dialog, from_=1, to=32, orient='horizontal', label="Sheet Rows")
+        rows.pack(fill='x', pady=5)
+
+        def load():
+            patterns = " ".join("*" + ext for ext in IMPORT_FORMATS)
+            path = askopenfilename(parent=dialog, filetypes=[("Images", patterns), ("All files", "*.*")])
+            if not path:
+                return
+            start = time.perf_counter()
+            try:
+                frames, durations = import_image(path, self.document.width, self.document.height, method.get(),
+                                                  colors.get(), (columns.get(), rows.get()))
+            except (OSError, ValueError) as error:
+                messagebox.showerror("Import Image", f"Could not import {path}: {error}", parent=dialog)
+                return
+            dialog.destroy()
+            self.finish_stroke()
+            name = os.path.splitext(os.path.basename(path))[0]
+            if target.get() == "layers":
+                before = list(self.document.layers), self.active_layer_index
+                add_image_layers(self.document, frames, name)
+                self.history.push(LayersChange(self.document, *before))
+                self.sync_layers()
+            else:
+                for pixels, duration in zip(frames, durations):
+                    self.frames.append(padded(pixels, self.document.width, self.document.height), duration)
+                self.update_frame_listbox()
+            self.autosave_snapshot()
+            h, w = frames[0].shape[:2]
+            self.var_status.set(f"Imported {len(frames)} {w}x{h} image(s) from {name} "
+                                f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        Button(dialog, text='Choose File...', command=load).pack(fill='x', pady=2)
+
+    def load_document(self, document):
+        """Show another document, with a fresh history and the whole grid in view."""
+        self.stop_color_cycle()  # It restores colours into the current document's palette
+        if not document.layers:
+            document.add_layer()
+        self.document = document
+        self.selection = None
+        self.compositor = Compositor(document)
+        self.history = History(document, self.HISTORY_BUDGET)
+        self.set_grid_size(max(document.width, document.height))
+        self.view.compositor = self.compositor
+        if self.instrument:
+            self.instrument.wrap(self.compositor, ('render', 'sample'))
+        self.view.clear()
+        self.view.viewport.fit(document.width, document.height)
+        self.zoom_scale.set(self.view.viewport.zoom)
+        self.refresh_layer_list()
+        self.refresh_swatches()
+        self.update_frame_listbox()
+        self.redraw_view()
+        self.autosave_snapshot()
 
     def export_as_gif(self):
-        """Export all frames as a GIF."""
+        """Export all frames as an animated GIF, APNG or WebP in a worker process."""
         if not self.frames:
             messagebox.showinfo("Export", "No frames to export.")
             return
 
-        gif_file = "animation.gif"
-        self.frames[0].save(
-            gif_file,
-            save_all=True,
-            append_images=self.frames[1:],
-            duration=100,
-            loop=0
-        )
-        messagebox.showinfo("Export", f"Animation saved as {gif_file}")
+        path = asksaveasfilename(defaultextension=".gif", initialfile="animation.gif",
+                                 filetypes=[("Animated GIF", "*.gif"), ("Animated PNG", "*.png *.apng"),
+                                            ("Animated WebP", "*.webp")])
+        if not path:
+            return
+        if self.export_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.export_pool = ProcessPoolExecutor(max_workers=1)
+        # The worker only needs the frames; they are read-only, so the editor can carry on meanwhile
+        project = Project(Document(self.document.width, self.document.height), list(self.frames),
+                          durations=list(self.frames.durations))
+        fmt = ANIMATION_FORMATS.get(path[path.rfind('.'):].lower(), "GIF")
+        job = self.export_pool.submit(export_animation, project, path, self.PIXEL_SIZE, None, fmt)
+        self.var_status.set(f"Exporting {path}...")
+        self.root.after(100, self.finish_export, job, path)
+
+    def export_atlas(self):
+        """Pack the frames and layers into a sprite atlas with JSON and Godot metadata."""
+        path = asksaveasfilename(defaultextension=".png", initialfile="sprite_atlas.png",
+                                 filetypes=[("PNG image", "*.png")])
+        if path:
+            written = export_atlas(self.current_project(), path, layers=True, godot=True)
+            messagebox.showinfo("Export Atlas", "Saved " + ", ".join(written))
+
+    def finish_export(self, job, path):
+        """Report an animation export once the worker is done with it."""
+        if not job.done():
+            self.root.after(100, self.finish_export, job, path)
+            return
+        error = job.exception()
+        if error is not None:
+            messagebox.showerror("Export", f"Could not export {path}: {error}")
+        else:
+            self.var_status.set(f"Animation saved as {path}")
+
+
 
+def measure_startup():
+    """Print how long imports, building the window and its first draw take, as JSON."""
+    app = Paint(autosave=False)
+    built = time.perf_counter()
+    app.root.update()  # Map the window and run the pending first draw
+    shown = time.perf_counter()
+    app.root.destroy()
+    print(json.dumps({
+        "imports_ms": round((IMPORTED - STARTED) * 1000, 1),
+        "build_window_ms": round((built - IMPORTED) * 1000, 1),
+        "first_draw_ms": round((shown - built) * 1000, 1),
+        "total_ms": round((shown - STARTED) * 1000, 1),
+    }))
 
 
 if __name__ == '__main__':
-    Paint()
\ No newline at end of file
+    if '--startup-time' in sys.argv[1:]:
+        measure_startup()
+    else:
+        # --profile times handlers and rendering; F12 saves a trace and the summary prints on exit
+        Paint(profile='--profile' in sys.argv[1:]).run()
\ No newline at end of file
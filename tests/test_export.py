@@ -0,0 +1,34 @@
+"""Animations whose frames were saved at different grid sizes."""
+import numpy as np
+import pytest
+
+from godraw import Document, Project
+from godraw.export import export_animation, sheet_pixels
+
+
+def mixed_frames():
+    small = np.zeros((16, 16, 4), np.uint8)
+    small[2:6, 2:6] = (255, 0, 0, 255)
+    large = np.zeros((32, 32, 4), np.uint8)
+    large[20:30, 20:30] = (0, 0, 255, 255)
+    return [small, large, small]
+
+
+@pytest.mark.parametrize("suffix", [".gif", ".apng", ".webp"])
+def test_mixed_size_frames_export_on_one_canvas(tmp_path, suffix):
+    from PIL import Image, ImageSequence
+    path = str(tmp_path / ("walk" + suffix))
+    export_animation(Project(Document(32, 32), mixed_frames(), durations=[50, 60, 70]), path)
+    with Image.open(path) as image:
+        frames = [np.asarray(frame.convert("RGBA")) for frame in ImageSequence.Iterator(image)]
+    assert image.size == (32, 32)
+    assert len(frames) == 3
+    assert tuple(frames[0][3, 3]) == (255, 0, 0, 255)
+    assert tuple(frames[0][25, 25]) != (0, 0, 255, 255)
+    assert tuple(frames[1][25, 25]) == (0, 0, 255, 255)
+
+
+def test_mixed_size_frames_share_one_sheet_cell_size():
+    sheet = sheet_pixels(mixed_frames(), columns=3)
+    assert sheet.shape == (32, 96, 4)
+    assert tuple(sheet[25, 57]) == (0, 0, 255, 255)